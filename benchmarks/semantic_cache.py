@@ -0,0 +1,93 @@
+"""
+语义查询缓存压测：对每组问题先问原问题，再问改写或无关的问题，
+统计不同相似度阈值下的命中率、误命中率（无关问题命中缓存）和命中/未命中的查询耗时。
+
+    python -m benchmarks.semantic_cache --path ./workdir --mode naive --thresholds 0.9 0.95
+    python -m benchmarks.semantic_cache --path ./workdir --pairs pairs.jsonl --stub
+
+--path 为已解析过文档的工作目录，每组问题开始前会清空该模式的查询缓存。
+--pairs 每行一个 {"q1": ..., "q2": ..., "same": true/false}，不指定时用内置的问题组。
+--stub 使用本地桩服务，向量是随机的，只用来检查流程。
+--llm-check 让LLM复核语义命中（默认不复核，测的是阈值本身的误命中率）。
+"""
+import json
+import time
+import argparse
+
+from lightrag import QueryParam
+
+from bluegraph import api, stub_server, worker
+from bluegraph.rag import main as rag_init
+
+PAIRS = [
+    ('王超杰是谁？', '请介绍一下王超杰。', True),
+    ('王超杰在哪里工作？', '王超杰的工作地点是哪里？', True),
+    ('文档里提到了哪些公司？', '文档中出现了哪些公司？', True),
+    ('这个项目的目标是什么？', '该项目想要达成什么目标？', True),
+    ('王超杰是谁？', '王超杰在哪里工作？', False),
+    ('文档里提到了哪些公司？', '文档里提到了哪些人？', False),
+    ('这个项目的目标是什么？', '这个项目什么时候开始？', False),
+]
+
+
+def _load_pairs(path):
+    with open(path, encoding='utf-8') as f:
+        return [(p['q1'], p['q2'], bool(p['same'])) for p in map(json.loads, f) if p]
+
+
+def _ask(rag, question, mode):
+    """返回（是否命中缓存，耗时）"""
+    before = rag.query_cache_metrics()
+    start = time.perf_counter()
+    worker.run(rag.aquery(question, param=QueryParam(mode=mode)))
+    elapsed = time.perf_counter() - start
+    after = rag.query_cache_metrics()
+    hits = lambda m: m['exact_hits'] + m['semantic_hits']
+    return hits(after) > hits(before), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', required=True)
+    parser.add_argument('--mode', default='naive', choices=['naive', 'local', 'global', 'hybrid', 'mix'])
+    parser.add_argument('--pairs', default=None)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.9, 0.95])
+    parser.add_argument('--stub', action='store_true')
+    parser.add_argument('--llm-check', action='store_true')
+    args = parser.parse_args()
+
+    if args.stub:
+        server = stub_server.start(latency=0.5)
+        api.BASE_URL = 'http://{}:{}'.format(*server.server_address)
+    pairs = _load_pairs(args.pairs) if args.pairs else PAIRS
+    rag = rag_init(args.path)
+    config = rag.llm_response_cache.global_config['embedding_cache_config']
+    config['enabled'] = True
+    config['use_llm_check'] = args.llm_check
+
+    print(f'{len(pairs)} 组问题（改写 {sum(p[2] for p in pairs)} 组），mode={args.mode}')
+    print(f'{"threshold":>10} {"hit rate":>10} {"false hits":>11} {"hit ms":>10} {"miss ms":>10}')
+    for threshold in args.thresholds:
+        config['similarity_threshold'] = threshold
+        true_hits = false_hits = 0
+        hit_times, miss_times = [], []
+        for q1, q2, same in pairs:
+            # 每组单独计，避免命中前面组里问过的问题
+            worker.run(rag.aclear_cache([args.mode]))
+            _ask(rag, q1, args.mode)
+            hit, elapsed = _ask(rag, q2, args.mode)
+            (hit_times if hit else miss_times).append(elapsed)
+            true_hits += hit and same
+            false_hits += hit and not same
+        n_same = sum(p[2] for p in pairs) or 1
+        n_diff = (len(pairs) - sum(p[2] for p in pairs)) or 1
+        avg = lambda xs: sum(xs) / len(xs) * 1000 if xs else 0.0
+        print(
+            f'{threshold:>10.3f} {true_hits / n_same:>10.0%} {false_hits / n_diff:>11.0%}'
+            f' {avg(hit_times):>10.1f} {avg(miss_times):>10.1f}'
+        )
+    print(json.dumps(rag.query_cache_metrics(), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
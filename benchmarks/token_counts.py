@@ -0,0 +1,80 @@
+"""
+上下文截断压测：模拟一次查询的上下文组装（实体、关系描述和文本块各截断一次），比较
+每次重新分词、记忆化计数（Tokenizer.count_tokens）和写入时存储的token数三种方式的耗时。
+
+    python -m benchmarks.token_counts --entities 60 --relations 60 --chunks 20 --queries 50
+"""
+import time
+import random
+import argparse
+
+from lightrag.utils import TiktokenTokenizer, truncate_list_by_token_size
+
+WORDS = ['知识图谱', '实体', '关系', '抽取', '文档', 'graph', 'entity', 'relation', 'chunk', 'token']
+
+
+def _text(n_words):
+    return ' '.join(random.choice(WORDS) for _ in range(n_words))
+
+
+def _encode_all(list_data, key, max_token_size, tokenizer):
+    # 改动前的实现：每项都重新分词
+    tokens = 0
+    for i, data in enumerate(list_data):
+        tokens += len(tokenizer.encode(key(data)))
+        if tokens > max_token_size:
+            return list_data[:i]
+    return list_data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entities', type=int, default=60)
+    parser.add_argument('--relations', type=int, default=60)
+    parser.add_argument('--chunks', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--model', default='gpt-4o-mini')
+    args = parser.parse_args()
+
+    random.seed(0)
+    tokenizer = TiktokenTokenizer(args.model)
+    nodes = [{'description': _text(random.randint(50, 400))} for _ in range(args.entities)]
+    edges = [{'description': _text(random.randint(30, 200))} for _ in range(args.relations)]
+    chunks = [{'data': {'content': _text(900)}} for _ in range(args.chunks)]
+    for item in nodes + edges:
+        item['description_tokens'] = len(tokenizer.encode(item['description']))
+    for item in chunks:
+        item['data']['tokens'] = len(tokenizer.encode(item['data']['content']))
+    # 上限取很大，保证每项都要计数
+    limit = 10 ** 9
+
+    def encode_all():
+        _encode_all(nodes, lambda x: x['description'], limit, tokenizer)
+        _encode_all(edges, lambda x: x['description'], limit, tokenizer)
+        _encode_all(chunks, lambda x: x['data']['content'], limit, tokenizer)
+
+    def memoized():
+        truncate_list_by_token_size(nodes, lambda x: x['description'], limit, tokenizer)
+        truncate_list_by_token_size(edges, lambda x: x['description'], limit, tokenizer)
+        truncate_list_by_token_size(chunks, lambda x: x['data']['content'], limit, tokenizer)
+
+    def stored():
+        truncate_list_by_token_size(
+            nodes, lambda x: x['description'], limit, tokenizer, count=lambda x: x['description_tokens'])
+        truncate_list_by_token_size(
+            edges, lambda x: x['description'], limit, tokenizer, count=lambda x: x['description_tokens'])
+        truncate_list_by_token_size(
+            chunks, lambda x: x['data']['content'], limit, tokenizer, count=lambda x: x['data']['tokens'])
+
+    print(f'实体 {args.entities}，关系 {args.relations}，文本块 {args.chunks}，查询 {args.queries} 次')
+    print(f'{"case":<12} {"ms/query":>10}')
+    for name, run in [('重新分词', encode_all), ('记忆化计数', memoized), ('存储的token数', stored)]:
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            run()
+        elapsed = time.perf_counter() - start
+        print(f'{name:<12} {elapsed / args.queries * 1000:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
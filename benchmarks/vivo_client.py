@@ -0,0 +1,41 @@
+"""
+vivo客户端并发压测：对本地桩服务发起N次“分块抽取”请求，统计不同并发下的 chunks/s。
+
+    python -m benchmarks.vivo_client --chunks 64 --latency 0.5 --concurrency 1 2 4 8 16
+"""
+import time
+import asyncio
+import argparse
+
+from bluegraph import api, stub_server
+
+
+async def _run(n_chunks):
+    tasks = [api.sync_vivogpt(f'chunk {i} ' * 50) for i in range(n_chunks)]
+    await asyncio.gather(*tasks)
+    await api.close_client()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    server = stub_server.start(latency=args.latency)
+    api.BASE_URL = 'http://{}:{}'.format(*server.server_address)
+    print(f'stub: {api.BASE_URL}, latency={args.latency}s, chunks={args.chunks}')
+    print(f'{"concurrency":>12} {"seconds":>10} {"chunks/s":>10} {"max in flight":>14}')
+    for c in args.concurrency:
+        api.LLM_MAX_CONCURRENCY = c
+        server.max_in_flight = 0
+        start = time.perf_counter()
+        asyncio.run(_run(args.chunks))
+        elapsed = time.perf_counter() - start
+        print(f'{c:>12} {elapsed:>10.2f} {args.chunks / elapsed:>10.2f} {server.max_in_flight:>14}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,77 @@
 import streamlit as st
 import os
 import time  # 引入 time 模块
+import itertools
 from lightrag import QueryParam
 
 # 你的其他模块导入
 from .rag import main as rag_init
+from . import worker
 from .graph_viz import view as graph_viz
 from .obj_viz import func as obj_viz
 from .data_viz import func as data_viz
-from .muti_input import extract_text_from_pdf, extract_text_from_docx
+from .muti_input import extract_texts
+
+
+STAGE_NAMES = {'chunk': '分块', 'embed': '向量化', 'extract': '抽取', 'merge': '合并', 'persist': '保存'}
+
+
+def format_stage_metrics(stage_metrics: dict) -> str:
+    """每个阶段显示：已完成文档数、排队数、分块吞吐"""
+    return ' | '.join(
+        f"{STAGE_NAMES.get(name, name)} {m['items']}篇 排队{m['queued']} {m['units_per_s']:.1f}块/秒"
+        for name, m in stage_metrics.items()
+    )
+
+
+@st.fragment(run_every=0.5)
+def show_ingest_progress(path):
+    """
+    每0.5秒只重跑这个片段，读取后台解析任务的进度后立即返回，其他标签页照常可用。
+    任务结束后检查一次图谱文件，把结果记到 session_state 并整页重跑，让各标签页看到新图谱。
+    """
+    job = st.session_state.ingest_job
+    if job is None:
+        return
+    if not job.done():
+        p = worker.progress()
+        st.progress(
+            p['fraction'],
+            text=f"文档 {p['cur_batch']}/{p['docs']}，分块 {p['cur_chunk']}/{p['chunks']}",
+        )
+        st.caption(p['latest_message'][:200])
+        if p['stage_metrics']:
+            st.caption(format_stage_metrics(p['stage_metrics']))
+        return
+
+    st.session_state.ingest_job = None
+    st.session_state.ingest_result = finish_ingest(job, path)
+    st.rerun()
+
+
+def finish_ingest(job, path):
+    """解析任务结束后检查图谱文件，返回要显示的 [(类型, 内容), ...]"""
+    if job.exception() is not None:
+        return [('error', "处理文件时发生错误！"), ('exception', job.exception())]
+
+    graph_file_path = os.path.join(path, "graph_chunk_entity_relation.graphml")
+    if os.path.exists(graph_file_path):
+        st.session_state.graph_generated = True
+        return [('success', "✅ 文件已成功找到！图谱生成完毕。")]
+    result = [('error', "❌ 解析结束，但图谱文件未找到！")]
+    # 顺便看一下目录里到底有什么
+    if os.path.exists(path):
+        files_in_dir = os.listdir(path)
+        result.append(('warning', f"当前 `{path}` 目录内容: `{files_in_dir}`"))
+    else:
+        result.append(('error', f"严重错误：工作目录 `{path}` 本身都消失了！"))
+    return result
+
+
+def show_ingest_result():
+    for kind, content in st.session_state.ingest_result or []:
+        getattr(st, kind)(content)
 
-from io import BytesIO
 
 # --- 核心 main 函数 ---
 def main():
@@ -24,6 +85,10 @@ def main():
         st.session_state.project_path = None
     if 'graph_generated' not in st.session_state:
         st.session_state.graph_generated = False
+    if 'ingest_job' not in st.session_state:
+        st.session_state.ingest_job = None
+    if 'ingest_result' not in st.session_state:
+        st.session_state.ingest_result = None
 
     # --- 步骤 1: 创建项目工作目录 ---
     if not st.session_state.rag_instance:
@@ -54,69 +119,57 @@ def main():
         )
 
         with insert_tab:
-            st.header("步骤 2: 上传并解析单个文档")
+            st.header("步骤 2: 上传并解析文档")
             
-            uploaded_file = st.file_uploader(
-                "请选择一个文件进行解析", 
-                type=['txt', 'md', 'pdf', 'docx']
+            uploaded_files = st.file_uploader(
+                "请选择一个或多个文件进行解析", 
+                type=['txt', 'md', 'pdf', 'docx'],
+                accept_multiple_files=True,
             )
 
-            if uploaded_file is not None:
-                st.write(f"已选择文件: `{uploaded_file.name}`")
+            if uploaded_files:
+                st.write(f"已选择 {len(uploaded_files)} 个文件")
                 
-                if st.button("开始解析此文件", type="primary"):
-                    content = ""
+                if st.button(f"开始解析这 {len(uploaded_files)} 个文件", type="primary"):
                     try:
-                        file_type = uploaded_file.name.split('.')[-1].lower()
-                        
-                        with st.spinner(f"正在从 {file_type} 文件中提取文本..."):
-                            if file_type == 'pdf':
-                                content = extract_text_from_pdf(BytesIO(uploaded_file.getvalue()))
-                            elif file_type == 'docx':
-                                content = extract_text_from_docx(BytesIO(uploaded_file.getvalue()))
-                            else:
-                                content = uploaded_file.getvalue().decode("utf-8")
-                        
-                        st.success("文本提取成功！")
-
-                        with st.spinner("正在处理文本并构建知识图谱... "):
-                            # 1. 调用 insert
-                            rag.insert(content)
-
-                            # 2. 强制等待
-                            wait_time = 10  # 让我们等待10秒，给足后台时间
-                            
-                            progress_bar = st.progress(0)
-                            for i in range(wait_time):
-                                time.sleep(1)
-                                progress_bar.progress((i + 1) / wait_time)
-
-                            # 3. 检查文件是否存在
-                            graph_file_path = os.path.join(path, "graph_chunk_entity_relation.graphml")
-                            
-                            st.info(f"5. 正在检查文件是否存在于: `{graph_file_path}`")
-                            if os.path.exists(graph_file_path):
-                                st.success("✅ 文件已成功找到！图谱生成完毕。")
-                                st.session_state.graph_generated = True
+                        with st.spinner(f"正在并行提取 {len(uploaded_files)} 个文件的文本..."):
+                            results = extract_texts(
+                                [(f.name, f.getvalue()) for f in uploaded_files]
+                            )
+
+                        contents, file_paths = [], []
+                        for name, content, error in results:
+                            if error is not None:
+                                st.warning(f"`{name}` 提取失败：{error}")
+                            elif content.strip():
+                                contents.append(content)
+                                file_paths.append(name)
                             else:
-                                st.error("❌ 等待后，文件依然未找到！")
-                                # 顺便看一下目录里到底有什么
-                                if os.path.exists(path):
-                                    files_in_dir = os.listdir(path)
-                                    st.warning(f"当前 `{path}` 目录内容: `{files_in_dir}`")
-                                else:
-                                    st.error(f"严重错误：工作目录 `{path}` 本身都消失了！")
+                                st.warning(f"`{name}` 中没有提取到文本")
+
+                        if contents:
+                            st.success(f"已提取 {len(contents)} 个文件的文本！")
+                            # 一次入队，由同一次流水线按 max_parallel_insert 并行解析
+                            st.session_state.ingest_job = worker.ingest(
+                                rag, contents, file_paths=file_paths
+                            )
+                            st.session_state.ingest_result = None
                         
                     except Exception as e:
                         st.error(f"处理文件时发生错误！")
                         st.exception(e)
 
+            if st.session_state.ingest_job is not None:
+                show_ingest_progress(path)
+            else:
+                show_ingest_result()
+
 
         with graph_tab:
             if not st.session_state.graph_generated:
                 st.info("请先在 '解析文本' 标签页中上传并解析一个文件。")
             else:
-                graph_viz(path)
+                graph_viz(path, rag)
         
         with query_tab:
             if not st.session_state.graph_generated:
@@ -126,9 +179,19 @@ def main():
                 prompt = st.text_input('输入任何问题', placeholder="例如：王超杰是谁？")
                 if st.button('查询'):
                     if prompt:
+                        # 回答边生成边显示，spinner 只覆盖到第一段输出
+                        answer = worker.stream(
+                            rag.aquery(prompt, param=QueryParam(mode="naive", stream=True))
+                        )
                         with st.spinner("正在思考..."):
-                            answer = rag.query(prompt, param=QueryParam(mode="naive"))
-                            st.markdown(answer)
+                            first = next(answer, '')
+                        st.write_stream(itertools.chain([first], answer))
+                        metrics = rag.query_cache_metrics()
+                        st.caption(
+                            f"缓存命中率 {metrics['hit_rate']:.0%}"
+                            f"（语义命中 {metrics['semantic_hits']} / 查询 {metrics['lookups']}），"
+                            f"平均查找 {metrics['avg_lookup_ms']}ms"
+                        )
                     else:
                         st.warning("请输入您的问题。")
         with obj_tab:
@@ -141,7 +204,7 @@ def main():
             if not st.session_state.graph_generated:
                 st.info("请先在 '解析文本' 标签页中生成图谱。")
             else:
-                data_viz(path)
+                data_viz(path, rag)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,5 +1,10 @@
+import os
+import json
 import uuid
-import requests
+import asyncio
+import weakref
+
+import httpx
 from .auth_util import gen_sign_headers
 
 from tenacity import (
@@ -7,12 +12,14 @@ from tenacity import (
     stop_after_attempt,
     wait_exponential,
     retry_if_exception_type,
+    retry_if_not_exception_type,
 )
 from lightrag.exceptions import (
     APIConnectionError,
     RateLimitError,
     APITimeoutError,
 )
+from lightrag.utils import logger
 
 # 请替换APP_ID、APP_KEY
 APP_ID = '2025371607'
@@ -20,24 +27,212 @@ APP_KEY = 'jxDGEJyDHTHwVFyZ'
 DOMAIN = 'api-ai.vivo.com.cn'
 METHOD = 'POST'
 
+# 可通过环境变量指向本地桩服务（见 bluegraph/stub_server.py）
+BASE_URL = os.getenv('VIVO_BASE_URL', 'https://{}'.format(DOMAIN))
+
+LLM_URI = '/vivogpt/completions'
+LLM_STREAM_URI = '/vivogpt/completions/stream'
+EMBEDDING_URI = '/embedding-model-api/predict/batch'
+
+# 每个接口同时在途的请求上限
+LLM_MAX_CONCURRENCY = int(os.getenv('VIVO_LLM_MAX_CONCURRENCY', 8))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv('VIVO_EMBEDDING_MAX_CONCURRENCY', 4))
+
+# 连接池与超时（秒）
+MAX_CONNECTIONS = int(os.getenv('VIVO_MAX_CONNECTIONS', 32))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('VIVO_MAX_KEEPALIVE_CONNECTIONS', 16))
+CONNECT_TIMEOUT = float(os.getenv('VIVO_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.getenv('VIVO_READ_TIMEOUT', 120))
+POOL_TIMEOUT = float(os.getenv('VIVO_POOL_TIMEOUT', 60))
+
+
 class VivoError(Exception):
     """莫名其妙的错误？？"""
 
+
+class VivoRateLimitError(VivoError):
+    """接口返回429，被限流"""
+
+
+class VivoTimeoutError(VivoError):
+    """连接或读取超时"""
+
+
+class VivoConnectionError(VivoError):
+    """网络连接失败"""
+
+
+class VivoBusinessError(VivoError):
+    """HTTP 200 但业务码不为0（内容审核、参数错误等），重试也不会成功"""
+
+
+# AsyncClient 与 Semaphore 都绑定在创建它们的事件循环上，
+# 不同事件循环（如多次 asyncio.run）之间不能共用，所以按循环分别缓存
+_clients = weakref.WeakKeyDictionary()
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _get_client() -> httpx.AsyncClient:
+    """获取当前事件循环共享的连接池客户端"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=BASE_URL,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(
+                READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT
+            ),
+        )
+        _clients[loop] = client
+    return client
+
+
+def _get_semaphore(uri: str) -> asyncio.Semaphore:
+    """获取当前事件循环中某个接口的并发信号量"""
+    loop = asyncio.get_running_loop()
+    semaphores = _semaphores.setdefault(loop, {})
+    if uri not in semaphores:
+        limit = LLM_MAX_CONCURRENCY if uri == LLM_URI else EMBEDDING_MAX_CONCURRENCY
+        semaphores[uri] = asyncio.Semaphore(limit)
+    return semaphores[uri]
+
+
+async def close_client() -> None:
+    """关闭当前事件循环的连接池，并发限制会在下次请求时按当前配置重建"""
+    loop = asyncio.get_running_loop()
+    _semaphores.pop(loop, None)
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _post(uri, json_data, params=None) -> httpx.Response:
+    """签名并通过共享连接池发送请求，网络错误统一转换为VivoError的子类"""
+    params = params or {}
+    headers = gen_sign_headers(APP_ID, APP_KEY, METHOD, uri, params)
+    headers['Content-Type'] = 'application/json'
+    async with _get_semaphore(uri):
+        try:
+            response = await _get_client().post(
+                uri, json=json_data, headers=headers, params=params
+            )
+        except httpx.TimeoutException as e:
+            raise VivoTimeoutError(f'{uri}: {e!r}') from e
+        except httpx.TransportError as e:
+            raise VivoConnectionError(f'{uri}: {e!r}') from e
+    if response.status_code == 429:
+        raise VivoRateLimitError(f'{uri}: {response.text}')
+    return response
+
+
+async def _post_stream(uri, json_data, params=None) -> '_SSEStream':
+    """
+    签名并发送流式请求，收到响应头即返回 _SSEStream，响应体由调用方逐段读取。
+    并发信号量与LLM_URI共用，一直占用到流读完、出错或被关闭，流式回答同样受LLM_MAX_CONCURRENCY限制。
+    """
+    params = params or {}
+    headers = gen_sign_headers(APP_ID, APP_KEY, METHOD, uri, params)
+    headers['Content-Type'] = 'application/json'
+    client = _get_client()
+    semaphore = _get_semaphore(LLM_URI)
+    await semaphore.acquire()
+    try:
+        try:
+            request = client.build_request(
+                METHOD, uri, json=json_data, headers=headers, params=params
+            )
+            response = await client.send(request, stream=True)
+        except httpx.TimeoutException as e:
+            raise VivoTimeoutError(f'{uri}: {e!r}') from e
+        except httpx.TransportError as e:
+            raise VivoConnectionError(f'{uri}: {e!r}') from e
+        if response.status_code != 200:
+            body = await response.aread()
+            await response.aclose()
+            if response.status_code == 429:
+                raise VivoRateLimitError(f'{uri}: {body!r}')
+            raise VivoError(f'{uri}: HTTP {response.status_code}')
+    except BaseException:
+        semaphore.release()
+        raise
+    return _SSEStream(response, semaphore)
+
+
+class _SSEStream:
+    """
+    按SSE逐段产出回答，event:close 结束，event:error 抛出VivoError。
+    读完、出错或 aclose 时关闭连接并释放并发名额；用类而不是异步生成器，
+    是因为还没开始读就被丢弃的生成器不会执行 finally，名额会一直占着。
+    """
+
+    def __init__(self, response: httpx.Response, semaphore: asyncio.Semaphore):
+        self._response = response
+        self._semaphore = semaphore
+        self._lines = response.aiter_lines()
+        self._event = None
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            while True:
+                line = await self._lines.__anext__()
+                if line.startswith('event:'):
+                    self._event = line[len('event:'):].strip()
+                    if self._event == 'close':
+                        raise StopAsyncIteration
+                elif line.startswith('data:'):
+                    payload = line[len('data:'):].strip()
+                    if self._event == 'error':
+                        raise VivoError(f'{LLM_STREAM_URI}: {payload}')
+                    try:
+                        message = json.loads(payload).get('message')
+                    except (ValueError, AttributeError):
+                        continue
+                    if message:
+                        return message
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._response.aclose()
+        finally:
+            self._semaphore.release()
+
+    def __del__(self):
+        # 没有关闭就被回收（调用方既没读完也没 aclose），连接随响应对象回收，名额在这里归还
+        if not self._closed:
+            self._closed = True
+            self._semaphore.release()
+
+
 @retry(
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=1, min=4, max=10),
     retry=retry_if_exception_type(
         (RateLimitError, APIConnectionError, APITimeoutError, VivoError)
-    ),
+    )
+    # 429由LightRAG的限流器统一退避重试，这里重试只会加剧拥塞；业务错误重试也不会成功
+    & retry_if_not_exception_type((VivoRateLimitError, VivoBusinessError)),
 )
 async def sync_vivogpt(prompt, system_prompt=None, history_messages=[], **kwargs):
-    print('Call VivoGPT')
+    logger.debug('Call VivoGPT')
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
-    URI = '/vivogpt/completions'
     params = {
         'requestId': str(uuid.uuid4())
     }
@@ -51,43 +246,43 @@ async def sync_vivogpt(prompt, system_prompt=None, history_messages=[], **kwargs
             'max_new_tokens': 5000,
         },
     }
-    headers = gen_sign_headers(APP_ID, APP_KEY, METHOD, URI, params)
-    headers['Content-Type'] = 'application/json'
-
-    url = 'https://{}{}'.format(DOMAIN, URI)
-    response = requests.post(url, json=data, headers=headers, params=params)
+    if kwargs.get('stream'):
+        # 建立连接失败会被重试，开始输出后的错误在读取时抛出
+        return await _post_stream(LLM_STREAM_URI, data, params)
+    response = await _post(LLM_URI, data, params)
 
     if response.status_code == 200:
         res_obj = response.json()
-        print(f'response:{res_obj}')
+        logger.debug(f'response:{res_obj}')
         if res_obj['code'] == 0 and res_obj.get('data'):
             content = res_obj['data']['content']
-            print(f'final content:\n{content}')
             return content
+        # HTTP 200 但业务失败（如内容审核、参数错误），返回None会被当成空回答写进缓存
+        logger.error(f'{LLM_URI} {BASE_URL}: code {res_obj.get("code")}, {res_obj.get("msg")}')
+        raise VivoBusinessError(f'{LLM_URI}: code {res_obj.get("code")}, {res_obj.get("msg")}')
     else:
-        print(messages, URI, DOMAIN)
-        print(response.status_code, response.content)
-        raise VivoError()
+        logger.error(f'{LLM_URI} {BASE_URL}: HTTP {response.status_code}, {response.content!r}')
+        raise VivoError(f'{LLM_URI}: HTTP {response.status_code}')
+
 
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(multiplier=1, min=4, max=10),
+    retry=retry_if_exception_type((VivoTimeoutError, VivoConnectionError)),
+)
 async def embedding(texts):
-    URI = '/embedding-model-api/predict/batch'
-    params = {}
     post_data = {
         "model_name": "m3e-base",
         "sentences": texts
     }
-    headers = gen_sign_headers(APP_ID, APP_KEY, METHOD, URI, params)
-
-    url = 'https://{}{}'.format(DOMAIN, URI)
-    response = requests.post(url, json=post_data, headers=headers)
+    response = await _post(EMBEDDING_URI, post_data)
     if response.status_code == 200:
         return response.json()['data']
     else:
-        print(URI, DOMAIN, texts)
-        print(response.status_code, response.text)
-        exit()
+        logger.error(f'{EMBEDDING_URI} {BASE_URL}: {len(texts)} texts, HTTP {response.status_code}, {response.text}')
+        raise VivoError(f'{EMBEDDING_URI}: HTTP {response.status_code}')
 
 if __name__ == '__main__':
-    import asyncio
     #asyncio.run(sync_vivogpt('你好？'))
-    #asyncio.run(embedding(['123456']))
\ No newline at end of file
+    #asyncio.run(embedding(['123456']))
+    pass
@@ -1,25 +1,62 @@
 import streamlit as st
-import json
 import os
 
-def func(path: str) -> None:
+from lightrag.base import DocStatus
+from lightrag.kg.json_doc_status_impl import JsonDocStatusStorage
+from lightrag.kg.shared_storage import initialize_share_data
+from bluegraph import worker
+
+PAGE_SIZE = 50
+
+
+@st.cache_resource
+def open_doc_status(path: str) -> JsonDocStatusStorage:
+    """
+    单独运行本页面时没有LightRAG实例，直接打开文档状态存储
+    """
+    initialize_share_data()
+    storage = JsonDocStatusStorage(
+        namespace='doc_status', global_config={'working_dir': path}, embedding_func=None
+    )
+    worker.run(storage.initialize())
+    return storage
+
+
+def func(path: str, rag=None) -> None:
     """
     path: 项目文件根目录
-    调用后，显示kv_store_doc_status.json的内容为可视化列表。
+    rag: LightRAG实例，为None时直接读取path下的文档状态
+    调用后，分页显示文档状态列表，完整内容按需加载。
     """
-    json_path = os.path.join(path, 'kv_store_doc_status.json')
-    if not os.path.exists(json_path):
-        st.error(f"未找到文件: {json_path}")
-        return
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    st.write(f"共 {len(data)} 个文档")
-    search = st.text_input('搜索文档ID或内容摘要')
-    filtered = []
-    for doc_id, info in data.items():
-        if not search or search in doc_id or search in info.get('content_summary', ''):
-            filtered.append((doc_id, info))
-    for doc_id, info in filtered:
+    if rag is not None:
+        doc_status = rag.doc_status
+    else:
+        json_path = os.path.join(path, 'kv_store_doc_status.json')
+        if not os.path.exists(json_path):
+            st.error(f"未找到文件: {json_path}")
+            return
+        doc_status = open_doc_status(path)
+
+    counts = worker.run(doc_status.get_status_counts())
+    st.write(f"共 {sum(counts.values())} 个文档：" + "，".join(f"{k} {v}" for k, v in counts.items()))
+
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        search = st.text_input('搜索文档ID、文件路径或内容摘要')
+    with col2:
+        status = st.selectbox('状态', ['全部'] + [s.value for s in DocStatus])
+    status = None if status == '全部' else DocStatus(status)
+
+    # 总数随查询一起返回，先按上次的页码查询，越界时回到最后一页
+    page = st.session_state.get('doc_page', 1)
+    total, docs = worker.run(doc_status.get_docs_paginated(status, search, (page - 1) * PAGE_SIZE, PAGE_SIZE))
+    pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+    if page > pages:
+        st.session_state['doc_page'] = page = pages
+        total, docs = worker.run(doc_status.get_docs_paginated(status, search, (page - 1) * PAGE_SIZE, PAGE_SIZE))
+    st.number_input(f"页码（共 {pages} 页，{total} 条）", min_value=1, max_value=pages, key='doc_page')
+
+    for doc_id, info in docs:
         with st.expander(f"文档ID: {doc_id}"):
             st.write(f"**状态**: {info.get('status', '')}")
             st.write(f"**分块数**: {info.get('chunks_count', '')}")
@@ -28,7 +65,11 @@ def func(path: str) -> None:
             st.write(f"**创建时间**: {info.get('created_at', '')}")
             st.write(f"**更新时间**: {info.get('updated_at', '')}")
             st.write(f"**文件路径**: {info.get('file_path', '')}")
-            st.text_area('完整内容', info.get('content', ''), height=200)
+            if info.get('error'):
+                st.write(f"**错误**: {info['error']}")
+            if st.checkbox('显示完整内容', key=f'doc_content_{doc_id}'):
+                doc = worker.run(doc_status.get_by_id(doc_id)) or {}
+                st.text_area('完整内容', doc.get('content', ''), height=200, key=f'doc_text_{doc_id}')
 
 if __name__ == "__main__":
     st.title('kv_store_doc_status.json 可视化工具')
@@ -39,4 +80,4 @@ if __name__ == "__main__":
         st.session_state['loaded'] = True
         st.session_state['path'] = path
     if st.session_state.get('loaded', False):
-        func(st.session_state.get('path', path))
\ No newline at end of file
+        func(st.session_state.get('path', path))
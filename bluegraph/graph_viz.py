@@ -1,10 +1,18 @@
 import streamlit as st
 import networkx as nx
 import os
+import itertools
 from pyvis.network import Network
+from pyvis.node import Node
+from pyvis.edge import Edge
 import pandas as pd
+import numpy as np
 import json
 
+from lightrag.kg.networkx_impl import MAX_GRAPH_NODES
+from lightrag.utils import logger
+from . import worker
+
 def create_html(net):
     """返回用于嵌入的 HTML 内容"""
     html_content = net.generate_html()
@@ -47,8 +55,8 @@ def edge_tip(data):
     
     return tip
 
-def set_physics_options(net, spring_length=90, central_gravity=0.3):
-    """设置物理引擎选项"""
+def set_physics_options(net, spring_length=90, central_gravity=0.3, stabilize=True):
+    """设置物理引擎选项，stabilize为False时跳过浏览器端的初始稳定迭代"""
     physics_options = {
                     "physics": {
                         "barnesHut": {
@@ -63,7 +71,7 @@ def set_physics_options(net, spring_length=90, central_gravity=0.3):
                         "minVelocity": 0.1,
                         "solver": "barnesHut",
                         "stabilization": {
-                            "enabled": True,
+                            "enabled": stabilize,
                             "iterations": 1000,
                             "updateInterval": 100,
                             "onlyDynamicEdges": False,
@@ -107,51 +115,166 @@ def node_size(G):
         node_sizes[node_id] = node_size
     return node_sizes
 
-def viz_graph(graphml_path, height=800, physics=True):
-    """可视化 .graphml 文件并返回交互式网络"""
-    if os.path.exists(graphml_path):
+def layout_path(graphml_path):
+    """布局文件与图谱文件放在一起"""
+    return os.path.splitext(graphml_path)[0] + '.layout.json'
+
+def _force_layout(G, nodes, iterations=100, negative_samples=5, seed=42):
+    """
+    向量化的力导向布局，用于大图（networkx 的 spring_layout 每次迭代是 O(n²) 的 Python 循环）。
+    以谱布局为初始坐标；斥力只对随机采样的节点对计算，每次迭代 O(边数 + 节点数)。
+    """
+    index = {node_id: i for i, node_id in enumerate(nodes)}
+    n = len(nodes)
+    edges = np.array(
+        [(index[u], index[v]) for u, v in G.edges() if u != v], dtype=np.int64
+    ).reshape(-1, 2)
+    rng = np.random.default_rng(seed)
+    try:
+        # 500个节点以上的谱布局依赖scipy的稀疏特征值分解
+        spectral = nx.spectral_layout(G)
+        pos = np.array([spectral[node_id] for node_id in nodes], dtype=float)
+        pos = (pos - pos.mean(axis=0)) / (pos.std(axis=0) + 1e-9) * np.sqrt(n) / 2
+    except Exception as e:
+        logger.warning(f'谱布局失败（{type(e).__name__}: {e}），改用随机初始坐标，布局收敛会变慢')
+        pos = rng.uniform(-1, 1, (n, 2)) * np.sqrt(n)
+
+    temperature = np.sqrt(n) / 5
+    for _ in range(iterations):
+        disp = np.zeros_like(pos)
+        if len(edges):
+            # 引力 d²，沿边方向
+            delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+            force = delta * np.linalg.norm(delta, axis=1, keepdims=True)
+            np.add.at(disp, edges[:, 0], -force)
+            np.add.at(disp, edges[:, 1], force)
+        for _ in range(negative_samples):
+            # 斥力 1/d，用采样估计对全部节点的合力
+            delta = pos - pos[rng.integers(0, n, n)]
+            dist2 = (delta ** 2).sum(axis=1, keepdims=True) + 1e-9
+            disp += delta / dist2 * (n / negative_samples)
+        length = np.linalg.norm(disp, axis=1, keepdims=True) + 1e-9
+        pos += disp / length * np.minimum(length, temperature)
+        temperature *= 0.95
+    return pos
+
+def compute_layout(G, spring_length=90):
+    """在服务端计算节点坐标，返回 {节点ID: [x, y]}，边长中位数约为spring_length像素"""
+    nodes = list(G.nodes())
+    if not nodes:
+        return {}
+    if len(nodes) <= 500:
+        layout = nx.spring_layout(G, seed=42, iterations=50)
+        pos = np.array([layout[node_id] for node_id in nodes], dtype=float)
+    else:
+        pos = _force_layout(G, nodes)
+
+    # 缩放到vis.js的像素尺度
+    index = {node_id: i for i, node_id in enumerate(nodes)}
+    edge_lengths = [
+        np.linalg.norm(pos[index[u]] - pos[index[v]]) for u, v in G.edges() if u != v
+    ]
+    median = float(np.median(edge_lengths)) if edge_lengths else 0.0
+    scale = spring_length / median if median > 0 else 100 * np.sqrt(len(nodes))
+    pos = pos * scale
+    return {node_id: [float(x), float(y)] for node_id, (x, y) in zip(nodes, pos)}
+
+def load_layout(graphml_path, G, mtime):
+    """读取预计算的布局，图谱文件更新过则重新计算并保存"""
+    path = layout_path(graphml_path)
+    if os.path.exists(path):
         try:
-            G = nx.read_graphml(graphml_path)
-            node_colors = assign_colors(G)
-            node_sizes = node_size(G)
+            with open(path, 'r', encoding='utf-8') as f:
+                layout = json.load(f)
+            if layout.get('mtime') == mtime:
+                return layout['positions']
+        except (OSError, ValueError, KeyError):
+            pass
+    positions = compute_layout(G)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'mtime': mtime, 'positions': positions}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return positions
 
-            # 创建 Pyvis 网络
-            net = Network(height=f"{height}px", width="100%", bgcolor="#3E4149", 
-                        font_color="white", directed=False, 
-                        cdn_resources="in_line")
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_graph(graphml_path, mtime):
+    """按文件修改时间缓存解析后的图，图谱文件不变就不再重新解析"""
+    return nx.read_graphml(graphml_path)
 
-            if physics:
-                net = set_physics_options(net)
-            
-            for node_id in G.nodes():
-                node_data = G.nodes[node_id]
-                size = node_sizes.get(node_id, 10)  # 默认大小为 20
-                color = node_colors.get(node_id, '#00ffff')  # 默认颜色为 #00ffff
-                shape = "dot"
-
-                title = node_tip(node_data)
-                
-                # 添加节点
-                net.add_node(node_id,
-                            size=size,
-                            label=node_id,
-                            title=title, 
-                            shape=shape,
-                            color=color
-                            )
-            
-            # 添加边
-            for source, target, edge_data in G.edges(data=True):
-                weight = float(edge_data.get('weight', 1.0))
-                
-                title = edge_tip(edge_data)
-                width = 1 + (weight / 7)
-                
-                net.add_edge(source, target, title=title, width=width, 
-                            weight=weight)
-            
-            # 生成 HTML
-            html_content = create_html(net)
+@st.cache_data(max_entries=16, show_spinner="正在生成图谱...")
+def render_graph(graphml_path, mtime, height, physics, nodes=None):
+    """
+    按 (文件, 修改时间, 高度, 物理引擎, 节点集合) 缓存生成的 HTML。
+    nodes 为要显示的节点ID元组，None 表示整张图；颜色、大小和坐标都按整张图计算，展开邻居时已有节点不会跳动。
+    """
+    G = load_graph(graphml_path, mtime)
+    positions = load_layout(graphml_path, G, mtime)
+    node_colors = assign_colors(G)
+    node_sizes = node_size(G)
+    if nodes is not None:
+        G = G.subgraph(nodes)
+
+    # 创建 Pyvis 网络
+    net = Network(height=f"{height}px", width="100%", bgcolor="#3E4149", 
+                font_color="white", directed=False, 
+                cdn_resources="in_line")
+
+    if physics:
+        # 已有服务端布局时，浏览器不必再做上千次稳定迭代
+        net = set_physics_options(net, stabilize=not positions)
+    else:
+        net.toggle_physics(False)
+
+    for node_id in G.nodes():
+        node_data = G.nodes[node_id]
+        size = node_sizes.get(node_id, 10)  # 默认大小为 20
+        color = node_colors.get(node_id, '#00ffff')  # 默认颜色为 #00ffff
+        shape = "dot"
+
+        title = node_tip(node_data)
+        extra = {}
+        if node_id in positions:
+            extra['x'], extra['y'] = positions[node_id]
+        
+        # 添加节点
+        # pyvis 的 add_node/add_edge 每次都线性查重，大图上是 O(n²)；
+        # nx.Graph 本身没有重复的节点和边，直接写入 net 的列表
+        node = Node(node_id, shape,
+                    size=size,
+                    label=node_id,
+                    title=title, 
+                    color=color,
+                    font_color=net.font_color,
+                    **extra
+                    )
+        net.nodes.append(node.options)
+        net.node_ids.append(node_id)
+        net.node_map[node_id] = node.options
+    
+    # 添加边
+    for source, target, edge_data in G.edges(data=True):
+        weight = float(edge_data.get('weight', 1.0))
+        
+        title = edge_tip(edge_data)
+        width = 1 + (weight / 7)
+        
+        edge = Edge(source, target, net.directed, title=title, width=width, 
+                    weight=weight)
+        net.edges.append(edge.options)
+    
+    # 生成 HTML
+    return create_html(net)
+
+def viz_graph(graphml_path, height=800, physics=True, nodes=None):
+    """可视化 .graphml 文件并返回交互式网络，nodes 为要显示的节点（默认整张图）"""
+    if os.path.exists(graphml_path):
+        try:
+            mtime = os.path.getmtime(graphml_path)
+            G = load_graph(graphml_path, mtime)
+            if nodes is not None:
+                nodes = tuple(sorted(nodes))
+            html_content = render_graph(graphml_path, mtime, height, physics, nodes)
             return html_content, G
         except Exception as e:
             st.error(f"处理图形时出错: {str(e)}")
@@ -162,32 +285,155 @@ def viz_graph(graphml_path, height=800, physics=True):
         st.error(f"文件 '{graphml_path}' 未找到!")
         return None, None
 
-def view(path):
+def _pagerank(G, alpha=0.85, max_iter=100, tol=1.0e-6):
+    """
+    没装scipy时nx.pagerank不可用，用numpy按边做幂迭代，结果与nx.pagerank一致。
+    无向边按两个方向各算一次，权重取边的weight属性，悬挂节点的分数均分给所有节点。
+    """
+    nodes = list(G.nodes())
+    index = {node_id: i for i, node_id in enumerate(nodes)}
+    n = len(nodes)
+    links = []
+    for u, v, w in G.edges(data='weight', default=1.0):
+        links.append((index[u], index[v], float(w)))
+        if not G.is_directed() and u != v:
+            links.append((index[v], index[u], float(w)))
+    links = np.array(links, dtype=float).reshape(-1, 3)
+    src, dst, weight = links[:, 0].astype(np.int64), links[:, 1].astype(np.int64), links[:, 2]
+    out_weight = np.bincount(src, weights=weight, minlength=n)
+    dangling = out_weight == 0
+    share = weight / np.where(dangling, 1.0, out_weight)[src]
+
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        last = x
+        x = np.bincount(dst, weights=last[src] * share, minlength=n) * alpha
+        x += (alpha * last[dangling].sum() + 1.0 - alpha) / n
+        if np.abs(x - last).sum() < n * tol:
+            break
+    return dict(zip(nodes, x.tolist()))
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def pagerank_scores(graphml_path, mtime):
+    """按文件修改时间缓存的PageRank"""
+    G = load_graph(graphml_path, mtime)
+    if not G.number_of_nodes():
+        return {}
+    try:
+        return nx.pagerank(G)
+    except ImportError:
+        return _pagerank(G)
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def entity_type_counts(graphml_path, mtime):
+    entity_types = {}
+    for node_id, data in load_graph(graphml_path, mtime).nodes(data=True):
+        entity_type = data.get('entity_type', 'unknown')
+        entity_types[entity_type] = entity_types.get(entity_type, 0) + 1
+    return entity_types
+
+def select_nodes(G, graphml_path, mtime, mode, max_nodes, entity=None, depth=2, rag=None):
+    """
+    按细节层级选出要显示的节点：
+    degree - 度数最高的max_nodes个节点；pagerank - PageRank最高的max_nodes个节点；
+    ego - 实体entity在depth跳以内的邻域，同一跳内优先高度数节点。
+    有rag实例时度数和邻域直接用图存储的 get_knowledge_graph。
+    """
+    if mode == 'pagerank':
+        scores = pagerank_scores(graphml_path, mtime)
+        return sorted(scores, key=scores.get, reverse=True)[:max_nodes]
+
+    label = entity if mode == 'ego' else '*'
+    if rag is not None:
+        kg = worker.run(rag.get_knowledge_graph(label, max_depth=depth, max_nodes=max_nodes))
+        return [node.id for node in kg.nodes if node.id in G]
+
+    # 没有rag实例（单独运行本页面）时直接在图上计算
+    if mode == 'ego':
+        if entity not in G:
+            return []
+        ego = nx.ego_graph(G, entity, radius=depth)
+        rest = sorted((n for n in ego if n != entity), key=G.degree, reverse=True)
+        return [entity] + rest[:max_nodes - 1]
+    return [n for n, _ in sorted(G.degree, key=lambda x: x[1], reverse=True)[:max_nodes]]
+
+def paginate(total, key, page_size=50):
+    """分页控件，返回当前页的 [start, end)"""
+    pages = max(1, (total + page_size - 1) // page_size)
+    page = st.number_input(f"页码（共 {pages} 页）", min_value=1, max_value=pages, value=1, key=key)
+    start = (page - 1) * page_size
+    return start, min(start + page_size, total)
+
+def _truncate(description, length=50):
+    # 截断过长的描述
+    if description and len(description) > length:
+        return description[:length] + "..."
+    return description
+
+def view(path, rag=None):
     st.title("交互式阅读图谱")
     
     col1, col2 = st.columns([3, 1])
     
-    with col1:
-        st.header("图谱视图")
-        
-        # 提供默认路径或允许用户上传
-        
-        graphml_path = None
-        G = None
-        
-        graphml_path = os.path.join(path, "graph_chunk_entity_relation.graphml")
-        # 检查路径是否存在
-        if not os.path.exists(graphml_path):
+    graphml_path = os.path.join(path, "graph_chunk_entity_relation.graphml")
+    # 检查路径是否存在
+    if not os.path.exists(graphml_path):
+        with col1:
             st.warning(f"File not found: {graphml_path}")
             st.info("请检查默认路径！")
-            graphml_path = None
-        
-        if graphml_path:
+        return
+    mtime = os.path.getmtime(graphml_path)
+    G = load_graph(graphml_path, mtime)
+
+    with col1:
+        st.header("图谱视图")
+
+        modes = {'度数最高': 'degree', 'PageRank最高': 'pagerank', '实体邻域': 'ego'}
+        c1, c2, c3 = st.columns(3)
+        mode = modes[c1.radio("显示范围", list(modes), horizontal=True)]
+        max_nodes = c2.number_input(
+            "最多显示节点数", min_value=10, max_value=MAX_GRAPH_NODES,
+            value=min(200, MAX_GRAPH_NODES), step=50,
+        )
+        entity, depth = None, 2
+        if mode == 'ego':
+            entity = c3.text_input("实体名", placeholder="输入要查看的实体")
+            depth = c3.slider("邻域深度", min_value=1, max_value=3, value=2)
+
+        # 视图参数变化时清空已展开的节点
+        view_key = (mtime, mode, max_nodes, entity, depth)
+        if st.session_state.get('graph_view_key') != view_key:
+            st.session_state.graph_view_key = view_key
+            st.session_state.graph_expanded = []
+
+        if mode == 'ego' and not entity:
+            st.info("请输入实体名")
+            nodes = []
+        else:
+            nodes = select_nodes(G, graphml_path, mtime, mode, max_nodes, entity, depth, rag)
+            if mode == 'ego' and not nodes:
+                st.warning(f"图中没有实体 `{entity}`")
+
+        # 按需展开邻居
+        shown = set(nodes)
+        for node_id in st.session_state.graph_expanded:
+            if node_id in G:
+                shown.update(G.neighbors(node_id))
+                shown.add(node_id)
+
+        if shown:
+            e1, e2 = st.columns([3, 1])
+            to_expand = e1.selectbox("展开节点的邻居", sorted(shown))
+            if e2.button("展开"):
+                st.session_state.graph_expanded.append(to_expand)
+                shown.update(G.neighbors(to_expand))
+            st.caption(f"显示 {len(shown)} / {G.number_of_nodes()} 个节点")
+
             # 物理引擎参数
             physics_enabled = st.checkbox("启用物理引擎", value=True)
             height = st.slider("图形高度", min_value=400, max_value=1200, value=800, step=100)
             
-            html_content, G = viz_graph(graphml_path, height=height, physics=physics_enabled)
+            html_content, _ = viz_graph(graphml_path, height=height, physics=physics_enabled, nodes=shown)
             
             if html_content:
                 try:
@@ -197,67 +443,51 @@ def view(path):
                     import traceback
                     st.error(traceback.format_exc())
     
-    if G:
-        with col2:
-            st.header("图谱信息")
-            
-            st.subheader("基本信息")
-            st.markdown(f"**节点数量:** {G.number_of_nodes()}")
-            st.markdown(f"**连接数量:** {G.number_of_edges()}")
-            
-            # 展示实体类型统计
-            st.subheader("实体类型分布")
-            entity_types = {}
-            for node_id, data in G.nodes(data=True):
-                entity_type = data.get('entity_type', 'unknown')
-                entity_types[entity_type] = entity_types.get(entity_type, 0) + 1
-
-            # 创建实体类型数据框
-            entity_df = pd.DataFrame({
-                '实体类型': list(entity_types.keys()),
-                '数量': list(entity_types.values())
+    with col2:
+        st.header("图谱信息")
+        
+        st.subheader("基本信息")
+        st.markdown(f"**节点数量:** {G.number_of_nodes()}")
+        st.markdown(f"**连接数量:** {G.number_of_edges()}")
+        
+        # 展示实体类型统计
+        st.subheader("实体类型分布")
+        entity_types = entity_type_counts(graphml_path, mtime)
+
+        # 创建实体类型数据框
+        entity_df = pd.DataFrame({
+            '实体类型': list(entity_types.keys()),
+            '数量': list(entity_types.values())
+        })
+        st.dataframe(entity_df)
+        
+        # 展示节点列表，只构造当前页
+        st.subheader("节点列表")
+        node_ids = list(G.nodes)
+        start, end = paginate(len(node_ids), 'node_page')
+        node_data = []
+        for node_id in node_ids[start:end]:
+            data = G.nodes[node_id]
+            node_data.append({
+                '节点ID': node_id,
+                '类型': data.get('entity_type', '-'),
+                '描述': _truncate(data.get('description', '-'))
             })
-            st.dataframe(entity_df)
-            
-            # 展示节点列表
-            st.subheader("节点列表")
-            node_data = []
-            for node_id, data in G.nodes(data=True):
-                entity_type = data.get('entity_type', '-')
-                description = data.get('description', '-')
-                # 截断过长的描述
-                if description and len(description) > 50:
-                    description = description[:50] + "..."
-                
-                node_data.append({
-                    '节点ID': node_id,
-                    '类型': entity_type,
-                    '描述': description
-                })
-            
-            node_df = pd.DataFrame(node_data)
-            st.dataframe(node_df)
-            
-            # 展示边列表
-            st.subheader("关系列表")
-            edge_data = []
-            for source, target, data in G.edges(data=True):
-                weight = data.get('weight', '-')
-                description = data.get('description', '-')
-                # 截断过长的描述
-                if description and len(description) > 50:
-                    description = description[:50] + "..."
-                
-                edge_data.append({
-                    '源节点': source,
-                    '目标节点': target,
-                    '权重': weight,
-                    '描述': description
-                })
-            
-            edge_df = pd.DataFrame(edge_data)
-            st.dataframe(edge_df)
+        st.dataframe(pd.DataFrame(node_data))
+        
+        # 展示边列表，只构造当前页
+        st.subheader("关系列表")
+        start, end = paginate(G.number_of_edges(), 'edge_page')
+        edge_data = []
+        for source, target, data in itertools.islice(G.edges(data=True), start, end):
+            edge_data.append({
+                '源节点': source,
+                '目标节点': target,
+                '权重': data.get('weight', '-'),
+                '描述': _truncate(data.get('description', '-'))
+            })
+        st.dataframe(pd.DataFrame(edge_data))
 
 if __name__ == "__main__":
     st.set_page_config(layout="wide", page_title="交互式阅读图谱")
-    view()
+    view(st.text_input('请输入图谱所在的根目录路径', value='.'))
@@ -1,33 +1,175 @@
+import os
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import streamlit as st
 import PyPDF2
 import docx2txt
 from io import BytesIO
 
+# 需要解析的二进制格式，交给进程池；纯文本直接解码
+BINARY_TYPES = ['pdf', 'doc', 'docx']
+
+# 每个进程池任务解析的PDF页数
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', 20))
+
+_pool = None
+
+def iter_pdf_pages(file, start=0, end=None):
+    """逐页产出PDF文本的生成器，可只解析 [start, end) 区间的页"""
+    pages = PyPDF2.PdfReader(file).pages
+    end = len(pages) if end is None else min(end, len(pages))
+    for i in range(start, end):
+        yield pages[i].extract_text() or ""
+
 def extract_text_from_pdf(file):
-    pdf_reader = PyPDF2.PdfReader(file)
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+    return "".join(text + "\n" for text in iter_pdf_pages(file))
+
+def _extract_pdf_range(path, start, end):
+    """进程池任务：解析一个页区间。传文件路径而不是bytes，避免整本PDF被反复序列化"""
+    return list(iter_pdf_pages(path, start, end))
+
+def _iter_bounded(tasks, max_pending=None):
+    """
+    tasks: 可迭代的 (标记, 函数, 参数...)，惰性地提交到进程池
+    同时在途的任务不超过max_pending，按提交顺序产出 (标记, future)
+    """
+    max_pending = max_pending or 2 * (os.cpu_count() or 1)
+    tasks = iter(tasks)
+    pending = deque()
+    while True:
+        for tag, fn, *args in tasks:
+            pending.append((tag, _get_pool().submit(fn, *args)))
+            if len(pending) >= max_pending:
+                break
+        if not pending:
+            return
+        yield pending.popleft()
+
+def _pdf_ranges(path):
+    num_pages = len(PyPDF2.PdfReader(path).pages)
+    return range(0, num_pages, PDF_PAGES_PER_TASK)
+
+def iter_pdf_pages_parallel(path, max_pending=None):
+    """
+    path: PDF文件路径
+    按页区间在进程池中并行解析，按页序逐页产出文本。
+    同时在途的区间数不超过max_pending，内存占用与总页数无关。
+    """
+    tasks = (
+        (None, _extract_pdf_range, path, start, start + PDF_PAGES_PER_TASK)
+        for start in _pdf_ranges(path)
+    )
+    for _, future in _iter_bounded(tasks, max_pending):
+        yield from future.result()
+
+def _spill_to_file(data, suffix):
+    """把上传的内容写到临时文件，供子进程按路径读取"""
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(data)
+        return f.name
 
 def extract_text_from_docx(file):
     return docx2txt.process(file)
 
+def extract_text(name: str, data: bytes) -> str:
+    """按扩展名从文件内容中提取文本"""
+    file_type = name.split('.')[-1].lower()
+    if file_type in ['pdf']:
+        return extract_text_from_pdf(BytesIO(data))
+    elif file_type in ['doc', 'docx']:
+        return extract_text_from_docx(BytesIO(data))
+    else:  # txt, md, markdown
+        return data.decode("utf-8")
+
+def _get_pool() -> ProcessPoolExecutor:
+    # streamlit进程里还有后台线程，用spawn避免fork后子进程继承到被占用的锁
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _pool
+
+def extract_texts(files, max_pending=None):
+    """
+    files: [(文件名, 文件内容bytes), ...]
+    并行提取多个文件的文本，PDF/DOCX在进程池中解析。所有PDF的页区间共用一个任务窗口，
+    前面的文件还在解析时就提交后面文件的区间，同时在途的区间总数不超过max_pending。
+    返回与输入顺序一致的 [(文件名, 文本, 错误信息), ...]，成功时错误信息为None，失败时文本为None。
+    """
+    futures = {}
+    errors = {}
+    for i, (name, data) in enumerate(files):
+        file_type = name.split('.')[-1].lower()
+        if file_type in BINARY_TYPES and file_type != 'pdf':
+            try:
+                futures[i] = _get_pool().submit(extract_text, name, data)
+            except Exception as e:
+                errors[i] = str(e)
+
+    # PDF轮到提交时才落盘，全部区间解析完就删除
+    pdf_pages = {}
+    temp_files = {}
+    remaining = {}
+
+    def pdf_tasks():
+        for i, (name, data) in enumerate(files):
+            if name.split('.')[-1].lower() != 'pdf':
+                continue
+            try:
+                temp_files[i] = _spill_to_file(data, '.pdf')
+                ranges = _pdf_ranges(temp_files[i])
+            except Exception as e:
+                errors[i] = str(e)
+                continue
+            pdf_pages[i] = []
+            remaining[i] = len(ranges)
+            for start in ranges:
+                yield i, _extract_pdf_range, temp_files[i], start, start + PDF_PAGES_PER_TASK
+
+    try:
+        for i, future in _iter_bounded(pdf_tasks(), max_pending):
+            try:
+                if i not in errors:
+                    pdf_pages[i].extend(future.result())
+            except Exception as e:
+                errors[i] = str(e)
+            remaining[i] -= 1
+            if not remaining[i]:
+                os.remove(temp_files.pop(i))
+
+        results = []
+        for i, (name, data) in enumerate(files):
+            if i in errors:
+                results.append((name, None, errors[i]))
+                continue
+            try:
+                if i in pdf_pages:
+                    content = "".join(text + "\n" for text in pdf_pages.pop(i))
+                elif i in futures:
+                    content = futures[i].result()
+                else:
+                    content = extract_text(name, data)
+                results.append((name, content, None))
+            except Exception as e:
+                results.append((name, None, str(e)))
+        return results
+    finally:
+        for path in temp_files.values():
+            os.remove(path)
+
 def muti_input(after):
     # 文件上传器
     uploaded_file = st.file_uploader("请选择一个文件", type=['txt', 'md', 'markdown', 'pdf', 'docx'])
     content = ""
     if uploaded_file is not None:
-        file_type = uploaded_file.name.split('.')[-1].lower()
-        
         try:
             # 根据文件类型提取文本
-            if file_type in ['pdf']:
-                content = extract_text_from_pdf(BytesIO(uploaded_file.getvalue()))
-            elif file_type in ['doc', 'docx']:
-                content = extract_text_from_docx(BytesIO(uploaded_file.getvalue()))
-            else:  # txt, md, markdown
-                content = uploaded_file.getvalue().decode("utf-8")
+            content = extract_text(uploaded_file.name, uploaded_file.getvalue())
             # 显示文件信息
             st.subheader("文件信息：")
             st.write(f"文件名：{uploaded_file.name}")
@@ -1,28 +1,69 @@
 import streamlit as st
 import json
 import os
+import threading
+
+from lightrag.kg.search_index import TrigramSearchIndex
+from lightrag.kg.nano_vector_db_impl import SEARCH_TEXT_FIELDS, SEARCH_STORED_FIELDS
+
+PAGE_SIZE = 20
+
+
+@st.cache_resource(max_entries=4)
+def load_index(search_path: str) -> tuple[TrigramSearchIndex, threading.Lock]:
+    """
+    读取实体搜索索引（不含向量），每个路径只读一次，之后由refresh追加读取变更日志。
+    各会话共用同一个索引，refresh和search要在锁内进行
+    """
+    return TrigramSearchIndex.load(search_path, SEARCH_TEXT_FIELDS, SEARCH_STORED_FIELDS), threading.Lock()
+
+
+def build_index(json_path: str, search_path: str) -> None:
+    """
+    旧项目没有索引文件时，从vdb_entities.json构建一次并保存
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    index = TrigramSearchIndex(SEARCH_TEXT_FIELDS, SEARCH_STORED_FIELDS)
+    index.upsert({e['__id__']: e for e in data.get('data', [])})
+    index.save(search_path)
+
 
 def func(path: str) -> None:
     """
     path: 项目文件根目录
-    调用后，显示vdb_entities.json的内容为可视化列表，并支持搜索。
+    调用后，显示实体列表（分页），并支持按实体名、类型、内容搜索。
     """
+    search_path = os.path.join(path, 'search_entities.json')
     json_path = os.path.join(path, 'vdb_entities.json')
-    if not os.path.exists(json_path):
-        st.error(f"未找到文件: {json_path}")
-        return
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    entities = data.get('data', [])
+    if not os.path.exists(search_path):
+        if not os.path.exists(json_path):
+            st.error(f"未找到文件: {json_path}")
+            return
+        with st.spinner('首次打开，正在构建实体索引...'):
+            build_index(json_path, search_path)
+    index, lock = load_index(search_path)
 
-    search = st.text_input('搜索实体名或内容')
-    if search:
-        entities = [e for e in entities if search in e.get('entity_name', '') or search in e.get('content', '')]
-    st.write(f"共 {len(entities)} 条记录")
+    # 换了搜索词就回到第一页；页码控件在结果之后渲染，所以先从session_state读页码，一次查询同时拿到总数和当前页
+    search = st.text_input('搜索实体名或内容', on_change=lambda: st.session_state.update(obj_page=1))
+    page = st.session_state.get('obj_page', 1)
+    with lock:
+        # 只读取上次之后追加的变更日志，索引文件被重写（压缩）时才整体重读
+        index.refresh(search_path)
+        total, entities = index.search(search, offset=(page - 1) * PAGE_SIZE, limit=PAGE_SIZE, sort_field='entity_name')
+        pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+        if page > pages:
+            # 数据变少后页码越界（很少发生），退到最后一页再查一次
+            page = pages
+            st.session_state['obj_page'] = page
+            total, entities = index.search(search, offset=(page - 1) * PAGE_SIZE, limit=PAGE_SIZE, sort_field='entity_name')
+    st.number_input(f'页码（共 {pages} 页）', min_value=1, max_value=pages, key='obj_page')
+    st.write(f"共 {total} 条记录")
     for e in entities:
         with st.expander(e.get('entity_name', '无名实体')):
+            st.write(f"**类型**: {e.get('entity_type', '')}")
             st.write(f"**内容**: {e.get('content', '')}")
-            st.write(f"**ID**: {e.get('__id__', '')}")
+            st.write(f"**ID**: {e.get('id', '')}")
             st.write(f"**创建时间**: {e.get('__created_at__', '')}")
             st.write(f"**来源ID**: {e.get('source_id', '')}")
             st.write(f"**文件路径**: {e.get('file_path', '')}")
@@ -1,4 +1,4 @@
-import asyncio
+import os
 import nest_asyncio
 
 import logging
@@ -6,17 +6,31 @@ from lightrag import LightRAG
 from lightrag.utils import EmbeddingFunc
 from lightrag.kg.shared_storage import initialize_pipeline_status
 
-from . import api
+from . import api, worker
 
 nest_asyncio.apply()
 
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
+# 语义查询缓存：换个说法的重复提问直接用缓存的回答。阈值还没有用真实问题压测过
+# （python -m benchmarks.semantic_cache），误命中率未知，所以默认关闭，需要时用环境变量打开
+QUERY_SEMANTIC_CACHE = os.getenv('QUERY_SEMANTIC_CACHE', 'false').lower() == 'true'
+QUERY_SEMANTIC_CACHE_THRESHOLD = float(os.getenv('QUERY_SEMANTIC_CACHE_THRESHOLD', 0.95))
+
 async def initialize_rag(path):
     rag = LightRAG(
         working_dir=path,
         chunk_token_size=800,
+        # 与api中的接口并发上限保持一致，否则lightrag自身的队列会先把并发压到默认值
+        llm_model_max_async=api.LLM_MAX_CONCURRENCY,
+        embedding_func_max_async=api.EMBEDDING_MAX_CONCURRENCY,
         llm_model_func=api.sync_vivogpt,
+        # 命中率见 rag.query_cache_metrics()；打开时让LLM复核语义命中，误命中率才有统计
+        embedding_cache_config={
+            "enabled": QUERY_SEMANTIC_CACHE,
+            "similarity_threshold": QUERY_SEMANTIC_CACHE_THRESHOLD,
+            "use_llm_check": True,
+        },
         embedding_func=EmbeddingFunc(
             embedding_dim=768,
             max_token_size=8192,
@@ -29,4 +43,5 @@ async def initialize_rag(path):
 
 def main(path):
     # Initialize RAG instance
-    return asyncio.run(initialize_rag(path))
\ No newline at end of file
+    # 实例在后台事件循环中创建，之后对它的所有异步调用都要经由 worker 提交
+    return worker.run(initialize_rag(path))
\ No newline at end of file
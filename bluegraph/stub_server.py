@@ -0,0 +1,114 @@
+"""
+本地vivo接口桩服务，用于离线测试和压测。
+
+    python -m bluegraph.stub_server --port 8765 --latency 0.5
+    VIVO_BASE_URL=http://127.0.0.1:8765 streamlit run app.py
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 768
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive，才能测出连接池的效果
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, prompt):
+        """按SSE分段返回回答，段与段之间间隔 server.stream_interval 秒"""
+        pieces = ['stub ', 'reply ', f'({len(prompt)} ', 'chars)']
+        events = [
+            'data:' + json.dumps({'message': piece}, ensure_ascii=False) + '\n\n'
+            for piece in pieces
+        ]
+        events.append('event:close\ndata:[DONE]\n\n')
+        events = [event.encode('utf-8') for event in events]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(sum(len(event) for event in events)))
+        self.end_headers()
+        for i, event in enumerate(events):
+            if i:
+                time.sleep(self.server.stream_interval)
+            self.wfile.write(event)
+            self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+        with server.stats_lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.latency)
+            if random.random() < server.error_rate:
+                self._send(429, {'code': 429, 'msg': 'rate limited'})
+                return
+            path = self.path.split('?', 1)[0]
+            if path == '/vivogpt/completions/stream':
+                self._send_stream(data['messages'][-1]['content'])
+            elif path == '/vivogpt/completions':
+                prompt = data['messages'][-1]['content']
+                self._send(200, {
+                    'code': 0,
+                    'data': {'content': f'stub reply ({len(prompt)} chars)'},
+                })
+            elif path == '/embedding-model-api/predict/batch':
+                vectors = [
+                    [random.random() for _ in range(EMBEDDING_DIM)]
+                    for _ in data.get('sentences', [])
+                ]
+                self._send(200, {'data': vectors})
+            else:
+                self._send(404, {'code': 404, 'msg': 'not found'})
+        finally:
+            with server.stats_lock:
+                server.in_flight -= 1
+
+
+def start(port=0, latency=0.5, error_rate=0.0, stream_interval=0.05):
+    """
+    在后台线程启动桩服务，返回server对象。
+    server.server_address 为实际监听地址，server.max_in_flight 为观测到的最大并发数。
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.stream_interval = stream_interval
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='vivo接口本地桩服务')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help='每个请求的模拟耗时（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回429的概率')
+    args = parser.parse_args()
+    server = start(args.port, args.latency, args.error_rate)
+    print('stub server listening on http://{}:{}'.format(*server.server_address))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,100 @@
+"""
+后台事件循环：LightRAG实例及其存储、锁都绑定在这个循环上，
+streamlit脚本线程只负责提交任务和轮询进度，不会被解析过程阻塞。
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from lightrag.kg.shared_storage import get_namespace_data, get_pipeline_status_lock
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """获取（必要时启动）后台事件循环"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name='bluegraph-worker', daemon=True
+            ).start()
+    return _loop
+
+
+def submit(coro) -> Future:
+    """把协程交给后台循环执行，立即返回Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro, timeout=None):
+    """在后台循环中执行协程并等待结果"""
+    return submit(coro).result(timeout)
+
+
+# 异步流结束的标记
+_DONE = object()
+
+
+async def _next(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return _DONE
+
+
+def stream(coro, timeout=None):
+    """
+    在后台循环中执行返回异步流的协程（如 stream=True 的 rag.aquery），
+    把结果转成普通生成器逐段产出，供 st.write_stream 使用；结果是字符串时直接产出。
+    """
+    result = run(coro, timeout)
+    if isinstance(result, str):
+        yield result
+        return
+    try:
+        while True:
+            piece = run(_next(result), timeout)
+            if piece is _DONE:
+                return
+            yield piece
+    finally:
+        # 中途停止读取时关闭异步流，释放连接
+        if hasattr(result, 'aclose'):
+            run(result.aclose(), timeout)
+
+
+def ingest(rag, contents, file_paths=None) -> Future:
+    """后台解析文档，返回的Future在流水线结束后完成"""
+    return submit(rag.ainsert(contents, file_paths=file_paths))
+
+
+async def _progress() -> dict:
+    pipeline_status = await get_namespace_data('pipeline_status')
+    async with get_pipeline_status_lock():
+        return {
+            'busy': pipeline_status.get('busy', False),
+            'job_name': pipeline_status.get('job_name', '-'),
+            'docs': pipeline_status.get('docs', 0),
+            'cur_batch': pipeline_status.get('cur_batch', 0),
+            'chunks': pipeline_status.get('chunks', 0),
+            'cur_chunk': pipeline_status.get('cur_chunk', 0),
+            'latest_message': pipeline_status.get('latest_message', ''),
+            'stage_metrics': dict(pipeline_status.get('stage_metrics', {})),
+        }
+
+
+def progress() -> dict:
+    """
+    读取流水线进度：
+    docs/cur_batch 为文档总数/已开始的文档数，chunks/cur_chunk 为分块总数/已抽取的分块数，
+    stage_metrics 为各流水线阶段的吞吐统计。
+    """
+    snapshot = run(_progress(), timeout=5)
+    if snapshot['chunks']:
+        snapshot['fraction'] = min(1.0, snapshot['cur_chunk'] / snapshot['chunks'])
+    else:
+        snapshot['fraction'] = 0.0
+    return snapshot
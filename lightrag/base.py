@@ -5,6 +5,7 @@ from enum import Enum
 import os
 from dotenv import load_dotenv
 from dataclasses import dataclass, field
+import numpy as np
 from typing import (
     Any,
     Literal,
@@ -146,9 +147,21 @@ class BaseVectorStorage(StorageNameSpace, ABC):
 
     @abstractmethod
     async def query(
-        self, query: str, top_k: int, ids: list[str] | None = None
+        self,
+        query: str,
+        top_k: int,
+        ids: list[str] | None = None,
+        query_embedding: np.ndarray | None = None,
     ) -> list[dict[str, Any]]:
-        """Query the vector storage and retrieve top_k results."""
+        """Query the vector storage and retrieve top_k results.
+
+        Args:
+            query: Query text, embedded with embedding_func
+            top_k: Number of results
+            ids: Only search the chunks of these documents, where supported
+            query_embedding: Embedding of query computed by the caller, skips
+                the embedding call
+        """
 
     @abstractmethod
     async def upsert(self, data: dict[str, dict[str, Any]]) -> None:
@@ -160,6 +173,19 @@ class BaseVectorStorage(StorageNameSpace, ABC):
            KG-storage-log should be used to avoid data corruption
         """
 
+    async def update_metadata(self, data: dict[str, dict[str, Any]]) -> None:
+        """Update the meta fields of records that are already stored, keeping their vectors.
+
+        The default implementation re-embeds through upsert; storages that can
+        rewrite metadata in place override it.
+
+        Importance notes for in-memory storage:
+        1. Changes will be persisted to disk during the next index_done_callback
+        2. Only one process should updating the storage at a time before index_done_callback,
+           KG-storage-log should be used to avoid data corruption
+        """
+        await self.upsert(data)
+
     @abstractmethod
     async def delete_entity(self, entity_name: str) -> None:
         """Delete a single entity by its name.
@@ -467,6 +493,34 @@ class BaseGraphStorage(StorageNameSpace, ABC):
             edge_data: A dictionary of edge properties
         """
 
+    async def upsert_nodes_batch(self, nodes: dict[str, dict[str, str]]) -> None:
+        """Insert or update several nodes
+
+        Default implementation upserts nodes one by one.
+        Override this method for better performance in storage backends
+        that support batch operations.
+
+        Args:
+            nodes: Mapping of node ID to node properties
+        """
+        for node_id, node_data in nodes.items():
+            await self.upsert_node(node_id, node_data)
+
+    async def upsert_edges_batch(
+        self, edges: list[tuple[str, str, dict[str, str]]]
+    ) -> None:
+        """Insert or update several edges
+
+        Default implementation upserts edges one by one.
+        Override this method for better performance in storage backends
+        that support batch operations.
+
+        Args:
+            edges: List of (source node ID, target node ID, edge properties)
+        """
+        for source_node_id, target_node_id, edge_data in edges:
+            await self.upsert_edge(source_node_id, target_node_id, edge_data)
+
     @abstractmethod
     async def delete_node(self, node_id: str) -> None:
         """Delete a node from the graph.
@@ -567,6 +621,19 @@ class DocProcessingStatus:
     """Additional metadata"""
 
 
+DOC_SUMMARY_FIELDS = (
+    "status",
+    "content_summary",
+    "content_length",
+    "chunks_count",
+    "created_at",
+    "updated_at",
+    "file_path",
+    "error",
+)
+"""Document status fields returned by DocStatusStorage.get_docs_paginated"""
+
+
 @dataclass
 class DocStatusStorage(BaseKVStorage, ABC):
     """Base class for document status storage"""
@@ -581,6 +648,30 @@ class DocStatusStorage(BaseKVStorage, ABC):
     ) -> dict[str, DocProcessingStatus]:
         """Get all documents with a specific status"""
 
+    @abstractmethod
+    async def get_docs_paginated(
+        self,
+        status: DocStatus | None = None,
+        search: str | None = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> tuple[int, list[tuple[str, dict[str, Any]]]]:
+        """Get one page of document summaries, newest updated first
+
+        Only the fields in DOC_SUMMARY_FIELDS are returned, the full content is
+        left out and can be fetched with get_by_id when needed.
+
+        Args:
+            status: Only return documents with this status, None for all
+            search: Case-insensitive substring matched against document id,
+                file path and content summary
+            offset: Number of matching documents to skip
+            limit: Maximum number of documents to return
+
+        Returns:
+            (total number of matching documents, list of (doc_id, summary) pairs)
+        """
+
     async def drop_cache_by_modes(self, modes: list[str] | None = None) -> bool:
         """Drop cache is not supported for Doc Status storage"""
         return False
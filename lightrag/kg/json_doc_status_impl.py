@@ -3,6 +3,7 @@ import os
 from typing import Any, Union, final
 
 from lightrag.base import (
+    DOC_SUMMARY_FIELDS,
     DocProcessingStatus,
     DocStatus,
     DocStatusStorage,
@@ -96,6 +97,34 @@ class JsonDocStatusStorage(DocStatusStorage):
                         continue
         return result
 
+    async def get_docs_paginated(
+        self,
+        status: DocStatus | None = None,
+        search: str | None = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> tuple[int, list[tuple[str, dict[str, Any]]]]:
+        """Get one page of document summaries, newest updated first"""
+        search = (search or "").strip().lower()
+        matches = []
+        async with self._storage_lock:
+            for doc_id, doc in self._data.items():
+                if status is not None and doc.get("status") != status.value:
+                    continue
+                if search and not (
+                    search in doc_id.lower()
+                    or search in str(doc.get("file_path") or "").lower()
+                    or search in str(doc.get("content_summary") or "").lower()
+                ):
+                    continue
+                matches.append((str(doc.get("updated_at") or ""), doc_id, doc))
+        matches.sort(key=lambda m: m[0], reverse=True)
+        page = [
+            (doc_id, {k: doc.get(k) for k in DOC_SUMMARY_FIELDS})
+            for _, doc_id, doc in matches[offset : offset + limit]
+        ]
+        return len(matches), page
+
     async def index_done_callback(self) -> None:
         async with self._storage_lock:
             if self.storage_updated.value:
@@ -1,3 +1,5 @@
+import asyncio
+import json
 import os
 from dataclasses import dataclass
 from typing import Any, final
@@ -8,7 +10,6 @@ from lightrag.base import (
 from lightrag.utils import (
     load_json,
     logger,
-    write_json,
 )
 from .shared_storage import (
     get_namespace_data,
@@ -21,13 +22,88 @@ from .shared_storage import (
 )
 
 
+# The write-ahead log is compacted into the snapshot once it is larger than
+# both KV_WAL_COMPACT_MIN_BYTES and KV_WAL_COMPACT_RATIO times the snapshot
+KV_WAL_COMPACT_MIN_BYTES = int(os.getenv("KV_WAL_COMPACT_MIN_BYTES", 16 * 1024 * 1024))
+KV_WAL_COMPACT_RATIO = float(os.getenv("KV_WAL_COMPACT_RATIO", 0.5))
+
+
+def _replay_wal(data: dict[str, Any], file_name: str) -> int:
+    """Apply the records of a log file to data, returns the number of records applied
+
+    A torn last line (crash in the middle of an append) is ignored and cut off,
+    every complete line before it was fsynced by the writer.
+    """
+    if not os.path.exists(file_name):
+        return 0
+    applied = 0
+    valid_bytes = 0
+    with open(file_name, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(
+                    f"Ignoring torn record at byte {valid_bytes} of {file_name}"
+                )
+                break
+            valid_bytes += len(line)
+            key = record["k"]
+            if "sk" in record:
+                if record["op"] == "set":
+                    data.setdefault(key, {})[record["sk"]] = record["v"]
+                elif isinstance(data.get(key), dict):
+                    data[key].pop(record["sk"], None)
+            elif record["op"] == "set":
+                data[key] = record["v"]
+            else:
+                data.pop(key, None)
+            applied += 1
+    if valid_bytes < os.path.getsize(file_name):
+        with open(file_name, "r+b") as f:
+            f.truncate(valid_bytes)
+    return applied
+
+
+def _write_snapshot(data: dict[str, Any], file_name: str) -> None:
+    """Atomically replace the snapshot file"""
+    tmp_file = f"{file_name}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, file_name)
+
+
 @final
 @dataclass
 class JsonKVStorage(BaseKVStorage):
+    """JSON KV storage persisted as a snapshot plus an append-only log
+
+    Importance notes:
+    1. kv_store_<namespace>.json is the snapshot, changed keys are appended to
+       kv_store_<namespace>.wal.jsonl on index_done_callback, so persisting costs
+       the size of the changes instead of the size of the store.
+    2. For cache namespaces (one dict per mode) changes are logged per cache
+       entry. Entries must be replaced, not mutated in place, to be detected.
+    3. When the log grows past the compaction threshold it is rotated to
+       .wal.jsonl.old and a new snapshot is written in a worker thread. Replay at
+       initialize applies snapshot, .old log, log in that order; every record
+       holds the final value of its key, so replaying a log already contained
+       in the snapshot is harmless.
+    """
+
     def __post_init__(self):
         working_dir = self.global_config["working_dir"]
         self._file_name = os.path.join(working_dir, f"kv_store_{self.namespace}.json")
+        self._wal_file_name = os.path.join(
+            working_dir, f"kv_store_{self.namespace}.wal.jsonl"
+        )
+        self._old_wal_file_name = f"{self._wal_file_name}.old"
         self._data = None
+        self._dirty_keys = None
+        self._persisted_entries: dict[str, dict[str, Any]] = {}
+        self._compaction: asyncio.Future | None = None
         self._storage_lock = None
         self.storage_updated = None
 
@@ -39,10 +115,30 @@ class JsonKVStorage(BaseKVStorage):
             # check need_init must before get_namespace_data
             need_init = await try_initialize_namespace(self.namespace)
             self._data = await get_namespace_data(self.namespace)
+            # Keys changed since the last log append, shared between processes
+            self._dirty_keys = await get_namespace_data(f"{self.namespace}_dirty_keys")
             if need_init:
                 loaded_data = load_json(self._file_name) or {}
+                replayed = _replay_wal(loaded_data, self._old_wal_file_name)
+                replayed += _replay_wal(loaded_data, self._wal_file_name)
+                if replayed:
+                    logger.info(
+                        f"Process {os.getpid()} KV replayed {replayed} log records for {self.namespace}"
+                    )
+                if os.path.exists(self._old_wal_file_name):
+                    # An interrupted compaction, finish it before appending again
+                    _write_snapshot(loaded_data, self._file_name)
+                    os.remove(self._old_wal_file_name)
+                    if os.path.exists(self._wal_file_name):
+                        os.remove(self._wal_file_name)
                 async with self._storage_lock:
                     self._data.update(loaded_data)
+                    if self.namespace.endswith("cache"):
+                        self._persisted_entries = {
+                            mode: dict(entries)
+                            for mode, entries in loaded_data.items()
+                            if isinstance(entries, dict)
+                        }
 
                     # Calculate data count based on namespace
                     if self.namespace.endswith("cache"):
@@ -60,31 +156,101 @@ class JsonKVStorage(BaseKVStorage):
                         f"Process {os.getpid()} KV load {self.namespace} with {data_count} records"
                     )
 
+    def _changed_records(self, key: str) -> list[dict[str, Any]]:
+        """Log records for one changed key, per cache entry for cache namespaces"""
+        value = self._data.get(key)
+        if value is None:
+            self._persisted_entries.pop(key, None)
+            return [{"op": "del", "k": key}]
+        if not self.namespace.endswith("cache") or not isinstance(value, dict):
+            return [{"op": "set", "k": key, "v": value}]
+
+        persisted = self._persisted_entries.get(key)
+        self._persisted_entries[key] = dict(value)
+        if persisted is None:
+            # This process has not seen the mode yet, log it as a whole
+            return [{"op": "set", "k": key, "v": value}]
+        records = [
+            {"op": "set", "k": key, "sk": sub_key, "v": entry}
+            for sub_key, entry in value.items()
+            if sub_key not in persisted
+            or not (persisted[sub_key] is entry or persisted[sub_key] == entry)
+        ]
+        records.extend(
+            {"op": "del", "k": key, "sk": sub_key}
+            for sub_key in persisted
+            if sub_key not in value
+        )
+        return records
+
     async def index_done_callback(self) -> None:
         async with self._storage_lock:
             if self.storage_updated.value:
-                data_dict = (
-                    dict(self._data) if hasattr(self._data, "_getvalue") else self._data
-                )
+                keys = list(self._dirty_keys.keys())
+                records = []
+                for key in keys:
+                    records.extend(self._changed_records(key))
 
-                # Calculate data count based on namespace
-                if self.namespace.endswith("cache"):
-                    # # For cache namespaces, sum the cache entries across all cache types
-                    data_count = sum(
-                        len(first_level_dict)
-                        for first_level_dict in data_dict.values()
-                        if isinstance(first_level_dict, dict)
-                    )
-                else:
-                    # For non-cache namespaces, use the original count method
-                    data_count = len(data_dict)
+                if records:
+                    with open(self._wal_file_name, "a", encoding="utf-8") as f:
+                        for record in records:
+                            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                for key in keys:
+                    self._dirty_keys.pop(key, None)
 
                 logger.debug(
-                    f"Process {os.getpid()} KV writting {data_count} records to {self.namespace}"
+                    f"Process {os.getpid()} KV appended {len(records)} records for {len(keys)} keys to {self.namespace}"
                 )
-                write_json(data_dict, self._file_name)
                 await clear_all_update_flags(self.namespace)
 
+            if self._compaction is None and self._needs_compaction():
+                self._start_compaction()
+
+    def _needs_compaction(self) -> bool:
+        if not os.path.exists(self._wal_file_name) or os.path.exists(
+            self._old_wal_file_name
+        ):
+            return False
+        wal_size = os.path.getsize(self._wal_file_name)
+        snapshot_size = (
+            os.path.getsize(self._file_name) if os.path.exists(self._file_name) else 0
+        )
+        return wal_size >= max(
+            KV_WAL_COMPACT_MIN_BYTES, KV_WAL_COMPACT_RATIO * snapshot_size
+        )
+
+    def _start_compaction(self) -> None:
+        """Rotate the log and write a new snapshot in a worker thread
+
+        Must be called with the storage lock held and nothing left in the dirty
+        keys, so the copy taken here equals snapshot + rotated log.
+        """
+        os.replace(self._wal_file_name, self._old_wal_file_name)
+        # Entries are replaced rather than mutated, a copy two levels deep is consistent
+        data_copy = {
+            k: dict(v) if isinstance(v, dict) else v for k, v in self._data.items()
+        }
+
+        def compact():
+            _write_snapshot(data_copy, self._file_name)
+            os.remove(self._old_wal_file_name)
+
+        def done(fut):
+            self._compaction = None
+            if fut.exception() is not None:
+                logger.error(
+                    f"KV compaction of {self.namespace} failed: {fut.exception()}"
+                )
+            else:
+                logger.info(
+                    f"Process {os.getpid()} KV compacted {len(data_copy)} records of {self.namespace}"
+                )
+
+        self._compaction = asyncio.get_running_loop().run_in_executor(None, compact)
+        self._compaction.add_done_callback(done)
+
     async def get_all(self) -> dict[str, Any]:
         """Get all data from storage
 
@@ -124,6 +290,7 @@ class JsonKVStorage(BaseKVStorage):
         logger.debug(f"Inserting {len(data)} records to {self.namespace}")
         async with self._storage_lock:
             self._data.update(data)
+            self._dirty_keys.update(dict.fromkeys(data, True))
             await set_all_update_flags(self.namespace)
 
     async def delete(self, ids: list[str]) -> None:
@@ -144,6 +311,7 @@ class JsonKVStorage(BaseKVStorage):
             for doc_id in ids:
                 result = self._data.pop(doc_id, None)
                 if result is not None:
+                    self._dirty_keys[doc_id] = True
                     any_deleted = True
 
             if any_deleted:
@@ -178,8 +346,8 @@ class JsonKVStorage(BaseKVStorage):
 
         This method will:
         1. Clear all data from memory
-        2. Update flags to notify other processes
-        3. Trigger index_done_callback to save the empty state
+        2. Write an empty snapshot and remove the write-ahead log
+        3. Update flags to notify other processes
 
         Returns:
             dict[str, str]: Operation status and message
@@ -188,7 +356,15 @@ class JsonKVStorage(BaseKVStorage):
         """
         try:
             async with self._storage_lock:
+                if self._compaction is not None:
+                    await self._compaction
                 self._data.clear()
+                self._dirty_keys.clear()
+                self._persisted_entries.clear()
+                _write_snapshot({}, self._file_name)
+                for file_name in (self._wal_file_name, self._old_wal_file_name):
+                    if os.path.exists(file_name):
+                        os.remove(file_name)
                 await set_all_update_flags(self.namespace)
 
             await self.index_done_callback()
@@ -204,3 +380,5 @@ class JsonKVStorage(BaseKVStorage):
         """
         if self.namespace.endswith("cache"):
             await self.index_done_callback()
+        if self._compaction is not None:
+            await self._compaction
@@ -102,11 +102,18 @@ class MilvusVectorDBStorage(BaseVectorStorage):
         return results
 
     async def query(
-        self, query: str, top_k: int, ids: list[str] | None = None
+        self,
+        query: str,
+        top_k: int,
+        ids: list[str] | None = None,
+        query_embedding: np.ndarray | None = None,
     ) -> list[dict[str, Any]]:
-        embedding = await self.embedding_func(
-            [query], _priority=5
-        )  # higher priority for query
+        # Embedding computed by the caller, or a higher priority call for query
+        embedding = (
+            np.array([query_embedding])
+            if query_embedding is not None
+            else await self.embedding_func([query], _priority=5)
+        )
         results = self._client.search(
             collection_name=self.namespace,
             data=embedding,
@@ -0,0 +1,560 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, final
+
+import numpy as np
+
+from lightrag.utils import (
+    logger,
+    compute_mdhash_id,
+)
+from lightrag.base import BaseVectorStorage
+from lightrag.namespace import NameSpace, is_namespace
+
+from .shared_storage import (
+    get_storage_lock,
+    get_update_flag,
+    set_all_update_flags,
+)
+from .search_index import TrigramSearchIndex
+from .nano_vector_db_impl import SEARCH_STORED_FIELDS, SEARCH_TEXT_FIELDS
+
+# Rewrite the files once dead rows outnumber live ones and exceed this count
+MMAP_VDB_COMPACT_MIN_DEAD_ROWS = int(os.getenv("MMAP_VDB_COMPACT_MIN_DEAD_ROWS", 1000))
+
+
+def _append_lines(file_name: str, records: list[dict[str, Any]]) -> None:
+    with open(file_name, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+@final
+@dataclass
+class MmapVectorDBStorage(BaseVectorStorage):
+    """Vector storage backed by a memory-mapped float32 matrix
+
+    Files in working_dir:
+    - vdb_<namespace>.f32: raw row-major float32 matrix of L2-normalized vectors,
+      opened with np.memmap so processes share the rows through the page cache
+    - vdb_<namespace>.meta.jsonl: append-only log of {"row", "__id__", meta...}
+      records for upserts and {"del": id} records for deletes
+
+    Importance notes:
+    1. Upserts and deletes stay in memory until index_done_callback, which appends
+       the new rows and log records without rewriting existing data.
+    2. Replaced or deleted rows stay in the matrix as dead rows. Once they outnumber
+       the live rows (and MMAP_VDB_COMPACT_MIN_DEAD_ROWS), both files are rewritten
+       to new files and swapped in with os.replace.
+    3. On an update flag from another process only the appended tail of both files
+       is read. A compaction by another process changes the inode of the log, which
+       triggers a full reload instead.
+    """
+
+    def __post_init__(self):
+        kwargs = self.global_config.get("vector_db_storage_cls_kwargs", {})
+        cosine_threshold = kwargs.get("cosine_better_than_threshold")
+        if cosine_threshold is None:
+            raise ValueError(
+                "cosine_better_than_threshold must be specified in vector_db_storage_cls_kwargs"
+            )
+        self.cosine_better_than_threshold = cosine_threshold
+
+        working_dir = self.global_config["working_dir"]
+        self._matrix_file = os.path.join(working_dir, f"vdb_{self.namespace}.f32")
+        self._meta_file = os.path.join(working_dir, f"vdb_{self.namespace}.meta.jsonl")
+        self._max_batch_size = self.global_config["embedding_batch_num"]
+        self._dim = self.embedding_func.embedding_dim
+        self._storage_lock = None
+        self.storage_updated = None
+
+        # Entities also keep a vector-free text search index, as NanoVectorDBStorage does
+        self._search_index = None
+        self._search_file_name = os.path.join(
+            working_dir, f"search_{self.namespace}.json"
+        )
+
+        self._reset()
+        self._load()
+        if is_namespace(self.namespace, NameSpace.VECTOR_STORE_ENTITIES):
+            self._load_search_index()
+
+    def _reset(self) -> None:
+        # Persisted state
+        self._matrix = np.zeros((0, self._dim), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._row_ids: list[str | None] = []
+        self._meta: dict[str, dict[str, Any]] = {}
+        self._rows: dict[str, int] = {}
+        self._meta_offset = 0
+        self._meta_inode = None
+        # Changes not yet written by index_done_callback
+        self._pending: dict[str, tuple[dict[str, Any], np.ndarray]] = {}
+        self._pending_deletes: set[str] = set()
+
+    def _load_search_index(self) -> None:
+        """Load the search sidecar, building it from the metadata if missing"""
+        self._search_index = TrigramSearchIndex.load(
+            self._search_file_name, SEARCH_TEXT_FIELDS, SEARCH_STORED_FIELDS
+        )
+        if self._search_index is None:
+            self._search_index = TrigramSearchIndex(
+                SEARCH_TEXT_FIELDS, SEARCH_STORED_FIELDS
+            )
+            self._search_index.upsert(self._meta)
+            if len(self._search_index):
+                self._search_index.save(self._search_file_name)
+
+    def _load(self) -> None:
+        """Read the metadata log from the last offset and remap the matrix"""
+        exists = os.path.exists(self._meta_file) and os.path.exists(self._matrix_file)
+        stat = os.stat(self._meta_file) if exists else None
+        if self._meta_inode is not None and (
+            stat is None
+            or stat.st_ino != self._meta_inode
+            or stat.st_size < self._meta_offset
+        ):
+            # Compacted or dropped by another process, row numbers changed
+            pending, pending_deletes = self._pending, self._pending_deletes
+            self._reset()
+            self._pending, self._pending_deletes = pending, pending_deletes
+        if stat is None:
+            return
+        self._meta_inode = stat.st_ino
+
+        with open(self._meta_file, "rb") as f:
+            f.seek(self._meta_offset)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last record, it is overwritten by the next append
+                    break
+                self._meta_offset += len(line)
+                if "del" in record:
+                    self._meta.pop(record["del"], None)
+                    self._rows.pop(record["del"], None)
+                    continue
+                row = record.pop("row")
+                self._meta[record["__id__"]] = record
+                self._rows[record["__id__"]] = row
+
+        row_bytes = self._dim * 4
+        n_rows = os.path.getsize(self._matrix_file) // row_bytes
+        if n_rows:
+            self._matrix = np.memmap(
+                self._matrix_file, dtype=np.float32, mode="r", shape=(n_rows, self._dim)
+            )
+        self._row_ids = [None] * n_rows
+        for doc_id, row in self._rows.items():
+            self._row_ids[row] = doc_id
+        self._alive = np.zeros(n_rows, dtype=bool)
+        if self._rows:
+            self._alive[np.fromiter(self._rows.values(), dtype=np.int64)] = True
+        logger.info(
+            f"Process {os.getpid()} mmap vdb {self.namespace} loaded {len(self._rows)} vectors ({n_rows} rows)"
+        )
+
+    def _write_pending(self) -> None:
+        """Append pending rows and log records to the files"""
+        if not self._pending and not self._pending_deletes:
+            return
+        row_bytes = self._dim * 4
+        n_rows = (
+            os.path.getsize(self._matrix_file) // row_bytes
+            if os.path.exists(self._matrix_file)
+            else 0
+        )
+        records = [{"del": doc_id} for doc_id in self._pending_deletes]
+        if self._pending:
+            vectors = np.stack([vector for _, vector in self._pending.values()])
+            with open(self._matrix_file, "ab") as f:
+                # Drop a torn row left by an interrupted append
+                f.truncate(n_rows * row_bytes)
+                f.write(vectors.astype(np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            records.extend(
+                {**meta, "row": n_rows + i}
+                for i, (meta, _) in enumerate(self._pending.values())
+            )
+        if os.path.exists(self._meta_file):
+            # Drop a torn record left by an interrupted append
+            with open(self._meta_file, "r+b") as f:
+                f.truncate(self._meta_offset)
+        _append_lines(self._meta_file, records)
+        self._pending = {}
+        self._pending_deletes = set()
+
+    def _compact(self) -> None:
+        """Rewrite both files with live rows only"""
+        ids = list(self._rows)
+        rows = np.fromiter((self._rows[i] for i in ids), dtype=np.int64, count=len(ids))
+        tmp_matrix, tmp_meta = f"{self._matrix_file}.tmp", f"{self._meta_file}.tmp"
+        with open(tmp_matrix, "wb") as f:
+            for start in range(0, len(rows), 65536):
+                f.write(np.asarray(self._matrix[rows[start : start + 65536]]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        open(tmp_meta, "w").close()
+        _append_lines(
+            tmp_meta, [{**self._meta[i], "row": row} for row, i in enumerate(ids)]
+        )
+        os.replace(tmp_matrix, self._matrix_file)
+        os.replace(tmp_meta, self._meta_file)
+        logger.info(
+            f"Process {os.getpid()} mmap vdb {self.namespace} compacted {len(self._alive)} rows to {len(ids)}"
+        )
+        self._reset()
+        self._load()
+
+    async def initialize(self):
+        """Initialize storage data"""
+        # Get the update flag for cross-process update notification
+        self.storage_updated = await get_update_flag(self.namespace)
+        # Get the storage lock for use in other methods
+        self._storage_lock = get_storage_lock(enable_logging=False)
+
+    async def _refresh(self) -> None:
+        """Read what other processes appended, must hold the storage lock"""
+        if self.storage_updated.value:
+            logger.info(
+                f"Process {os.getpid()} reloading {self.namespace} due to update by another process"
+            )
+            self._load()
+            if self._search_index is not None:
+                self._load_search_index()
+            self.storage_updated.value = False
+
+    async def upsert(self, data: dict[str, dict[str, Any]]) -> None:
+        """
+        Importance notes:
+        1. Changes will be persisted to disk during the next index_done_callback
+        2. Only one process should updating the storage at a time before index_done_callback,
+           KG-storage-log should be used to avoid data corruption
+        """
+        logger.debug(f"Inserting {len(data)} to {self.namespace}")
+        if not data:
+            return
+
+        current_time = time.time()
+        list_data = [
+            {
+                "__id__": k,
+                "__created_at__": current_time,
+                **{k1: v1 for k1, v1 in v.items() if k1 in self.meta_fields},
+            }
+            for k, v in data.items()
+        ]
+        contents = [v["content"] for v in data.values()]
+        batches = [
+            contents[i : i + self._max_batch_size]
+            for i in range(0, len(contents), self._max_batch_size)
+        ]
+
+        # Execute embedding outside of lock to avoid long lock times
+        embedding_tasks = [self.embedding_func(batch) for batch in batches]
+        embeddings_list = await asyncio.gather(*embedding_tasks)
+
+        embeddings = np.concatenate(embeddings_list).astype(np.float32)
+        if len(embeddings) != len(list_data):
+            # sometimes the embedding is not returned correctly. just log it.
+            logger.error(
+                f"embedding is not 1-1 with data, {len(embeddings)} != {len(list_data)}"
+            )
+            return
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        embeddings /= norms
+
+        async with self._storage_lock:
+            await self._refresh()
+            for meta, vector in zip(list_data, embeddings):
+                self._pending_deletes.discard(meta["__id__"])
+                self._pending[meta["__id__"]] = (meta, vector)
+            if self._search_index is not None:
+                self._search_index.upsert({d["__id__"]: d for d in list_data})
+        return [d["__id__"] for d in list_data]
+
+    async def update_metadata(self, data: dict[str, dict[str, Any]]) -> None:
+        """Rewrite the meta fields of stored records without embedding
+
+        A persisted record is re-appended with its current vector, leaving a dead row
+        like any other update.
+
+        Importance notes:
+        1. Changes will be persisted to disk during the next index_done_callback
+        2. Only one process should updating the storage at a time before index_done_callback,
+           KG-storage-log should be used to avoid data corruption
+        """
+        if not data:
+            return
+        async with self._storage_lock:
+            await self._refresh()
+            updated = {}
+            for doc_id, values in data.items():
+                if doc_id in self._pending:
+                    meta, vector = self._pending[doc_id]
+                elif doc_id in self._meta and doc_id not in self._pending_deletes:
+                    meta = self._meta[doc_id]
+                    vector = np.array(self._matrix[self._rows[doc_id]])
+                else:
+                    continue
+                meta = {
+                    **meta,
+                    **{k: v for k, v in values.items() if k in self.meta_fields},
+                }
+                self._pending[doc_id] = (meta, vector)
+                updated[doc_id] = meta
+            if self._search_index is not None:
+                self._search_index.upsert(updated)
+
+    async def query(
+        self,
+        query: str,
+        top_k: int,
+        ids: list[str] | None = None,
+        query_embedding: np.ndarray | None = None,
+    ) -> list[dict[str, Any]]:
+        # Execute embedding outside of lock to avoid improve cocurrent
+        # Embedding computed by the caller, or a higher priority call for query
+        embedding = (
+            np.array([query_embedding])
+            if query_embedding is not None
+            else await self.embedding_func([query], _priority=5)
+        )
+        embedding = np.asarray(embedding[0], dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        if norm == 0:
+            return []
+        embedding /= norm
+
+        async with self._storage_lock:
+            await self._refresh()
+            scores = np.asarray(self._matrix @ embedding, dtype=np.float32)
+            alive = self._alive.copy()
+            # Rows replaced or deleted in memory but not yet on disk
+            for doc_id in itertools.chain(self._pending, self._pending_deletes):
+                row = self._rows.get(doc_id)
+                if row is not None:
+                    alive[row] = False
+            scores[~alive] = -np.inf
+            if top_k < len(scores):
+                top_rows = np.argpartition(-scores, top_k)[:top_k]
+            else:
+                top_rows = np.arange(len(scores))
+            candidates = [
+                (float(scores[row]), self._meta[self._row_ids[row]])
+                for row in top_rows
+                if alive[row]
+            ]
+            candidates.extend(
+                (float(vector @ embedding), meta)
+                for meta, vector in self._pending.values()
+            )
+
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        return [
+            {
+                **meta,
+                "id": meta["__id__"],
+                "distance": score,
+                "created_at": meta.get("__created_at__"),
+            }
+            for score, meta in candidates[:top_k]
+            if score >= self.cosine_better_than_threshold
+        ]
+
+    def _current_meta(self) -> dict[str, dict[str, Any]]:
+        """Metadata of all live records, including pending changes"""
+        metas = {
+            doc_id: meta
+            for doc_id, meta in self._meta.items()
+            if doc_id not in self._pending_deletes
+        }
+        metas.update({doc_id: meta for doc_id, (meta, _) in self._pending.items()})
+        return metas
+
+    @property
+    async def client_storage(self):
+        async with self._storage_lock:
+            await self._refresh()
+            return {"data": list(self._current_meta().values())}
+
+    async def delete(self, ids: list[str]):
+        """Delete vectors with specified IDs
+
+        Importance notes:
+        1. Changes will be persisted to disk during the next index_done_callback
+        2. Only one process should updating the storage at a time before index_done_callback,
+           KG-storage-log should be used to avoid data corruption
+
+        Args:
+            ids: List of vector IDs to be deleted
+        """
+        try:
+            async with self._storage_lock:
+                await self._refresh()
+                for doc_id in ids:
+                    self._pending.pop(doc_id, None)
+                    if doc_id in self._meta:
+                        self._pending_deletes.add(doc_id)
+                if self._search_index is not None:
+                    self._search_index.delete(ids)
+            logger.debug(
+                f"Successfully deleted {len(ids)} vectors from {self.namespace}"
+            )
+        except Exception as e:
+            logger.error(f"Error while deleting vectors from {self.namespace}: {e}")
+
+    async def delete_entity(self, entity_name: str) -> None:
+        """
+        Importance notes:
+        1. Changes will be persisted to disk during the next index_done_callback
+        2. Only one process should updating the storage at a time before index_done_callback,
+           KG-storage-log should be used to avoid data corruption
+        """
+        entity_id = compute_mdhash_id(entity_name, prefix="ent-")
+        logger.debug(f"Attempting to delete entity {entity_name} with ID {entity_id}")
+        await self.delete([entity_id])
+
+    async def delete_entity_relation(self, entity_name: str) -> None:
+        """
+        Importance notes:
+        1. Changes will be persisted to disk during the next index_done_callback
+        2. Only one process should updating the storage at a time before index_done_callback,
+           KG-storage-log should be used to avoid data corruption
+        """
+        storage = await self.client_storage
+        ids_to_delete = [
+            dp["__id__"]
+            for dp in storage["data"]
+            if dp.get("src_id") == entity_name or dp.get("tgt_id") == entity_name
+        ]
+        logger.debug(f"Found {len(ids_to_delete)} relations for entity {entity_name}")
+        if ids_to_delete:
+            await self.delete(ids_to_delete)
+
+    async def index_done_callback(self) -> bool:
+        """Append pending changes to disk, compacting when dead rows dominate"""
+        async with self._storage_lock:
+            try:
+                # Pick up rows appended by other processes so our rows go after them
+                self._load()
+                self.storage_updated.value = False
+                if not self._pending and not self._pending_deletes:
+                    return True
+                self._write_pending()
+                self._load()
+                dead_rows = len(self._alive) - len(self._rows)
+                if dead_rows > max(MMAP_VDB_COMPACT_MIN_DEAD_ROWS, len(self._rows)):
+                    self._compact()
+                if self._search_index is not None:
+                    self._search_index.persist(self._search_file_name)
+                # Notify other processes that data has been updated
+                await set_all_update_flags(self.namespace)
+                # Reset own update flag to avoid self-reloading
+                self.storage_updated.value = False
+                return True
+            except Exception as e:
+                logger.error(f"Error saving data for {self.namespace}: {e}")
+                return False
+
+    async def search_by_prefix(self, prefix: str) -> list[dict[str, Any]]:
+        """Search for records with IDs starting with a specific prefix.
+
+        Args:
+            prefix: The prefix to search for in record IDs
+
+        Returns:
+            List of records with matching ID prefixes
+        """
+        storage = await self.client_storage
+        matching_records = [
+            {**record, "id": record["__id__"]}
+            for record in storage["data"]
+            if record["__id__"].startswith(prefix)
+        ]
+        logger.debug(f"Found {len(matching_records)} records with prefix '{prefix}'")
+        return matching_records
+
+    async def get_by_id(self, id: str) -> dict[str, Any] | None:
+        """Get vector data by its ID
+
+        Args:
+            id: The unique identifier of the vector
+
+        Returns:
+            The vector data if found, or None if not found
+        """
+        result = await self.get_by_ids([id])
+        return result[0] if result else None
+
+    async def get_by_ids(self, ids: list[str]) -> list[dict[str, Any]]:
+        """Get multiple vector data by their IDs
+
+        Args:
+            ids: List of unique identifiers
+
+        Returns:
+            List of vector data objects that were found
+        """
+        if not ids:
+            return []
+        async with self._storage_lock:
+            await self._refresh()
+            results = []
+            for id in ids:
+                if id in self._pending:
+                    meta = self._pending[id][0]
+                elif id in self._meta and id not in self._pending_deletes:
+                    meta = self._meta[id]
+                else:
+                    continue
+                results.append({**meta, "id": id})
+            return results
+
+    async def drop(self) -> dict[str, str]:
+        """Drop all vector data from storage and clean up resources
+
+        This method will:
+        1. Remove the matrix, metadata and search files if they exist
+        2. Reset the in-memory state
+        3. Update flags to notify other processes
+        4. Changes is persisted to disk immediately
+
+        Returns:
+            dict[str, str]: Operation status and message
+            - On success: {"status": "success", "message": "data dropped"}
+            - On failure: {"status": "error", "message": "<error details>"}
+        """
+        try:
+            async with self._storage_lock:
+                for file_name in (self._matrix_file, self._meta_file):
+                    if os.path.exists(file_name):
+                        os.remove(file_name)
+                TrigramSearchIndex.remove_files(self._search_file_name)
+                self._reset()
+                if self._search_index is not None:
+                    self._search_index = TrigramSearchIndex(
+                        SEARCH_TEXT_FIELDS, SEARCH_STORED_FIELDS
+                    )
+
+                # Notify other processes that data has been updated
+                await set_all_update_flags(self.namespace)
+                # Reset own update flag to avoid self-reloading
+                self.storage_updated.value = False
+
+                logger.info(
+                    f"Process {os.getpid()} drop {self.namespace}(file:{self._matrix_file})"
+                )
+            return {"status": "success", "message": "data dropped"}
+        except Exception as e:
+            logger.error(f"Error dropping {self.namespace}: {e}")
+            return {"status": "error", "message": str(e)}
@@ -1,4 +1,5 @@
 import os
+import re
 from dataclasses import dataclass, field
 import numpy as np
 import configparser
@@ -10,6 +11,7 @@ from ..base import (
     BaseGraphStorage,
     BaseKVStorage,
     BaseVectorStorage,
+    DOC_SUMMARY_FIELDS,
     DocProcessingStatus,
     DocStatus,
     DocStatusStorage,
@@ -30,7 +32,7 @@ from motor.motor_asyncio import (  # type: ignore
     AsyncIOMotorDatabase,
     AsyncIOMotorCollection,
 )
-from pymongo.operations import SearchIndexModel  # type: ignore
+from pymongo.operations import SearchIndexModel, UpdateOne  # type: ignore
 from pymongo.errors import PyMongoError  # type: ignore
 
 config = configparser.ConfigParser()
@@ -286,6 +288,38 @@ class MongoDocStatusStorage(DocStatusStorage):
             for doc in result
         }
 
+    async def get_docs_paginated(
+        self,
+        status: DocStatus | None = None,
+        search: str | None = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> tuple[int, list[tuple[str, dict[str, Any]]]]:
+        """Get one page of document summaries, newest updated first"""
+        query: dict[str, Any] = {}
+        if status is not None:
+            query["status"] = status.value
+        if search:
+            pattern = {"$regex": re.escape(search.strip()), "$options": "i"}
+            query["$or"] = [
+                {"_id": pattern},
+                {"file_path": pattern},
+                {"content_summary": pattern},
+            ]
+        total = await self._data.count_documents(query)
+        projection = {k: 1 for k in DOC_SUMMARY_FIELDS}
+        cursor = (
+            self._data.find(query, projection)
+            .sort("updated_at", -1)
+            .skip(offset)
+            .limit(limit)
+        )
+        page = [
+            (doc["_id"], {k: doc.get(k) for k in DOC_SUMMARY_FIELDS})
+            for doc in await cursor.to_list()
+        ]
+        return total, page
+
     async def index_done_callback(self) -> None:
         # Mongo handles persistence automatically
         pass
@@ -646,6 +680,52 @@ class MongoGraphStorage(BaseGraphStorage):
             {"_id": source_node_id}, {"$push": {"edges": new_edge}}
         )
 
+    async def upsert_nodes_batch(self, nodes: dict[str, dict[str, str]]) -> None:
+        """
+        Upsert several node documents with one bulk write.
+        """
+        if not nodes:
+            return
+        await self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": node_id},
+                    {"$set": {**node_data}, "$setOnInsert": {"edges": []}},
+                    upsert=True,
+                )
+                for node_id, node_data in nodes.items()
+            ]
+        )
+
+    async def upsert_edges_batch(
+        self, edges: list[tuple[str, str, dict[str, str]]]
+    ) -> None:
+        """
+        Upsert several edges with one ordered bulk write, applying the same
+        ensure-source / pull / push steps as `upsert_edge` for every edge.
+        """
+        if not edges:
+            return
+        operations = []
+        for source_node_id, target_node_id, edge_data in edges:
+            new_edge = {"target": target_node_id}
+            new_edge.update(edge_data)
+            operations.extend(
+                [
+                    UpdateOne(
+                        {"_id": source_node_id},
+                        {"$setOnInsert": {"edges": []}},
+                        upsert=True,
+                    ),
+                    UpdateOne(
+                        {"_id": source_node_id},
+                        {"$pull": {"edges": {"target": target_node_id}}},
+                    ),
+                    UpdateOne({"_id": source_node_id}, {"$push": {"edges": new_edge}}),
+                ]
+            )
+        await self.collection.bulk_write(operations, ordered=True)
+
     #
     # -------------------------------------------------------------------------
     # DELETION
@@ -1028,13 +1108,20 @@ class MongoVectorDBStorage(BaseVectorStorage):
         return list_data
 
     async def query(
-        self, query: str, top_k: int, ids: list[str] | None = None
+        self,
+        query: str,
+        top_k: int,
+        ids: list[str] | None = None,
+        query_embedding: np.ndarray | None = None,
     ) -> list[dict[str, Any]]:
         """Queries the vector database using Atlas Vector Search."""
         # Generate the embedding
-        embedding = await self.embedding_func(
-            [query], _priority=5
-        )  # higher priority for query
+        # Embedding computed by the caller, or a higher priority call for query
+        embedding = (
+            np.array([query_embedding])
+            if query_embedding is not None
+            else await self.embedding_func([query], _priority=5)
+        )
 
         # Convert numpy array to a list to ensure compatibility with MongoDB
         query_vector = embedding[0].tolist()
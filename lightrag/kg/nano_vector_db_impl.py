@@ -11,6 +11,7 @@ from lightrag.utils import (
 )
 import pipmaster as pm
 from lightrag.base import BaseVectorStorage
+from lightrag.namespace import NameSpace, is_namespace
 
 if not pm.is_installed("nano-vectordb"):
     pm.install("nano-vectordb")
@@ -21,6 +22,18 @@ from .shared_storage import (
     get_update_flag,
     set_all_update_flags,
 )
+from .search_index import TrigramSearchIndex
+
+# Fields of entity records kept in the text search sidecar, and the ones searched
+SEARCH_STORED_FIELDS = (
+    "entity_name",
+    "entity_type",
+    "content",
+    "source_id",
+    "file_path",
+    "__created_at__",
+)
+SEARCH_TEXT_FIELDS = ("entity_name", "entity_type", "content")
 
 
 @final
@@ -51,6 +64,28 @@ class NanoVectorDBStorage(BaseVectorStorage):
             storage_file=self._client_file_name,
         )
 
+        # Entities also keep a vector-free text search index next to the vector file
+        self._search_index = None
+        self._search_file_name = os.path.join(
+            self.global_config["working_dir"], f"search_{self.namespace}.json"
+        )
+        if is_namespace(self.namespace, NameSpace.VECTOR_STORE_ENTITIES):
+            self._load_search_index()
+
+    def _load_search_index(self):
+        """Load the search sidecar, building it from the vector data if missing"""
+        self._search_index = TrigramSearchIndex.load(
+            self._search_file_name, SEARCH_TEXT_FIELDS, SEARCH_STORED_FIELDS
+        )
+        if self._search_index is None:
+            self._search_index = TrigramSearchIndex(
+                SEARCH_TEXT_FIELDS, SEARCH_STORED_FIELDS
+            )
+            storage = getattr(self._client, "_NanoVectorDB__storage")
+            self._search_index.upsert({dp["__id__"]: dp for dp in storage["data"]})
+            if len(self._search_index):
+                self._search_index.save(self._search_file_name)
+
     async def initialize(self):
         """Initialize storage data"""
         # Get the update flag for cross-process update notification
@@ -72,6 +107,8 @@ class NanoVectorDBStorage(BaseVectorStorage):
                     self.embedding_func.embedding_dim,
                     storage_file=self._client_file_name,
                 )
+                if self._search_index is not None:
+                    self._load_search_index()
                 # Reset update flag
                 self.storage_updated.value = False
 
@@ -114,6 +151,8 @@ class NanoVectorDBStorage(BaseVectorStorage):
                 d["__vector__"] = embeddings[i]
             client = await self._get_client()
             results = client.upsert(datas=list_data)
+            if self._search_index is not None:
+                self._search_index.upsert({d["__id__"]: d for d in list_data})
             return results
         else:
             # sometimes the embedding is not returned correctly. just log it.
@@ -121,13 +160,43 @@ class NanoVectorDBStorage(BaseVectorStorage):
                 f"embedding is not 1-1 with data, {len(embeddings)} != {len(list_data)}"
             )
 
+    async def update_metadata(self, data: dict[str, dict[str, Any]]) -> None:
+        """Rewrite the meta fields of stored records in place, without embedding
+
+        Importance notes:
+        1. Changes will be persisted to disk during the next index_done_callback
+        2. Only one process should updating the storage at a time before index_done_callback,
+           KG-storage-log should be used to avoid data corruption
+        """
+        if not data:
+            return
+        client = await self._get_client()
+        records = client.get(set(data))
+        for record in records:
+            record.update(
+                {
+                    k: v
+                    for k, v in data[record["__id__"]].items()
+                    if k in self.meta_fields
+                }
+            )
+        if self._search_index is not None:
+            self._search_index.upsert({record["__id__"]: record for record in records})
+
     async def query(
-        self, query: str, top_k: int, ids: list[str] | None = None
+        self,
+        query: str,
+        top_k: int,
+        ids: list[str] | None = None,
+        query_embedding: np.ndarray | None = None,
     ) -> list[dict[str, Any]]:
         # Execute embedding outside of lock to avoid improve cocurrent
-        embedding = await self.embedding_func(
-            [query], _priority=5
-        )  # higher priority for query
+        # Embedding computed by the caller, or a higher priority call for query
+        embedding = (
+            np.array([query_embedding])
+            if query_embedding is not None
+            else await self.embedding_func([query], _priority=5)
+        )
         embedding = embedding[0]
 
         client = await self._get_client()
@@ -166,6 +235,8 @@ class NanoVectorDBStorage(BaseVectorStorage):
         try:
             client = await self._get_client()
             client.delete(ids)
+            if self._search_index is not None:
+                self._search_index.delete(ids)
             logger.debug(
                 f"Successfully deleted {len(ids)} vectors from {self.namespace}"
             )
@@ -190,6 +261,8 @@ class NanoVectorDBStorage(BaseVectorStorage):
             client = await self._get_client()
             if client.get([entity_id]):
                 client.delete([entity_id])
+                if self._search_index is not None:
+                    self._search_index.delete([entity_id])
                 logger.debug(f"Successfully deleted entity {entity_name}")
             else:
                 logger.debug(f"Entity {entity_name} not found in storage")
@@ -239,6 +312,8 @@ class NanoVectorDBStorage(BaseVectorStorage):
                     self.embedding_func.embedding_dim,
                     storage_file=self._client_file_name,
                 )
+                if self._search_index is not None:
+                    self._load_search_index()
                 # Reset update flag
                 self.storage_updated.value = False
                 return False  # Return error
@@ -248,6 +323,8 @@ class NanoVectorDBStorage(BaseVectorStorage):
             try:
                 # Save data to disk
                 self._client.save()
+                if self._search_index is not None:
+                    self._search_index.persist(self._search_file_name)
                 # Notify other processes that data has been updated
                 await set_all_update_flags(self.namespace)
                 # Reset own update flag to avoid self-reloading
@@ -330,11 +407,16 @@ class NanoVectorDBStorage(BaseVectorStorage):
                 # delete _client_file_name
                 if os.path.exists(self._client_file_name):
                     os.remove(self._client_file_name)
+                TrigramSearchIndex.remove_files(self._search_file_name)
 
                 self._client = NanoVectorDB(
                     self.embedding_func.embedding_dim,
                     storage_file=self._client_file_name,
                 )
+                if self._search_index is not None:
+                    self._search_index = TrigramSearchIndex(
+                        SEARCH_TEXT_FIELDS, SEARCH_STORED_FIELDS
+                    )
 
                 # Notify other processes that data has been updated
                 await set_all_update_flags(self.namespace)
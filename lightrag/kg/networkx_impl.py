@@ -144,6 +144,35 @@ class NetworkXStorage(BaseGraphStorage):
         graph = await self._get_graph()
         graph.add_edge(source_node_id, target_node_id, **edge_data)
 
+    async def upsert_nodes_batch(self, nodes: dict[str, dict[str, str]]) -> None:
+        graph = await self._get_graph()
+        graph.add_nodes_from(nodes.items())
+
+    async def upsert_edges_batch(
+        self, edges: list[tuple[str, str, dict[str, str]]]
+    ) -> None:
+        graph = await self._get_graph()
+        graph.add_edges_from(edges)
+
+    async def get_nodes_batch(self, node_ids: list[str]) -> dict[str, dict]:
+        graph = await self._get_graph()
+        return {
+            node_id: graph.nodes[node_id]
+            for node_id in node_ids
+            if graph.has_node(node_id)
+        }
+
+    async def get_edges_batch(
+        self, pairs: list[dict[str, str]]
+    ) -> dict[tuple[str, str], dict]:
+        graph = await self._get_graph()
+        result = {}
+        for pair in pairs:
+            edge = graph.edges.get((pair["src"], pair["tgt"]))
+            if edge is not None:
+                result[(pair["src"], pair["tgt"])] = edge
+        return result
+
     async def delete_node(self, node_id: str) -> None:
         """
         Importance notes:
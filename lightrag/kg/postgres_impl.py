@@ -20,6 +20,7 @@ from ..base import (
     BaseGraphStorage,
     BaseKVStorage,
     BaseVectorStorage,
+    DOC_SUMMARY_FIELDS,
     DocProcessingStatus,
     DocStatus,
     DocStatusStorage,
@@ -217,6 +218,26 @@ class PostgreSQLDB:
             logger.error(f"PostgreSQL database,\nsql:{sql},\ndata:{data},\nerror:{e}")
             raise
 
+    async def execute_in_transaction(
+        self,
+        sql: str,
+        with_age: bool = False,
+        graph_name: str | None = None,
+    ) -> None:
+        """Run one (possibly multi-statement) query in an explicit transaction.
+
+        Unlike `execute`, no error is swallowed: any failure rolls back every
+        statement of the query and is re-raised to the caller.
+        """
+        async with self.pool.acquire() as connection:  # type: ignore
+            if with_age and graph_name:
+                await self.configure_age(connection, graph_name)  # type: ignore
+            elif with_age and not graph_name:
+                raise ValueError("Graph name is required when with_age is True")
+
+            async with connection.transaction():
+                await connection.execute(sql)  # type: ignore
+
 
 class ClientManager:
     _instances: dict[str, Any] = {"db": None, "ref_count": 0}
@@ -340,6 +361,10 @@ class PGKVStorage(BaseKVStorage):
             return res if res else None
         else:
             response = await self.db.query(sql, params)
+            if response and is_namespace(
+                self.namespace, NameSpace.KV_STORE_DOC_GRAPH_REFS
+            ):
+                response["chunks"] = json.loads(response["chunks"])
             return response if response else None
 
     async def get_by_mode_and_id(self, mode: str, id: str) -> Union[dict, None]:
@@ -375,7 +400,11 @@ class PGKVStorage(BaseKVStorage):
                 dict_res[row["mode"]][row["id"]] = row
             return [{k: v} for k, v in dict_res.items()]
         else:
-            return await self.db.query(sql, params, multirows=True)
+            rows = await self.db.query(sql, params, multirows=True)
+            if is_namespace(self.namespace, NameSpace.KV_STORE_DOC_GRAPH_REFS):
+                for row in rows:
+                    row["chunks"] = json.loads(row["chunks"])
+            return rows
 
     async def get_by_status(self, status: str) -> Union[list[dict[str, Any]], None]:
         """Specifically for llm_response_cache."""
@@ -434,6 +463,15 @@ class PGKVStorage(BaseKVStorage):
                     }
 
                     await self.db.execute(upsert_sql, _data)
+        elif is_namespace(self.namespace, NameSpace.KV_STORE_DOC_GRAPH_REFS):
+            for k, v in data.items():
+                upsert_sql = SQL_TEMPLATES["upsert_doc_graph_refs"]
+                _data = {
+                    "id": k,
+                    "chunks": json.dumps(v["chunks"]),
+                    "workspace": self.db.workspace,
+                }
+                await self.db.execute(upsert_sql, _data)
 
     async def index_done_callback(self) -> None:
         # PG handles persistence automatically
@@ -642,11 +680,18 @@ class PGVectorStorage(BaseVectorStorage):
 
     #################### query method ###############
     async def query(
-        self, query: str, top_k: int, ids: list[str] | None = None
+        self,
+        query: str,
+        top_k: int,
+        ids: list[str] | None = None,
+        query_embedding: np.ndarray | None = None,
     ) -> list[dict[str, Any]]:
-        embeddings = await self.embedding_func(
-            [query], _priority=5
-        )  # higher priority for query
+        # Embedding computed by the caller, or a higher priority call for query
+        embeddings = (
+            np.array([query_embedding])
+            if query_embedding is not None
+            else await self.embedding_func([query], _priority=5)
+        )
         embedding = embeddings[0]
         embedding_string = ",".join(map(str, embedding))
         # Use parameterized document IDs (None means search across all documents)
@@ -949,6 +994,51 @@ class PGDocStatusStorage(DocStatusStorage):
         }
         return docs_by_status
 
+    async def get_docs_paginated(
+        self,
+        status: DocStatus | None = None,
+        search: str | None = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> tuple[int, list[tuple[str, dict[str, Any]]]]:
+        """Get one page of document summaries, newest updated first"""
+        params: dict[str, Any] = {"workspace": self.db.workspace}
+        conditions = ["workspace=$1"]
+        if status is not None:
+            params["status"] = status.value
+            conditions.append(f"status=${len(params)}")
+        if search:
+            params["search"] = f"%{search.strip()}%"
+            n = len(params)
+            conditions.append(
+                f"(id ILIKE ${n} OR file_path ILIKE ${n} OR content_summary ILIKE ${n})"
+            )
+        params["offset"] = offset
+        params["limit"] = limit
+        # COUNT(*) OVER() returns the total with the page, the content column is never read
+        sql = f"""SELECT id, status, content_summary, content_length, chunks_count,
+                         created_at, updated_at, file_path, COUNT(*) OVER() AS total
+                    FROM LIGHTRAG_DOC_STATUS
+                   WHERE {" AND ".join(conditions)}
+                   ORDER BY updated_at DESC
+                  OFFSET ${len(params) - 1} LIMIT ${len(params)}"""
+        result = await self.db.query(sql, params, True)
+        if not result:
+            if offset == 0:
+                return 0, []
+            # The requested page is past the end, count the matches separately
+            count_sql = f"""SELECT COUNT(1) AS total FROM LIGHTRAG_DOC_STATUS
+                             WHERE {" AND ".join(conditions)}"""
+            count_params = {
+                k: v for k, v in params.items() if k not in ("offset", "limit")
+            }
+            row = await self.db.query(count_sql, count_params)
+            return (row["total"] if row else 0), []
+        page = [
+            (row["id"], {k: row.get(k) for k in DOC_SUMMARY_FIELDS}) for row in result
+        ]
+        return result[0]["total"], page
+
     async def index_done_callback(self) -> None:
         # PG handles persistence automatically
         pass
@@ -1414,6 +1504,16 @@ class PGGraphStorage(BaseGraphStorage):
             node_id: The unique identifier for the node (used as label)
             node_data: Dictionary of node properties
         """
+        query = self._upsert_node_query(node_id, node_data)
+
+        try:
+            await self._query(query, readonly=False, upsert=True)
+
+        except Exception:
+            logger.error(f"POSTGRES, upsert_node error on node_id: `{node_id}`")
+            raise
+
+    def _upsert_node_query(self, node_id: str, node_data: dict[str, str]) -> str:
         if "entity_id" not in node_data:
             raise ValueError(
                 "PostgreSQL: node properties must contain an 'entity_id' field"
@@ -1422,7 +1522,7 @@ class PGGraphStorage(BaseGraphStorage):
         label = self._normalize_node_id(node_id)
         properties = self._format_properties(node_data)
 
-        query = """SELECT * FROM cypher('%s', $$
+        return """SELECT * FROM cypher('%s', $$
                      MERGE (n:base {entity_id: "%s"})
                      SET n += %s
                      RETURN n
@@ -1432,13 +1532,6 @@ class PGGraphStorage(BaseGraphStorage):
             properties,
         )
 
-        try:
-            await self._query(query, readonly=False, upsert=True)
-
-        except Exception:
-            logger.error(f"POSTGRES, upsert_node error on node_id: `{node_id}`")
-            raise
-
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -1455,11 +1548,25 @@ class PGGraphStorage(BaseGraphStorage):
             target_node_id (str): Label of the target node (used as identifier)
             edge_data (dict): dictionary of properties to set on the edge
         """
+        query = self._upsert_edge_query(source_node_id, target_node_id, edge_data)
+
+        try:
+            await self._query(query, readonly=False, upsert=True)
+
+        except Exception:
+            logger.error(
+                f"POSTGRES, upsert_edge error on edge: `{source_node_id}`-`{target_node_id}`"
+            )
+            raise
+
+    def _upsert_edge_query(
+        self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
+    ) -> str:
         src_label = self._normalize_node_id(source_node_id)
         tgt_label = self._normalize_node_id(target_node_id)
         edge_properties = self._format_properties(edge_data)
 
-        query = """SELECT * FROM cypher('%s', $$
+        return """SELECT * FROM cypher('%s', $$
                      MATCH (source:base {entity_id: "%s"})
                      WITH source
                      MATCH (target:base {entity_id: "%s"})
@@ -1475,14 +1582,102 @@ class PGGraphStorage(BaseGraphStorage):
             edge_properties,  # https://github.com/HKUDS/LightRAG/issues/1438#issuecomment-2826000195
         )
 
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type((PGGraphQueryException,)),
+    )
+    async def upsert_nodes_batch(self, nodes: dict[str, dict[str, str]]) -> None:
+        """
+        Upsert several nodes in one round trip.
+
+        AGE has no parameterized UNWIND, so the per-node MERGE statements are sent
+        together as one multi-statement query inside an explicit transaction.
+
+        Importance notes:
+        1. `execute` in upsert mode swallows UniqueViolationError, which would
+           silently drop the whole batch after the rollback, so the batch goes
+           through `execute_in_transaction` instead, which re-raises.
+        2. A unique violation (two writers MERGE-ing the same new node) rolls the
+           batch back; it is then retried node by node with `upsert_node`, so
+           only the conflicting node gets the single-item upsert semantics.
+
+        Args:
+            nodes: Mapping of node ID to node properties
+        """
+        if not nodes:
+            return
+        query = ";\n".join(
+            self._upsert_node_query(node_id, node_data)
+            for node_id, node_data in nodes.items()
+        )
+
         try:
-            await self._query(query, readonly=False, upsert=True)
+            await self._execute_batch(query)
+        except asyncpg.exceptions.UniqueViolationError as e:
+            logger.warning(
+                f"POSTGRES, upsert_nodes_batch rolled back ({e}), retrying {len(nodes)} nodes one by one"
+            )
+            for node_id, node_data in nodes.items():
+                await self.upsert_node(node_id, node_data)
+        except Exception:
+            logger.error(f"POSTGRES, upsert_nodes_batch error on {len(nodes)} nodes")
+            raise
 
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type((PGGraphQueryException,)),
+    )
+    async def upsert_edges_batch(
+        self, edges: list[tuple[str, str, dict[str, str]]]
+    ) -> None:
+        """
+        Upsert several edges in one round trip, see `upsert_nodes_batch`.
+
+        Args:
+            edges: List of (source node ID, target node ID, edge properties)
+        """
+        if not edges:
+            return
+        query = ";\n".join(
+            self._upsert_edge_query(source_node_id, target_node_id, edge_data)
+            for source_node_id, target_node_id, edge_data in edges
+        )
+
+        try:
+            await self._execute_batch(query)
+        except asyncpg.exceptions.UniqueViolationError as e:
+            logger.warning(
+                f"POSTGRES, upsert_edges_batch rolled back ({e}), retrying {len(edges)} edges one by one"
+            )
+            for source_node_id, target_node_id, edge_data in edges:
+                await self.upsert_edge(source_node_id, target_node_id, edge_data)
         except Exception:
-            logger.error(
-                f"POSTGRES, upsert_edge error on edge: `{source_node_id}`-`{target_node_id}`"
+            logger.error(f"POSTGRES, upsert_edges_batch error on {len(edges)} edges")
+            raise
+
+    async def _execute_batch(self, query: str) -> None:
+        """Run a multi-statement graph query in one transaction.
+
+        Unique violations are re-raised as is so the caller can fall back to per-item
+        upserts; other errors are wrapped in PGGraphQueryException like `_query`, so
+        the tenacity retry of the caller applies to them.
+        """
+        try:
+            await self.db.execute_in_transaction(
+                query, with_age=True, graph_name=self.graph_name
             )
+        except asyncpg.exceptions.UniqueViolationError:
             raise
+        except Exception as e:
+            raise PGGraphQueryException(
+                {
+                    "message": f"Error executing graph query: {query}",
+                    "wrapped": query,
+                    "detail": str(e),
+                }
+            ) from e
 
     async def delete_node(self, node_id: str) -> None:
         """
@@ -2177,6 +2372,7 @@ NAMESPACE_TABLE_MAP = {
     NameSpace.VECTOR_STORE_RELATIONSHIPS: "LIGHTRAG_VDB_RELATION",
     NameSpace.DOC_STATUS: "LIGHTRAG_DOC_STATUS",
     NameSpace.KV_STORE_LLM_RESPONSE_CACHE: "LIGHTRAG_LLM_CACHE",
+    NameSpace.KV_STORE_DOC_GRAPH_REFS: "LIGHTRAG_DOC_GRAPH_REFS",
 }
 
 
@@ -2255,6 +2451,16 @@ TABLES = {
 	                CONSTRAINT LIGHTRAG_LLM_CACHE_PK PRIMARY KEY (workspace, mode, id)
                     )"""
     },
+    "LIGHTRAG_DOC_GRAPH_REFS": {
+        "ddl": """CREATE TABLE LIGHTRAG_DOC_GRAPH_REFS (
+                    id VARCHAR(255),
+                    workspace VARCHAR(255),
+                    chunks JSONB,
+                    create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    update_time TIMESTAMP,
+	                CONSTRAINT LIGHTRAG_DOC_GRAPH_REFS_PK PRIMARY KEY (workspace, id)
+                    )"""
+    },
     "LIGHTRAG_DOC_STATUS": {
         "ddl": """CREATE TABLE LIGHTRAG_DOC_STATUS (
 	               workspace varchar(255) NOT NULL,
@@ -2298,12 +2504,23 @@ SQL_TEMPLATES = {
     "get_by_ids_llm_response_cache": """SELECT id, original_prompt, COALESCE(return_value, '') as "return", mode
                                  FROM LIGHTRAG_LLM_CACHE WHERE workspace=$1 AND mode= IN ({ids})
                                 """,
+    "get_by_id_doc_graph_refs": """SELECT id, chunks::text as chunks
+                                FROM LIGHTRAG_DOC_GRAPH_REFS WHERE workspace=$1 AND id=$2
+                            """,
+    "get_by_ids_doc_graph_refs": """SELECT id, chunks::text as chunks
+                                 FROM LIGHTRAG_DOC_GRAPH_REFS WHERE workspace=$1 AND id IN ({ids})
+                            """,
     "filter_keys": "SELECT id FROM {table_name} WHERE workspace=$1 AND id IN ({ids})",
     "upsert_doc_full": """INSERT INTO LIGHTRAG_DOC_FULL (id, content, workspace)
                         VALUES ($1, $2, $3)
                         ON CONFLICT (workspace,id) DO UPDATE
                            SET content = $2, update_time = CURRENT_TIMESTAMP
                        """,
+    "upsert_doc_graph_refs": """INSERT INTO LIGHTRAG_DOC_GRAPH_REFS (id, chunks, workspace)
+                        VALUES ($1, $2::jsonb, $3)
+                        ON CONFLICT (workspace,id) DO UPDATE
+                           SET chunks = $2::jsonb, update_time = CURRENT_TIMESTAMP
+                       """,
     "upsert_llm_response_cache": """INSERT INTO LIGHTRAG_LLM_CACHE(workspace,id,original_prompt,return_value,mode)
                                       VALUES ($1, $2, $3, $4, $5)
                                       ON CONFLICT (workspace,mode,id) DO UPDATE
@@ -0,0 +1,421 @@
+import json
+import os
+from itertools import islice
+from typing import Any, Iterable
+
+import numpy as np
+
+from lightrag.utils import load_json, logger, write_json
+
+
+# The change log is folded into the snapshot once it is larger than both
+# SEARCH_LOG_COMPACT_MIN_BYTES and SEARCH_LOG_COMPACT_RATIO times the snapshot
+SEARCH_LOG_COMPACT_MIN_BYTES = int(
+    os.getenv("SEARCH_LOG_COMPACT_MIN_BYTES", 4 * 1024 * 1024)
+)
+SEARCH_LOG_COMPACT_RATIO = float(os.getenv("SEARCH_LOG_COMPACT_RATIO", 0.5))
+
+# Changes applied after the postings were built are answered by a scan of the
+# changed records; past this many (or a tenth of the records) the postings are rebuilt
+SEARCH_REBUILD_MIN_CHANGES = 1000
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def log_file_name(file_name: str) -> str:
+    """Change log written next to a saved index"""
+    return os.path.splitext(file_name)[0] + ".wal.jsonl"
+
+
+def _file_stamp(file_name: str) -> tuple[int, int, int] | None:
+    try:
+        stat = os.stat(file_name)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class TrigramSearchIndex:
+    """Case-insensitive substring search over the text fields of stored records.
+
+    Only the display fields of each record are kept (never vectors), so the
+    sidecar file can be read by viewers without loading the vector store.
+
+    Importance notes:
+    1. Only `docs` is persisted. Trigram postings are derived data, built on the
+       first search as sorted numpy arrays of packed trigram keys and record numbers.
+       Writers (the vector storages) never search, so they only hold `docs`.
+    2. Texts are padded with NUL before taking trigrams, so every occurrence of a
+       one or two character query starts some trigram, and the trigrams starting
+       with the query are one contiguous key range: short queries are answered
+       exactly by a range slice. Three character queries are one key lookup;
+       longer ones intersect trigram postings and verify the candidates. Records
+       changed after the build are scanned until enough changes pile up to rebuild.
+    3. `persist` appends the records changed since the last write to a change log
+       (see `log_file_name`) instead of rewriting the sidecar, and folds the log
+       into a new snapshot once it grows past the compaction threshold. Every log
+       record holds the final value of its id, so replaying a log that is already
+       contained in the snapshot is harmless.
+    4. Viewers keep one index and call `refresh`, which applies only the log
+       records appended since the last call; the whole sidecar is read again only
+       when the snapshot itself was rewritten.
+    5. Ids ordered by a sort field are cached for empty queries and dropped on any
+       change.
+    """
+
+    def __init__(self, text_fields: Iterable[str], stored_fields: Iterable[str]):
+        self.text_fields = tuple(text_fields)
+        self.stored_fields = tuple(stored_fields)
+        self.docs: dict[str, dict[str, Any]] = {}
+        # Postings built by _ensure_postings on the first search. Characters are
+        # numbered by code point order (NUL is 0), a trigram's key is its three
+        # numbers in base _n_chars. _grams holds the sorted unique keys, the records
+        # of _grams[i] are _post_docs[_gram_starts[i]:_gram_starts[i + 1]], ascending
+        self._char_numbers: dict[str, int] = {}
+        self._n_chars = 0
+        self._packed = False
+        self._grams: np.ndarray | None = None
+        self._gram_starts: np.ndarray | None = None
+        self._post_docs: np.ndarray | None = None
+        self._doc_ids: list[str] = []
+        self._numbers: dict[str, int] = {}
+        self._alive: np.ndarray | None = None
+        # Records added or replaced after the postings were built, found by scanning
+        self._unindexed: set[str] = set()
+        self._changes_since_build = 0
+        # Ids changed since the last save / persist
+        self._dirty: set[str] = set()
+        # A torn log record was skipped at load, the next persist writes a snapshot
+        self._needs_snapshot = False
+        self._sorted_ids: dict[str, list[str]] = {}
+        # Snapshot read by load / refresh and the log bytes applied on top of it
+        self._snapshot_stamp: tuple[int, int, int] | None = None
+        self._log_offset = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _text_of(self, doc: dict[str, Any]) -> str:
+        return "\n".join(str(doc.get(field) or "") for field in self.text_fields).lower()
+
+    def _drop_postings(self) -> None:
+        self._grams = self._gram_starts = self._post_docs = self._alive = None
+        self._char_numbers = {}
+        self._n_chars = 0
+        self._doc_ids = []
+        self._numbers = {}
+        self._unindexed = set()
+        self._changes_since_build = 0
+
+    def _ensure_postings(self) -> None:
+        """Build the postings in one vectorized pass over all texts
+
+        Every text is followed by two NUL characters (NULs inside texts are dropped),
+        so each of its positions starts a trigram, the last ones padded with NUL.
+        Trigrams starting on the padding would span two records and are left out.
+        Each (trigram key, record number) pair is packed into one uint64, so a plain
+        sort orders and dedups the postings; argsort of the keys is several times
+        slower and only used when the packed pair would not fit.
+        """
+        if self._grams is not None and self._changes_since_build <= max(
+            SEARCH_REBUILD_MIN_CHANGES, len(self.docs) // 10
+        ):
+            return
+        self._drop_postings()
+        self._doc_ids = list(self.docs)
+        self._numbers = {doc_id: i for i, doc_id in enumerate(self._doc_ids)}
+        self._alive = np.ones(len(self._doc_ids), dtype=bool)
+        texts = [
+            self._text_of(self.docs[doc_id]).replace("\0", "") + "\0\0"
+            for doc_id in self._doc_ids
+        ]
+        doc_of = np.repeat(
+            np.arange(len(texts), dtype=np.int32), [len(t) for t in texts]
+        )[:-2]
+        codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+        del texts
+        present = np.flatnonzero(np.bincount(codes)) if len(codes) else np.zeros(1, np.int64)
+        self._char_numbers = {chr(code): i for i, code in enumerate(present.tolist())}
+        self._n_chars = n_chars = len(present)
+        number_of = np.zeros(int(present[-1]) + 1, dtype=np.uint32)
+        number_of[present] = np.arange(n_chars, dtype=np.uint32)
+        chars = number_of[codes]
+        del codes, number_of
+
+        valid = chars[:-2] != 0
+        keys = chars[:-2][valid].astype(np.uint64)
+        keys *= np.uint64(n_chars)
+        keys += chars[1:-1][valid]
+        keys *= np.uint64(n_chars)
+        keys += chars[2:][valid]
+        doc_of = doc_of[valid]
+        del chars, valid
+
+        doc_bits = max(1, (len(self._doc_ids) - 1).bit_length())
+        self._packed = n_chars**3 << doc_bits <= 1 << 64
+        if self._packed:
+            keys <<= np.uint64(doc_bits)
+            keys |= doc_of.astype(np.uint64)
+            keys.sort()
+            pairs = keys
+            del keys, doc_of
+            first = np.empty(len(pairs), dtype=bool)
+            first[:1] = True
+            np.not_equal(pairs[1:], pairs[:-1], out=first[1:])
+            pairs = pairs[first]
+            self._post_docs = (pairs & np.uint64((1 << doc_bits) - 1)).astype(np.int32)
+            keys = pairs >> np.uint64(doc_bits)
+            del pairs
+        else:
+            order = np.argsort(keys)
+            keys = keys[order]
+            self._post_docs = doc_of[order]
+            del order, doc_of
+        new_gram = np.empty(len(keys), dtype=bool)
+        new_gram[:1] = True
+        np.not_equal(keys[1:], keys[:-1], out=new_gram[1:])
+        self._gram_starts = np.append(np.flatnonzero(new_gram), len(keys))
+        self._grams = keys[new_gram]
+
+    def _docs_of(self, gram: str) -> np.ndarray:
+        """Sorted unique record numbers of the trigrams starting with gram (1 to 3 chars)"""
+        numbers = [self._char_numbers.get(c) for c in gram]
+        if None in numbers:
+            return np.zeros(0, dtype=np.int32)
+        numbers += [0] * (3 - len(gram))
+        low = (numbers[0] * self._n_chars + numbers[1]) * self._n_chars + numbers[2]
+        high = low + self._n_chars ** (3 - len(gram))
+        i, j = np.searchsorted(self._grams, np.array([low, high], dtype=np.uint64))
+        docs = self._post_docs[self._gram_starts[i] : self._gram_starts[j]]
+        # The records of one key are sorted and unique when built by the packed sort
+        return docs if j - i == 1 and self._packed else np.unique(docs)
+
+    def _put(self, doc_id: str, doc: dict[str, Any]) -> None:
+        if self._grams is not None:
+            number = self._numbers.get(doc_id)
+            if number is not None:
+                self._alive[number] = False
+            self._unindexed.add(doc_id)
+            self._changes_since_build += 1
+        self.docs[doc_id] = doc
+
+    def _remove(self, doc_id: str) -> None:
+        if self.docs.pop(doc_id, None) is not None and self._grams is not None:
+            number = self._numbers.get(doc_id)
+            if number is not None:
+                self._alive[number] = False
+            self._unindexed.discard(doc_id)
+            self._changes_since_build += 1
+
+    def upsert(self, records: dict[str, dict[str, Any]]) -> None:
+        """Insert or replace records, keeping only stored_fields of each one"""
+        for doc_id, record in records.items():
+            self._put(doc_id, {k: record[k] for k in self.stored_fields if k in record})
+            self._dirty.add(doc_id)
+        self._sorted_ids.clear()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        for doc_id in ids:
+            if doc_id not in self.docs:
+                continue
+            self._remove(doc_id)
+            self._dirty.add(doc_id)
+        self._sorted_ids.clear()
+
+    def _ordered_by(self, sort_field: str) -> list[str]:
+        ids = self._sorted_ids.get(sort_field)
+        if ids is None:
+            ids = sorted(
+                self.docs, key=lambda doc_id: str(self.docs[doc_id].get(sort_field) or "")
+            )
+            self._sorted_ids[sort_field] = ids
+        return ids
+
+    def _match(self, query: str) -> set[str]:
+        self._ensure_postings()
+        if len(query) <= 3:
+            # All trigrams starting with a short query form one key range
+            numbers = self._docs_of(query)
+        else:
+            postings = sorted((self._docs_of(gram) for gram in _trigrams(query)), key=len)
+            numbers = postings[0]
+            for p in postings[1:]:
+                if not len(numbers):
+                    break
+                numbers = np.intersect1d(numbers, p, assume_unique=True)
+        numbers = numbers[self._alive[numbers]]
+        matches = {self._doc_ids[i] for i in numbers.tolist()}
+        if len(query) > 3:
+            matches = {
+                doc_id
+                for doc_id in matches
+                if query in self._text_of(self.docs[doc_id])
+            }
+        matches.update(
+            doc_id
+            for doc_id in self._unindexed
+            if query in self._text_of(self.docs[doc_id])
+        )
+        return matches
+
+    def search(
+        self, query: str, offset: int = 0, limit: int = 20, sort_field: str | None = None
+    ) -> tuple[int, list[dict[str, Any]]]:
+        """Find records whose text fields contain the query
+
+        Args:
+            query: Substring to look for, case-insensitive. Empty matches everything
+            offset: Number of matches to skip
+            limit: Maximum number of matches to return
+            sort_field: Matches whose sort_field equals the query come first, then those
+                whose sort_field contains it, then the rest
+
+        Returns:
+            (total number of matches, records of the requested page with an "id" key)
+        """
+        query = query.strip().lower()
+        if not query:
+            total = len(self.docs)
+            if sort_field is None:
+                page = list(islice(self.docs, offset, offset + limit))
+            else:
+                page = self._ordered_by(sort_field)[offset : offset + limit]
+        else:
+            matches = list(self._match(query))
+            total = len(matches)
+            if sort_field is not None:
+
+                def rank(doc_id: str):
+                    value = str(self.docs[doc_id].get(sort_field) or "")
+                    lowered = value.lower()
+                    if lowered == query:
+                        return (0, value)
+                    if query in lowered:
+                        return (1, value)
+                    return (2, value)
+
+                matches.sort(key=rank)
+            page = matches[offset : offset + limit]
+
+        return total, [{**self.docs[doc_id], "id": doc_id} for doc_id in page]
+
+    def save(self, file_name: str) -> None:
+        """Write a full snapshot and drop the change log it now contains"""
+        write_json({"docs": self.docs}, file_name)
+        if os.path.exists(log_file_name(file_name)):
+            os.remove(log_file_name(file_name))
+        self._dirty.clear()
+        self._needs_snapshot = False
+        self._snapshot_stamp = _file_stamp(file_name)
+        self._log_offset = 0
+
+    def persist(self, file_name: str) -> None:
+        """Append the records changed since the last write to the change log"""
+        if self._needs_snapshot or not os.path.exists(file_name):
+            self.save(file_name)
+            return
+        if not self._dirty:
+            return
+        log_file = log_file_name(file_name)
+        with open(log_file, "a", encoding="utf-8") as f:
+            for doc_id in self._dirty:
+                if doc_id in self.docs:
+                    record = {"op": "set", "k": doc_id, "v": self.docs[doc_id]}
+                else:
+                    record = {"op": "del", "k": doc_id}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._dirty.clear()
+        if os.path.getsize(log_file) >= max(
+            SEARCH_LOG_COMPACT_MIN_BYTES,
+            SEARCH_LOG_COMPACT_RATIO * os.path.getsize(file_name),
+        ):
+            self.save(file_name)
+
+    @staticmethod
+    def remove_files(file_name: str) -> None:
+        """Delete a saved index together with its change log"""
+        for name in (file_name, log_file_name(file_name)):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def _apply_log_tail(self, log_file: str) -> int:
+        """Apply the complete log records after _log_offset, returns how many were applied
+
+        Readers may run while a writer appends, so an unterminated last line is left
+        for the next call. For a writer it can only be the torn tail of a crashed
+        append, so it (like an unparsable complete line) makes the next persist
+        write a snapshot instead of appending after it.
+        """
+        if not os.path.exists(log_file):
+            return 0
+        with open(log_file, "rb") as f:
+            f.seek(self._log_offset)
+            tail = f.read()
+        applied = 0
+        lines = tail.split(b"\n")
+        if lines[-1]:
+            self._needs_snapshot = True
+        for line in lines[:-1]:
+            self._log_offset += len(line) + 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                self._needs_snapshot = True
+                continue
+            if record["op"] == "set":
+                self._put(record["k"], record["v"])
+            else:
+                self._remove(record["k"])
+            applied += 1
+        if applied:
+            self._sorted_ids.clear()
+        return applied
+
+    def _read(self, file_name: str) -> int:
+        """Replace the contents with the snapshot plus its log, returns log records applied"""
+        self._snapshot_stamp = _file_stamp(file_name)
+        self.docs = (load_json(file_name) or {}).get("docs", {})
+        self._drop_postings()
+        self._sorted_ids.clear()
+        self._log_offset = 0
+        return self._apply_log_tail(log_file_name(file_name))
+
+    def refresh(self, file_name: str) -> bool:
+        """Pick up changes written since the last load / refresh, returns True if any
+
+        Only the new log records are applied, unless the snapshot was rewritten
+        (compaction, drop) or the log shrank, then the whole sidecar is read again.
+        """
+        log_file = log_file_name(file_name)
+        log_size = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+        if _file_stamp(file_name) != self._snapshot_stamp or log_size < self._log_offset:
+            if not os.path.exists(file_name):
+                # Dropped, forget the records until a new snapshot is written
+                changed = bool(self.docs)
+                self.docs = {}
+                self._drop_postings()
+                self._sorted_ids.clear()
+                self._snapshot_stamp = None
+                self._log_offset = 0
+                return changed
+            self._read(file_name)
+            return True
+        return self._apply_log_tail(log_file) > 0
+
+    @classmethod
+    def load(
+        cls, file_name: str, text_fields: Iterable[str], stored_fields: Iterable[str]
+    ) -> "TrigramSearchIndex | None":
+        """Load an index saved by `save` / `persist`, returns None if the file does not exist"""
+        if not os.path.exists(file_name):
+            return None
+        index = cls(text_fields, stored_fields)
+        replayed = index._read(file_name)
+        logger.info(
+            f"Loaded search index {file_name} with {len(index)} records ({replayed} log records)"
+        )
+        return index
@@ -44,6 +44,16 @@ _data_init_lock: Optional[LockType] = None
 # async locks for coroutine synchronization in multiprocess mode
 _async_locks: Optional[Dict[str, asyncio.Lock]] = None
 
+# keyed locks: owner token of every key held by any process (multiprocess mode only)
+_keyed_lock_owners: Optional[Dict[str, str]] = None
+# per-process asyncio locks of keyed locks: key -> [lock, number of users]
+_local_keyed_locks: Dict[str, list] = {}
+_keyed_lock_counter = 0
+
+# number of merges running under the shared graph db lock, see get_graph_db_shared_lock
+_graph_readers: Any = None
+_graph_readers_lock: Optional[LockType] = None
+
 
 class UnifiedLock(Generic[T]):
     """Provide a unified lock interface type for asyncio.Lock and multiprocessing.Lock"""
@@ -248,9 +258,12 @@ def get_pipeline_status_lock(enable_logging: bool = False) -> UnifiedLock:
 
 
 def get_graph_db_lock(enable_logging: bool = False) -> UnifiedLock:
-    """return unified graph database lock for ensuring atomic operations"""
+    """return unified graph database lock for ensuring atomic operations
+
+    Also waits for merges holding get_graph_db_shared_lock to finish.
+    """
     async_lock = _async_locks.get("graph_db_lock") if _is_multiprocess else None
-    return UnifiedLock(
+    return GraphDBExclusiveLock(
         lock=_graph_db_lock,
         is_async=not _is_multiprocess,
         name="graph_db_lock",
@@ -259,6 +272,162 @@ def get_graph_db_lock(enable_logging: bool = False) -> UnifiedLock:
     )
 
 
+class _Counter:
+    """Single process stand-in for a Manager Value"""
+
+    def __init__(self, value: int = 0):
+        self.value = value
+
+
+class KeyedLock:
+    """Lock a set of keys, e.g. the entities touched by one merge
+
+    Keys are acquired one by one in sorted order, so tasks locking overlapping
+    key sets cannot deadlock. Within a process each key is an asyncio.Lock that
+    exists only while someone uses it. In multiprocess mode a key is also claimed
+    in a Manager dict (setdefault is atomic in the manager process) and waiters
+    poll until the owner releases it. A key whose owner process died is taken over.
+    """
+
+    _POLL_MIN = 0.005
+    _POLL_MAX = 0.1
+
+    def __init__(self, namespace: str, keys, enable_logging: bool = False):
+        self._keys = sorted({f"{namespace}:{key}" for key in keys})
+        self._held: list[str] = []
+        self._enable_logging = enable_logging
+
+    async def __aenter__(self) -> "KeyedLock":
+        try:
+            for key in self._keys:
+                await self._acquire(key)
+                self._held.append(key)
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        while self._held:
+            key = self._held.pop()
+            if _keyed_lock_owners is not None:
+                _keyed_lock_owners.pop(key, None)
+            entry = _local_keyed_locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _local_keyed_locks[key]
+
+    async def _acquire(self, key: str) -> None:
+        global _keyed_lock_counter
+        entry = _local_keyed_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _local_keyed_locks[key]
+            raise
+        if _keyed_lock_owners is None:
+            return
+
+        _keyed_lock_counter += 1
+        token = f"{os.getpid()}:{_keyed_lock_counter}"
+        delay = self._POLL_MIN
+        try:
+            while True:
+                owner = _keyed_lock_owners.setdefault(key, token)
+                if owner == token:
+                    return
+                if not _process_alive(int(owner.split(":", 1)[0])):
+                    direct_log(
+                        f"Process {os.getpid()} taking over keyed lock '{key}' from dead owner {owner}",
+                        level="WARNING",
+                    )
+                    _keyed_lock_owners.pop(key, None)
+                    continue
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self._POLL_MAX)
+        except BaseException:
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _local_keyed_locks[key]
+            raise
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def get_keyed_lock(
+    keys, namespace: str = "graph", enable_logging: bool = False
+) -> KeyedLock:
+    """return a lock over the given keys, works in single and multiprocess mode"""
+    return KeyedLock(namespace, keys, enable_logging=enable_logging)
+
+
+class GraphDBSharedLock:
+    """Shared side of the graph db lock
+
+    Merges hold this while they lock individual entities with get_keyed_lock, so
+    any number of them run at once. Holders of get_graph_db_lock (whole-graph
+    edits) wait until no shared holder is left, and block new ones meanwhile.
+    """
+
+    async def __aenter__(self) -> "GraphDBSharedLock":
+        # Passing through the plain graph db lock waits out a running graph edit
+        async_lock = _async_locks.get("graph_db_lock") if _is_multiprocess else None
+        async with UnifiedLock(
+            lock=_graph_db_lock,
+            is_async=not _is_multiprocess,
+            name="graph_db_lock",
+            enable_logging=False,
+            async_lock=async_lock,
+        ):
+            _change_graph_readers(1)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        _change_graph_readers(-1)
+
+
+def _change_graph_readers(delta: int) -> None:
+    if _graph_readers_lock is None:
+        _graph_readers.value += delta
+    else:
+        with _graph_readers_lock:
+            _graph_readers.value += delta
+
+
+class GraphDBExclusiveLock(UnifiedLock):
+    """The graph db lock, additionally waiting for shared holders to finish"""
+
+    async def __aenter__(self) -> "GraphDBExclusiveLock":
+        await super().__aenter__()
+        try:
+            delay = KeyedLock._POLL_MIN
+            while _graph_readers is not None and _graph_readers.value > 0:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, KeyedLock._POLL_MAX)
+        except BaseException:
+            await super().__aexit__(None, None, None)
+            raise
+        return self
+
+
+def get_graph_db_shared_lock() -> GraphDBSharedLock:
+    """return the shared graph db lock for operations that lock entities individually"""
+    return GraphDBSharedLock()
+
+
 def get_data_init_lock(enable_logging: bool = False) -> UnifiedLock:
     """return unified data initialization lock for ensuring atomic data initialization"""
     async_lock = _async_locks.get("data_init_lock") if _is_multiprocess else None
@@ -302,7 +471,10 @@ def initialize_share_data(workers: int = 1):
         _init_flags, \
         _initialized, \
         _update_flags, \
-        _async_locks
+        _async_locks, \
+        _keyed_lock_owners, \
+        _graph_readers, \
+        _graph_readers_lock
 
     # Check if already initialized
     if _initialized:
@@ -324,6 +496,9 @@ def initialize_share_data(workers: int = 1):
         _shared_dicts = _manager.dict()
         _init_flags = _manager.dict()
         _update_flags = _manager.dict()
+        _keyed_lock_owners = _manager.dict()
+        _graph_readers = _manager.Value("i", 0)
+        _graph_readers_lock = _manager.Lock()
 
         # Initialize async locks for multiprocess mode
         _async_locks = {
@@ -347,6 +522,9 @@ def initialize_share_data(workers: int = 1):
         _shared_dicts = {}
         _init_flags = {}
         _update_flags = {}
+        _keyed_lock_owners = None  # Process-local asyncio locks are enough
+        _graph_readers = _Counter()
+        _graph_readers_lock = None
         _async_locks = None  # No need for async locks in single process mode
         direct_log(f"Process {os.getpid()} Shared-Data created for Single Process")
 
@@ -377,6 +555,8 @@ async def initialize_pipeline_status():
                 "docs": 0,  # Total number of documents to be indexed
                 "batchs": 0,  # Number of batches for processing documents
                 "cur_batch": 0,  # Current processing batch
+                "chunks": 0,  # Total number of chunks of the documents started so far
+                "cur_chunk": 0,  # Number of chunks already extracted
                 "request_pending": False,  # Flag for pending request for processing
                 "latest_message": "",  # Latest message from pipeline processing
                 "history_messages": history_messages,  # 使用共享列表对象
@@ -535,7 +715,10 @@ def finalize_share_data():
         _init_flags, \
         _initialized, \
         _update_flags, \
-        _async_locks
+        _async_locks, \
+        _keyed_lock_owners, \
+        _graph_readers, \
+        _graph_readers_lock
 
     # Check if already initialized
     if not _initialized:
@@ -601,5 +784,9 @@ def finalize_share_data():
     _data_init_lock = None
     _update_flags = None
     _async_locks = None
+    _keyed_lock_owners = None
+    _graph_readers = None
+    _graph_readers_lock = None
+    _local_keyed_locks.clear()
 
     direct_log(f"Process {os.getpid()} storage data finalization complete")
@@ -47,6 +47,9 @@ from .operate import (
     chunking_by_token_size,
     extract_entities,
     merge_nodes_and_edges,
+    process_summary_queue,
+    remove_chunks_from_graph,
+    SummaryQueue,
     kg_query,
     mix_kg_vector_query,
     naive_query,
@@ -62,10 +65,19 @@ from .utils import (
     convert_response_to_json,
     lazy_external_import,
     priority_limit_async_func_call,
+    ChunkScheduler,
+    ReadThroughKVCache,
+    rate_limit_async_func_call,
+    AdaptiveRateLimiter,
     get_content_summary,
     clean_text,
     check_storage_env_vars,
     logger,
+    PipelineStage,
+    StageMetrics,
+    run_pipeline_stages,
+    with_description_tokens,
+    get_query_cache_metrics,
 )
 from .types import KnowledgeGraph
 from dotenv import load_dotenv
@@ -125,6 +137,12 @@ class LightRAG:
         default=int(os.getenv("FORCE_LLM_SUMMARY_ON_MERGE", 6))
     )
 
+    summary_growth_ratio: float = field(
+        default=float(os.getenv("SUMMARY_GROWTH_RATIO", 0.2))
+    )
+    """Re-summarize a description only when the fragments added since its last summary
+    reach this ratio of the chunks already summarized. 0 summarizes on every merge."""
+
     # Text chunking
     # ---
 
@@ -173,7 +191,9 @@ class LightRAG:
         - `tokens`: The number of tokens in the chunk.
         - `content`: The text content of the chunk.
 
-    Defaults to `chunking_by_token_size` if not specified.
+    Defaults to `chunking_by_token_size` if not specified. Its keyword-only options snap chunk ends to
+    sentence or paragraph boundaries and encode very large documents in worker processes, e.g.
+    `partial(chunking_by_token_size, snap_to="sentence", workers=4)`.
     """
 
     # Embedding
@@ -198,11 +218,21 @@ class LightRAG:
         }
     )
     """Configuration for embedding cache.
-    - enabled: If True, enables caching to avoid redundant computations.
+    - enabled: If True, kg, naive and mix queries missing the exact cache are answered from the cached answer of the most similar earlier question.
     - similarity_threshold: Minimum similarity score to use cached embeddings.
     - use_llm_check: If True, validates cached embeddings using an LLM.
+    See `query_cache_metrics` for hit rates.
     """
 
+    embedding_rate_limit: dict[str, Any] = field(
+        default_factory=lambda: {
+            "requests_per_second": float(os.getenv("EMBEDDING_RPS", 0)),
+            "tokens_per_minute": float(os.getenv("EMBEDDING_TPM", 0)),
+            "latency_target": float(os.getenv("EMBEDDING_LATENCY_TARGET", 0)),
+        }
+    )
+    """Rate limit shared by all embedding calls of this instance, see `llm_rate_limit`."""
+
     # LLM Configuration
     # ---
 
@@ -218,9 +248,30 @@ class LightRAG:
     llm_model_max_async: int = field(default=int(os.getenv("MAX_ASYNC", 4)))
     """Maximum number of concurrent LLM calls."""
 
+    llm_query_reserved_slots: int = field(
+        default=int(os.getenv("LLM_QUERY_RESERVED_SLOTS", 1))
+    )
+    """LLM slots chunk extraction never takes, so queries are not queued behind an ingest.
+    Chunks of all documents share the remaining `llm_model_max_async - llm_query_reserved_slots` slots (at least 1).
+    """
+
     llm_model_kwargs: dict[str, Any] = field(default_factory=dict)
     """Additional keyword arguments passed to the LLM model function."""
 
+    llm_rate_limit: dict[str, Any] = field(
+        default_factory=lambda: {
+            "requests_per_second": float(os.getenv("LLM_RPS", 0)),
+            "tokens_per_minute": float(os.getenv("LLM_TPM", 0)),
+            "latency_target": float(os.getenv("LLM_LATENCY_TARGET", 0)),
+        }
+    )
+    """Rate limit shared by all LLM calls of this instance.
+    - requests_per_second: Request budget, 0 disables it.
+    - tokens_per_minute: Prompt plus completion token budget, 0 disables it.
+    - latency_target: Seconds; slower calls shrink the concurrency window, 0 disables it.
+    Concurrency adapts between 1 and `llm_model_max_async`, halving on HTTP 429.
+    """
+
     # Storage
     # ---
 
@@ -237,12 +288,23 @@ class LightRAG:
     enable_llm_cache_for_entity_extract: bool = field(default=True)
     """If True, enables caching for entity extraction steps to reduce LLM costs."""
 
+    chunk_cache_size: int = field(default=int(os.getenv("CHUNK_CACHE_SIZE", 4096)))
+    """Number of text chunks kept in the read-through LRU cache in front of `text_chunks`, 0 disables it."""
+
     # Extensions
     # ---
 
     max_parallel_insert: int = field(default=int(os.getenv("MAX_PARALLEL_INSERT", 2)))
     """Maximum number of parallel insert operations."""
 
+    replace_documents_by_file_path: bool = field(
+        default=os.getenv("REPLACE_DOCUMENTS_BY_FILE_PATH", "false").lower() == "true"
+    )
+    """If True, a new document with the file path of a processed document is a new version of it:
+    only its changed chunks are extracted and the previous version is removed.
+    Only enable this when file paths identify documents, not when they are citation labels.
+    """
+
     addon_params: dict[str, Any] = field(
         default_factory=lambda: {
             "language": os.getenv("SUMMARY_LANGUAGE", PROMPTS["DEFAULT_LANGUAGE"])
@@ -337,10 +399,25 @@ class LightRAG:
         _print_config = ",\n  ".join([f"{k} = {v}" for k, v in global_config.items()])
         logger.debug(f"LightRAG init with param:\n  {_print_config}\n")
 
+        # Init rate limiters, shared by every call of this instance
+        def count_tokens(text: str) -> int:
+            return len(self.tokenizer.encode(text))
+
+        self.embedding_rate_limiter = AdaptiveRateLimiter(
+            self.embedding_func_max_async, **self.embedding_rate_limit
+        )
+        self.llm_rate_limiter = AdaptiveRateLimiter(
+            self.llm_model_max_async, **self.llm_rate_limit
+        )
+
         # Init Embedding
         self.embedding_func = priority_limit_async_func_call(
             self.embedding_func_max_async
-        )(self.embedding_func)
+        )(
+            rate_limit_async_func_call(self.embedding_rate_limiter, count_tokens)(
+                self.embedding_func
+            )
+        )
 
         # Initialize all storages
         self.key_string_value_json_storage_cls: type[BaseKVStorage] = (
@@ -387,6 +464,17 @@ class LightRAG:
             ),
             embedding_func=self.embedding_func,
         )
+        if self.chunk_cache_size > 0:
+            # Hot chunks are read by most queries, serve them from memory
+            self.text_chunks = ReadThroughKVCache(self.text_chunks, self.chunk_cache_size)  # type: ignore
+        self.doc_graph_refs: BaseKVStorage = self.key_string_value_json_storage_cls(  # type: ignore
+            namespace=make_namespace(
+                self.namespace_prefix, NameSpace.KV_STORE_DOC_GRAPH_REFS
+            ),
+            embedding_func=self.embedding_func,
+        )
+        """Per document: its chunks and the entities and relations extracted from each"""
+
         self.chunk_entity_relation_graph: BaseGraphStorage = self.graph_storage_cls(  # type: ignore
             namespace=make_namespace(
                 self.namespace_prefix, NameSpace.GRAPH_STORE_CHUNK_ENTITY_RELATION
@@ -399,7 +487,7 @@ class LightRAG:
                 self.namespace_prefix, NameSpace.VECTOR_STORE_ENTITIES
             ),
             embedding_func=self.embedding_func,
-            meta_fields={"entity_name", "source_id", "content", "file_path"},
+            meta_fields={"entity_name", "entity_type", "source_id", "content", "file_path"},
         )
         self.relationships_vdb: BaseVectorStorage = self.vector_db_storage_cls(  # type: ignore
             namespace=make_namespace(
@@ -427,13 +515,20 @@ class LightRAG:
         hashing_kv = self.llm_response_cache
 
         self.llm_model_func = priority_limit_async_func_call(self.llm_model_max_async)(
-            partial(
-                self.llm_model_func,  # type: ignore
-                hashing_kv=hashing_kv,
-                **self.llm_model_kwargs,
+            rate_limit_async_func_call(self.llm_rate_limiter, count_tokens)(
+                partial(
+                    self.llm_model_func,  # type: ignore
+                    hashing_kv=hashing_kv,
+                    **self.llm_model_kwargs,
+                )
             )
         )
 
+        # Chunks of all documents are extracted through one scheduler
+        self.chunk_scheduler = ChunkScheduler(
+            self.llm_model_max_async - self.llm_query_reserved_slots
+        )
+
         self._storages_status = StoragesStatus.CREATED
 
         if self.auto_manage_storages_states:
@@ -476,6 +571,7 @@ class LightRAG:
             for storage in (
                 self.full_docs,
                 self.text_chunks,
+                self.doc_graph_refs,
                 self.entities_vdb,
                 self.relationships_vdb,
                 self.chunks_vdb,
@@ -499,6 +595,7 @@ class LightRAG:
             for storage in (
                 self.full_docs,
                 self.text_chunks,
+                self.doc_graph_refs,
                 self.entities_vdb,
                 self.relationships_vdb,
                 self.chunks_vdb,
@@ -849,8 +946,11 @@ class LightRAG:
                         "docs": 0,
                         "batchs": 0,  # Total number of files to be processed
                         "cur_batch": 0,  # Number of files already processed
+                        "chunks": 0,  # Number of chunks of the started files
+                        "cur_chunk": 0,  # Number of chunks already extracted
                         "request_pending": False,  # Clear any previous request
                         "latest_message": "",
+                        "stage_metrics": {},  # Throughput of each ingestion stage
                     }
                 )
                 # Cleaning history_messages without breaking it as a shared list object
@@ -863,6 +963,9 @@ class LightRAG:
                 )
                 return
 
+        # Descriptions to summarize, shared by all documents of this run
+        summary_queue = SummaryQueue()
+
         try:
             # Process documents until no more documents or requests
             while True:
@@ -893,227 +996,35 @@ class LightRAG:
                 job_name = f"{path_prefix}[{total_files} files]"
                 pipeline_status["job_name"] = job_name
 
-                # Create a counter to track the number of processed files
-                processed_count = 0
-                # Create a semaphore to limit the number of concurrent file processing
-                semaphore = asyncio.Semaphore(self.max_parallel_insert)
-
-                async def process_document(
-                    doc_id: str,
-                    status_doc: DocProcessingStatus,
-                    split_by_character: str | None,
-                    split_by_character_only: bool,
-                    pipeline_status: dict,
-                    pipeline_status_lock: asyncio.Lock,
-                    semaphore: asyncio.Semaphore,
-                ) -> None:
-                    """Process single document"""
-                    file_extraction_stage_ok = False
-                    async with semaphore:
-                        nonlocal processed_count
-                        current_file_number = 0
-                        try:
-                            # Get file path from status document
-                            file_path = getattr(
-                                status_doc, "file_path", "unknown_source"
-                            )
-
-                            async with pipeline_status_lock:
-                                # Update processed file count and save current file number
-                                processed_count += 1
-                                current_file_number = (
-                                    processed_count  # Save the current file number
-                                )
-                                pipeline_status["cur_batch"] = processed_count
-
-                                log_message = f"Extracting stage {current_file_number}/{total_files}: {file_path}"
-                                logger.info(log_message)
-                                pipeline_status["history_messages"].append(log_message)
-                                log_message = f"Processing d-id: {doc_id}"
-                                logger.info(log_message)
-                                pipeline_status["latest_message"] = log_message
-                                pipeline_status["history_messages"].append(log_message)
-
-                            # Generate chunks from document
-                            chunks: dict[str, Any] = {
-                                compute_mdhash_id(dp["content"], prefix="chunk-"): {
-                                    **dp,
-                                    "full_doc_id": doc_id,
-                                    "file_path": file_path,  # Add file path to each chunk
-                                }
-                                for dp in self.chunking_func(
-                                    self.tokenizer,
-                                    status_doc.content,
-                                    split_by_character,
-                                    split_by_character_only,
-                                    self.chunk_overlap_token_size,
-                                    self.chunk_token_size,
-                                )
-                            }
-
-                            # Process document (text chunks and full docs) in parallel
-                            # Create tasks with references for potential cancellation
-                            doc_status_task = asyncio.create_task(
-                                self.doc_status.upsert(
-                                    {
-                                        doc_id: {
-                                            "status": DocStatus.PROCESSING,
-                                            "chunks_count": len(chunks),
-                                            "content": status_doc.content,
-                                            "content_summary": status_doc.content_summary,
-                                            "content_length": status_doc.content_length,
-                                            "created_at": status_doc.created_at,
-                                            "updated_at": datetime.now().isoformat(),
-                                            "file_path": file_path,
-                                        }
-                                    }
-                                )
-                            )
-                            chunks_vdb_task = asyncio.create_task(
-                                self.chunks_vdb.upsert(chunks)
-                            )
-                            entity_relation_task = asyncio.create_task(
-                                self._process_entity_relation_graph(
-                                    chunks, pipeline_status, pipeline_status_lock
-                                )
-                            )
-                            full_docs_task = asyncio.create_task(
-                                self.full_docs.upsert(
-                                    {doc_id: {"content": status_doc.content}}
-                                )
-                            )
-                            text_chunks_task = asyncio.create_task(
-                                self.text_chunks.upsert(chunks)
-                            )
-                            tasks = [
-                                doc_status_task,
-                                chunks_vdb_task,
-                                entity_relation_task,
-                                full_docs_task,
-                                text_chunks_task,
-                            ]
-                            await asyncio.gather(*tasks)
-                            file_extraction_stage_ok = True
-
-                        except Exception as e:
-                            # Log error and update pipeline status
-                            error_msg = f"Failed to extrat document {doc_id}: {traceback.format_exc()}"
-                            logger.error(error_msg)
-                            async with pipeline_status_lock:
-                                pipeline_status["latest_message"] = error_msg
-                                pipeline_status["history_messages"].append(error_msg)
-
-                                # Cancel other tasks as they are no longer meaningful
-                                for task in [
-                                    chunks_vdb_task,
-                                    entity_relation_task,
-                                    full_docs_task,
-                                    text_chunks_task,
-                                ]:
-                                    if not task.done():
-                                        task.cancel()
-
-                            # Update document status to failed
-                            await self.doc_status.upsert(
-                                {
-                                    doc_id: {
-                                        "status": DocStatus.FAILED,
-                                        "error": str(e),
-                                        "content": status_doc.content,
-                                        "content_summary": status_doc.content_summary,
-                                        "content_length": status_doc.content_length,
-                                        "created_at": status_doc.created_at,
-                                        "updated_at": datetime.now().isoformat(),
-                                        "file_path": file_path,
-                                    }
-                                }
-                            )
-
-                    # Semphore was released here
-
-                    if file_extraction_stage_ok:
-                        try:
-                            # Get chunk_results from entity_relation_task
-                            chunk_results = await entity_relation_task
-                            await merge_nodes_and_edges(
-                                chunk_results=chunk_results,  # result collected from entity_relation_task
-                                knowledge_graph_inst=self.chunk_entity_relation_graph,
-                                entity_vdb=self.entities_vdb,
-                                relationships_vdb=self.relationships_vdb,
-                                global_config=asdict(self),
-                                pipeline_status=pipeline_status,
-                                pipeline_status_lock=pipeline_status_lock,
-                                llm_response_cache=self.llm_response_cache,
-                                current_file_number=current_file_number,
-                                total_files=total_files,
-                                file_path=file_path,
-                            )
-
-                            await self.doc_status.upsert(
-                                {
-                                    doc_id: {
-                                        "status": DocStatus.PROCESSED,
-                                        "chunks_count": len(chunks),
-                                        "content": status_doc.content,
-                                        "content_summary": status_doc.content_summary,
-                                        "content_length": status_doc.content_length,
-                                        "created_at": status_doc.created_at,
-                                        "updated_at": datetime.now().isoformat(),
-                                        "file_path": file_path,
-                                    }
-                                }
-                            )
-
-                            # Call _insert_done after processing each file
-                            await self._insert_done()
-
-                            async with pipeline_status_lock:
-                                log_message = f"Completed processing file {current_file_number}/{total_files}: {file_path}"
-                                logger.info(log_message)
-                                pipeline_status["latest_message"] = log_message
-                                pipeline_status["history_messages"].append(log_message)
-
-                        except Exception as e:
-                            # Log error and update pipeline status
-                            error_msg = f"Merging stage failed in document {doc_id}: {traceback.format_exc()}"
-                            logger.error(error_msg)
-                            async with pipeline_status_lock:
-                                pipeline_status["latest_message"] = error_msg
-                                pipeline_status["history_messages"].append(error_msg)
-
-                            # Update document status to failed
-                            await self.doc_status.upsert(
-                                {
-                                    doc_id: {
-                                        "status": DocStatus.FAILED,
-                                        "error": str(e),
-                                        "content": status_doc.content,
-                                        "content_summary": status_doc.content_summary,
-                                        "content_length": status_doc.content_length,
-                                        "created_at": status_doc.created_at,
-                                        "updated_at": datetime.now().isoformat(),
-                                        "file_path": file_path,
-                                    }
-                                }
-                            )
-
-                # Create processing tasks for all documents
-                doc_tasks = []
-                for doc_id, status_doc in to_process_docs.items():
-                    doc_tasks.append(
-                        process_document(
-                            doc_id,
-                            status_doc,
-                            split_by_character,
-                            split_by_character_only,
-                            pipeline_status,
-                            pipeline_status_lock,
-                            semaphore,
-                        )
-                    )
+                await self._process_documents_in_stages(
+                    to_process_docs,
+                    split_by_character,
+                    split_by_character_only,
+                    pipeline_status,
+                    pipeline_status_lock,
+                    summary_queue,
+                )
 
-                # Wait for all document processing to complete
-                await asyncio.gather(*doc_tasks)
+                # Summarize the descriptions queued by the merges of all documents
+                try:
+                    await process_summary_queue(
+                        summary_queue,
+                        knowledge_graph_inst=self.chunk_entity_relation_graph,
+                        entity_vdb=self.entities_vdb,
+                        relationships_vdb=self.relationships_vdb,
+                        global_config=asdict(self),
+                        pipeline_status=pipeline_status,
+                        pipeline_status_lock=pipeline_status_lock,
+                        llm_response_cache=self.llm_response_cache,
+                    )
+                    await self._insert_done()
+                except Exception:
+                    # Descriptions stay merged but unsummarized, documents are not affected
+                    error_msg = f"Summarizing descriptions failed: {traceback.format_exc()}"
+                    logger.error(error_msg)
+                    async with pipeline_status_lock:
+                        pipeline_status["latest_message"] = error_msg
+                        pipeline_status["history_messages"].append(error_msg)
 
                 # Check if there's a pending request to process more documents (with lock)
                 has_pending_request = False
@@ -1152,8 +1063,361 @@ class LightRAG:
                 pipeline_status["latest_message"] = log_message
                 pipeline_status["history_messages"].append(log_message)
 
+    async def _process_documents_in_stages(
+        self,
+        to_process_docs: dict[str, DocProcessingStatus],
+        split_by_character: str | None,
+        split_by_character_only: bool,
+        pipeline_status: dict,
+        pipeline_status_lock: asyncio.Lock,
+        summary_queue: SummaryQueue,
+    ) -> None:
+        """Run documents through the chunk -> embed -> extract -> merge -> persist stages
+
+        Stages are connected by bounded queues and work on different documents at
+        the same time: extraction moves on to the next document while the previous
+        one is merged, so the LLM is not left idle at document boundaries.
+        A document failing in any stage is marked FAILED and leaves the pipeline.
+        Stage throughput is published in pipeline_status["stage_metrics"].
+        """
+        total_files = len(to_process_docs)
+        processed_count = 0
+        previous_versions = await self._find_previous_versions(to_process_docs)
+
+        async def set_failed(doc: dict[str, Any], error_msg: str, e: Exception) -> None:
+            logger.error(error_msg)
+            async with pipeline_status_lock:
+                pipeline_status["latest_message"] = error_msg
+                pipeline_status["history_messages"].append(error_msg)
+            status_doc = doc["status_doc"]
+            await self.doc_status.upsert(
+                {
+                    doc["doc_id"]: {
+                        "status": DocStatus.FAILED,
+                        "error": str(e),
+                        "content": status_doc.content,
+                        "content_summary": status_doc.content_summary,
+                        "content_length": status_doc.content_length,
+                        "created_at": status_doc.created_at,
+                        "updated_at": datetime.now().isoformat(),
+                        "file_path": doc["file_path"],
+                    }
+                }
+            )
+
+        async def chunk_stage(doc: dict[str, Any]) -> dict[str, Any] | None:
+            nonlocal processed_count
+            doc_id, status_doc, file_path = doc["doc_id"], doc["status_doc"], doc["file_path"]
+            try:
+                async with pipeline_status_lock:
+                    # Update processed file count and save current file number
+                    processed_count += 1
+                    doc["current_file_number"] = processed_count
+                    pipeline_status["cur_batch"] = processed_count
+
+                    log_message = f"Extracting stage {processed_count}/{total_files}: {file_path}"
+                    logger.info(log_message)
+                    pipeline_status["history_messages"].append(log_message)
+                    log_message = f"Processing d-id: {doc_id}"
+                    logger.info(log_message)
+                    pipeline_status["latest_message"] = log_message
+                    pipeline_status["history_messages"].append(log_message)
+
+                # Generate chunks from document, in a thread so that encoding a long
+                # document (possibly in worker processes) does not block the loop
+                # running the embed and extract stages and concurrent queries
+                chunks = await asyncio.to_thread(
+                    self.chunking_func,
+                    self.tokenizer,
+                    status_doc.content,
+                    split_by_character,
+                    split_by_character_only,
+                    self.chunk_overlap_token_size,
+                    self.chunk_token_size,
+                )
+                doc["chunks"] = {
+                    compute_mdhash_id(dp["content"], prefix="chunk-"): {
+                        **dp,
+                        "full_doc_id": doc_id,
+                        "file_path": file_path,  # Add file path to each chunk
+                    }
+                    for dp in chunks
+                }
+                if doc_id in previous_versions:
+                    await self._diff_previous_version(doc, previous_versions[doc_id])
+                    log_message = (
+                        f"Document {doc_id} replaces {doc['previous_doc_id']}: "
+                        f"{len(doc['kept_chunk_refs'])} chunks unchanged, "
+                        f"{len(doc['changed_chunks'])} to extract, "
+                        f"{len(doc['removed_chunk_refs'])} removed"
+                    )
+                    logger.info(log_message)
+                    async with pipeline_status_lock:
+                        pipeline_status["latest_message"] = log_message
+                        pipeline_status["history_messages"].append(log_message)
+
+                async with pipeline_status_lock:
+                    pipeline_status["chunks"] = pipeline_status.get("chunks", 0) + len(
+                        doc.get("changed_chunks", doc["chunks"])
+                    )
+
+                await self.doc_status.upsert(
+                    {
+                        doc_id: {
+                            "status": DocStatus.PROCESSING,
+                            "chunks_count": len(doc["chunks"]),
+                            "content": status_doc.content,
+                            "content_summary": status_doc.content_summary,
+                            "content_length": status_doc.content_length,
+                            "created_at": status_doc.created_at,
+                            "updated_at": datetime.now().isoformat(),
+                            "file_path": file_path,
+                        }
+                    }
+                )
+                return doc
+            except Exception as e:
+                await set_failed(
+                    doc, f"Failed to chunk document {doc_id}: {traceback.format_exc()}", e
+                )
+                return None
+
+        async def embed_stage(doc: dict[str, Any]) -> dict[str, Any] | None:
+            try:
+                # Unchanged chunks of a new version keep their vectors, only their
+                # full_doc_id moves to the new document
+                changed = doc.get("changed_chunks", doc["chunks"])
+                kept = {
+                    chunk_id: chunk
+                    for chunk_id, chunk in doc["chunks"].items()
+                    if chunk_id not in changed
+                }
+                await asyncio.gather(
+                    self.chunks_vdb.upsert(changed),
+                    self.chunks_vdb.update_metadata(kept),
+                    self.full_docs.upsert(
+                        {doc["doc_id"]: {"content": doc["status_doc"].content}}
+                    ),
+                    self.text_chunks.upsert(doc["chunks"]),
+                )
+                return doc
+            except Exception as e:
+                await set_failed(
+                    doc,
+                    f"Failed to store chunks of document {doc['doc_id']}: {traceback.format_exc()}",
+                    e,
+                )
+                return None
+
+        async def extract_stage(doc: dict[str, Any]) -> dict[str, Any] | None:
+            try:
+                # Unchanged chunks of a new version keep what was extracted from them
+                doc["chunk_results"] = await self._process_entity_relation_graph(
+                    doc.get("changed_chunks", doc["chunks"]),
+                    pipeline_status,
+                    pipeline_status_lock,
+                )
+                return doc
+            except Exception as e:
+                await set_failed(
+                    doc,
+                    f"Failed to extrat document {doc['doc_id']}: {traceback.format_exc()}",
+                    e,
+                )
+                return None
+
+        async def merge_stage(doc: dict[str, Any]) -> dict[str, Any] | None:
+            try:
+                if "previous_doc_id" in doc:
+                    await self._retract_removed_chunks(doc)
+                await merge_nodes_and_edges(
+                    chunk_results=doc.pop("chunk_results"),
+                    knowledge_graph_inst=self.chunk_entity_relation_graph,
+                    entity_vdb=self.entities_vdb,
+                    relationships_vdb=self.relationships_vdb,
+                    global_config=asdict(self),
+                    pipeline_status=pipeline_status,
+                    pipeline_status_lock=pipeline_status_lock,
+                    llm_response_cache=self.llm_response_cache,
+                    current_file_number=doc["current_file_number"],
+                    total_files=total_files,
+                    file_path=doc["file_path"],
+                    summary_queue=summary_queue,
+                    doc_id=doc["doc_id"],
+                    chunk_ids=list(doc.get("changed_chunks", doc["chunks"])),
+                    doc_graph_refs=self.doc_graph_refs,
+                    kept_chunk_refs=doc.get("kept_chunk_refs"),
+                )
+                if "previous_doc_id" in doc:
+                    # The unchanged chunks and their index entries now belong to doc_id
+                    previous_doc_id = doc["previous_doc_id"]
+                    await self.full_docs.delete([previous_doc_id])
+                    await self.doc_status.delete([previous_doc_id])
+                    await self.doc_graph_refs.delete([previous_doc_id])
+                return doc
+            except Exception as e:
+                await set_failed(
+                    doc,
+                    f"Merging stage failed in document {doc['doc_id']}: {traceback.format_exc()}",
+                    e,
+                )
+                return None
+
+        async def persist_stage(docs: list[dict[str, Any]]) -> list[dict[str, Any]]:
+            # Documents merged meanwhile are persisted together with one _insert_done
+            await self.doc_status.upsert(
+                {
+                    doc["doc_id"]: {
+                        "status": DocStatus.PROCESSED,
+                        "chunks_count": len(doc["chunks"]),
+                        "content": doc["status_doc"].content,
+                        "content_summary": doc["status_doc"].content_summary,
+                        "content_length": doc["status_doc"].content_length,
+                        "created_at": doc["status_doc"].created_at,
+                        "updated_at": datetime.now().isoformat(),
+                        "file_path": doc["file_path"],
+                    }
+                    for doc in docs
+                }
+            )
+            await self._insert_done()
+
+            async with pipeline_status_lock:
+                for doc in docs:
+                    log_message = f"Completed processing file {doc['current_file_number']}/{total_files}: {doc['file_path']}"
+                    logger.info(log_message)
+                    pipeline_status["latest_message"] = log_message
+                    pipeline_status["history_messages"].append(log_message)
+            return docs
+
+        def publish_metrics(metrics: dict[str, StageMetrics]) -> None:
+            pipeline_status["stage_metrics"] = {
+                name: stage_metrics.snapshot() for name, stage_metrics in metrics.items()
+            }
+
+        docs = [
+            {
+                "doc_id": doc_id,
+                "status_doc": status_doc,
+                "file_path": getattr(status_doc, "file_path", "unknown_source"),
+            }
+            for doc_id, status_doc in to_process_docs.items()
+        ]
+        # Chunks of all documents in the extract stage share the chunk scheduler.
+        # The stage takes up to llm_model_max_async documents, so small documents
+        # or the tail of a large one leave no slot unused.
+        workers = self.max_parallel_insert
+        metrics = await run_pipeline_stages(
+            docs,
+            [
+                PipelineStage("chunk", chunk_stage),
+                PipelineStage("embed", embed_stage, workers),
+                PipelineStage(
+                    "extract",
+                    extract_stage,
+                    max(workers, self.llm_model_max_async),
+                ),
+                PipelineStage("merge", merge_stage, workers),
+                PipelineStage("persist", persist_stage, batch=True),
+            ],
+            queue_size=workers,
+            count_units=lambda doc: len(doc.get("chunks", ())),
+            on_update=publish_metrics,
+        )
+        for name, stage_metrics in metrics.items():
+            logger.info(f"Pipeline stage {name}: {stage_metrics.snapshot()}")
+
+    async def _find_previous_versions(
+        self, docs: dict[str, DocProcessingStatus]
+    ) -> dict[str, str]:
+        """Map documents to the processed document they are a new version of
+
+        Only with replace_documents_by_file_path: a document with the same file
+        path as a processed document replaces it.
+        When several pending documents share a file path, only the most recently
+        created one is treated as the new version. Documents without a file path
+        have no versions.
+        """
+        if not self.replace_documents_by_file_path:
+            return {}
+        latest_pending = {}
+        for doc_id, status_doc in sorted(docs.items(), key=lambda item: item[1].created_at):
+            if status_doc.file_path and status_doc.file_path != "unknown_source":
+                latest_pending[status_doc.file_path] = doc_id
+        if not latest_pending:
+            return {}
+
+        processed = await self.doc_status.get_docs_by_status(DocStatus.PROCESSED)
+        latest_processed = {}
+        for doc_id, status_doc in sorted(
+            processed.items(), key=lambda item: item[1].updated_at
+        ):
+            if status_doc.file_path in latest_pending:
+                latest_processed[status_doc.file_path] = doc_id
+        return {
+            latest_pending[file_path]: previous_doc_id
+            for file_path, previous_doc_id in latest_processed.items()
+        }
+
+    async def _diff_previous_version(self, doc: dict[str, Any], previous_doc_id: str) -> None:
+        """Compare the chunks of a document with those of its previous version
+
+        Chunk IDs are content hashes, so a chunk of the new version with the same
+        ID as a chunk of the previous version is unchanged. Sets on doc:
+        - previous_doc_id: ID of the replaced document
+        - changed_chunks: chunks that are new in this version, to extract
+        - kept_chunk_refs: doc_graph_refs entries of the unchanged chunks
+        - removed_chunk_refs: doc_graph_refs entries of the chunks no longer present
+        """
+        refs = await self.doc_graph_refs.get_by_id(previous_doc_id)
+        if refs is None:
+            refs = await self._scan_doc_graph_refs(previous_doc_id)
+        previous_chunks = refs["chunks"]
+
+        doc["previous_doc_id"] = previous_doc_id
+        doc["changed_chunks"] = {
+            chunk_id: chunk
+            for chunk_id, chunk in doc["chunks"].items()
+            if chunk_id not in previous_chunks
+        }
+        doc["kept_chunk_refs"] = {
+            chunk_id: chunk_refs
+            for chunk_id, chunk_refs in previous_chunks.items()
+            if chunk_id in doc["chunks"]
+        }
+        doc["removed_chunk_refs"] = {
+            chunk_id: chunk_refs
+            for chunk_id, chunk_refs in previous_chunks.items()
+            if chunk_id not in doc["chunks"]
+        }
+
+    async def _retract_removed_chunks(self, doc: dict[str, Any]) -> None:
+        """Remove the chunks a new version dropped, and their graph contributions"""
+        removed = doc["removed_chunk_refs"]
+        if not removed:
+            return
+        entity_names = sorted(
+            {name for chunk in removed.values() for name in chunk["entities"]}
+        )
+        relation_pairs = sorted(
+            {tuple(pair) for chunk in removed.values() for pair in chunk["relations"]}
+        )
+        await self.chunks_vdb.delete(list(removed))
+        await self.text_chunks.delete(list(removed))
+        await remove_chunks_from_graph(
+            set(removed),
+            entity_names,
+            relation_pairs,
+            self.chunk_entity_relation_graph,
+            self.entities_vdb,
+            self.relationships_vdb,
+        )
+
     async def _process_entity_relation_graph(
-        self, chunk: dict[str, Any], pipeline_status=None, pipeline_status_lock=None
+        self,
+        chunk: dict[str, Any],
+        pipeline_status=None,
+        pipeline_status_lock=None,
     ) -> list:
         try:
             chunk_results = await extract_entities(
@@ -1162,6 +1426,7 @@ class LightRAG:
                 pipeline_status=pipeline_status,
                 pipeline_status_lock=pipeline_status_lock,
                 llm_response_cache=self.llm_response_cache,
+                chunk_scheduler=self.chunk_scheduler,
             )
             return chunk_results
         except Exception as e:
@@ -1180,6 +1445,7 @@ class LightRAG:
             for storage_inst in [  # type: ignore
                 self.full_docs,
                 self.text_chunks,
+                self.doc_graph_refs,
                 self.llm_response_cache,
                 self.entities_vdb,
                 self.relationships_vdb,
@@ -1271,7 +1537,8 @@ class LightRAG:
                 }
                 # Insert node data into the knowledge graph
                 await self.chunk_entity_relation_graph.upsert_node(
-                    entity_name, node_data=node_data
+                    entity_name,
+                    node_data=with_description_tokens(dict(node_data), self.tokenizer),
                 )
                 node_data["entity_name"] = entity_name
                 all_entities_data.append(node_data)
@@ -1301,24 +1568,30 @@ class LightRAG:
                     ):
                         await self.chunk_entity_relation_graph.upsert_node(
                             need_insert_id,
-                            node_data={
-                                "entity_id": need_insert_id,
-                                "source_id": source_id,
-                                "description": "UNKNOWN",
-                                "entity_type": "UNKNOWN",
-                            },
+                            node_data=with_description_tokens(
+                                {
+                                    "entity_id": need_insert_id,
+                                    "source_id": source_id,
+                                    "description": "UNKNOWN",
+                                    "entity_type": "UNKNOWN",
+                                },
+                                self.tokenizer,
+                            ),
                         )
 
                 # Insert edge into the knowledge graph
                 await self.chunk_entity_relation_graph.upsert_edge(
                     src_id,
                     tgt_id,
-                    edge_data={
-                        "weight": weight,
-                        "description": description,
-                        "keywords": keywords,
-                        "source_id": source_id,
-                    },
+                    edge_data=with_description_tokens(
+                        {
+                            "weight": weight,
+                            "description": description,
+                            "keywords": keywords,
+                            "source_id": source_id,
+                        },
+                        self.tokenizer,
+                    ),
                 )
                 edge_data: dict[str, str] = {
                     "src_id": src_id,
@@ -1460,6 +1733,8 @@ class LightRAG:
             )
         else:
             raise ValueError(f"Unknown mode {param.mode}")
+        if hasattr(response, "__aiter__"):
+            return self._stream_then_query_done(response)
         await self._query_done()
         return response
 
@@ -1511,12 +1786,31 @@ class LightRAG:
             hashing_kv=self.llm_response_cache,
         )
 
+        if hasattr(response, "__aiter__"):
+            return self._stream_then_query_done(response)
         await self._query_done()
         return response
 
     async def _query_done(self):
         await self.llm_response_cache.index_done_callback()
 
+    async def _stream_then_query_done(
+        self, stream: AsyncIterator[str]
+    ) -> AsyncIterator[str]:
+        """A streamed answer is cached when its stream ends, persist the cache after that.
+
+        The inner stream is closed even when the caller stops reading early, so the
+        LLM response behind it is released instead of waiting for garbage collection.
+        """
+        try:
+            async for part in stream:
+                yield part
+            await self._query_done()
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
     async def aclear_cache(self, modes: list[str] | None = None) -> None:
         """Clear cache data from the LLM response cache storage.
 
@@ -1570,6 +1864,15 @@ class LightRAG:
         """Synchronous version of aclear_cache."""
         return always_get_an_event_loop().run_until_complete(self.aclear_cache(modes))
 
+    def query_cache_metrics(self) -> dict[str, Any]:
+        """Hit rates, lookup latency and LLM-rejected semantic hits of the query cache
+        since this instance was created, see `embedding_cache_config`.
+
+        `false_hit_rate` counts the semantic candidates rejected by the LLM check, so
+        it is only meaningful when `use_llm_check` is enabled; otherwise it is always 0.
+        """
+        return get_query_cache_metrics(self.llm_response_cache).snapshot()
+
     async def get_docs_by_status(
         self, status: DocStatus
     ) -> dict[str, DocProcessingStatus]:
@@ -1660,248 +1963,105 @@ class LightRAG:
 
             logger.debug(f"Starting deletion for document {doc_id}")
 
-            # 2. Get all chunks related to this document
-            # Find all chunks where full_doc_id equals the current doc_id
-            all_chunks = await self.text_chunks.get_all()
-            related_chunks = {
-                chunk_id: chunk_data
-                for chunk_id, chunk_data in all_chunks.items()
-                if isinstance(chunk_data, dict)
-                and chunk_data.get("full_doc_id") == doc_id
-            }
+            # 2. Get the chunks of this document and what was extracted from them
+            refs = await self.doc_graph_refs.get_by_id(doc_id)
+            if refs is None:
+                refs = await self._scan_doc_graph_refs(doc_id)
 
-            if not related_chunks:
+            chunk_ids = set(refs["chunks"])
+            if not chunk_ids:
                 logger.warning(f"No chunks found for document {doc_id}")
                 return
+            entity_names = sorted(
+                {name for chunk in refs["chunks"].values() for name in chunk["entities"]}
+            )
+            relation_pairs = sorted(
+                {
+                    tuple(pair)
+                    for chunk in refs["chunks"].values()
+                    for pair in chunk["relations"]
+                }
+            )
+            logger.debug(
+                f"Found {len(chunk_ids)} chunks, {len(entity_names)} entities and {len(relation_pairs)} relations to check"
+            )
 
-            # Get all related chunk IDs
-            chunk_ids = set(related_chunks.keys())
-            logger.debug(f"Found {len(chunk_ids)} chunks to delete")
-
-            # TODO: self.entities_vdb.client_storage only works for local storage, need to fix this
-
-            # 3. Before deleting, check the related entities and relationships for these chunks
-            for chunk_id in chunk_ids:
-                # Check entities
-                entities_storage = await self.entities_vdb.client_storage
-                entities = [
-                    dp
-                    for dp in entities_storage["data"]
-                    if chunk_id in dp.get("source_id")
-                ]
-                logger.debug(f"Chunk {chunk_id} has {len(entities)} related entities")
-
-                # Check relationships
-                relationships_storage = await self.relationships_vdb.client_storage
-                relations = [
-                    dp
-                    for dp in relationships_storage["data"]
-                    if chunk_id in dp.get("source_id")
-                ]
-                logger.debug(f"Chunk {chunk_id} has {len(relations)} related relations")
-
-            # Continue with the original deletion process...
-
-            # 4. Delete chunks from vector database
-            if chunk_ids:
-                await self.chunks_vdb.delete(chunk_ids)
-                await self.text_chunks.delete(chunk_ids)
-
-            # 5. Find and process entities and relationships that have these chunks as source
-            # Get all nodes and edges from the graph storage using storage-agnostic methods
-            entities_to_delete = set()
-            entities_to_update = {}  # entity_name -> new_source_id
-            relationships_to_delete = set()
-            relationships_to_update = {}  # (src, tgt) -> new_source_id
-
-            # Process entities - use storage-agnostic methods
-            all_labels = await self.chunk_entity_relation_graph.get_all_labels()
-            for node_label in all_labels:
-                node_data = await self.chunk_entity_relation_graph.get_node(node_label)
-                if node_data and "source_id" in node_data:
-                    # Split source_id using GRAPH_FIELD_SEP
-                    sources = set(node_data["source_id"].split(GRAPH_FIELD_SEP))
-                    sources.difference_update(chunk_ids)
-                    if not sources:
-                        entities_to_delete.add(node_label)
-                        logger.debug(
-                            f"Entity {node_label} marked for deletion - no remaining sources"
-                        )
-                    else:
-                        new_source_id = GRAPH_FIELD_SEP.join(sources)
-                        entities_to_update[node_label] = new_source_id
-                        logger.debug(
-                            f"Entity {node_label} will be updated with new source_id: {new_source_id}"
-                        )
-
-            # Process relationships
-            for node_label in all_labels:
-                node_edges = await self.chunk_entity_relation_graph.get_node_edges(
-                    node_label
-                )
-                if node_edges:
-                    for src, tgt in node_edges:
-                        edge_data = await self.chunk_entity_relation_graph.get_edge(
-                            src, tgt
-                        )
-                        if edge_data and "source_id" in edge_data:
-                            # Split source_id using GRAPH_FIELD_SEP
-                            sources = set(edge_data["source_id"].split(GRAPH_FIELD_SEP))
-                            sources.difference_update(chunk_ids)
-                            if not sources:
-                                relationships_to_delete.add((src, tgt))
-                                logger.debug(
-                                    f"Relationship {src}-{tgt} marked for deletion - no remaining sources"
-                                )
-                            else:
-                                new_source_id = GRAPH_FIELD_SEP.join(sources)
-                                relationships_to_update[(src, tgt)] = new_source_id
-                                logger.debug(
-                                    f"Relationship {src}-{tgt} will be updated with new source_id: {new_source_id}"
-                                )
-
-            # Delete entities
-            if entities_to_delete:
-                for entity in entities_to_delete:
-                    await self.entities_vdb.delete_entity(entity)
-                    logger.debug(f"Deleted entity {entity} from vector DB")
-                await self.chunk_entity_relation_graph.remove_nodes(
-                    list(entities_to_delete)
-                )
-                logger.debug(f"Deleted {len(entities_to_delete)} entities from graph")
-
-            # Update entities
-            for entity, new_source_id in entities_to_update.items():
-                node_data = await self.chunk_entity_relation_graph.get_node(entity)
-                if node_data:
-                    node_data["source_id"] = new_source_id
-                    await self.chunk_entity_relation_graph.upsert_node(
-                        entity, node_data
-                    )
-                    logger.debug(
-                        f"Updated entity {entity} with new source_id: {new_source_id}"
-                    )
-
-            # Delete relationships
-            if relationships_to_delete:
-                for src, tgt in relationships_to_delete:
-                    rel_id_0 = compute_mdhash_id(src + tgt, prefix="rel-")
-                    rel_id_1 = compute_mdhash_id(tgt + src, prefix="rel-")
-                    await self.relationships_vdb.delete([rel_id_0, rel_id_1])
-                    logger.debug(f"Deleted relationship {src}-{tgt} from vector DB")
-                await self.chunk_entity_relation_graph.remove_edges(
-                    list(relationships_to_delete)
-                )
-                logger.debug(
-                    f"Deleted {len(relationships_to_delete)} relationships from graph"
-                )
-
-            # Update relationships
-            for (src, tgt), new_source_id in relationships_to_update.items():
-                edge_data = await self.chunk_entity_relation_graph.get_edge(src, tgt)
-                if edge_data:
-                    edge_data["source_id"] = new_source_id
-                    await self.chunk_entity_relation_graph.upsert_edge(
-                        src, tgt, edge_data
-                    )
-                    logger.debug(
-                        f"Updated relationship {src}-{tgt} with new source_id: {new_source_id}"
-                    )
+            # 3. Delete chunks from vector database
+            await self.chunks_vdb.delete(list(chunk_ids))
+            await self.text_chunks.delete(list(chunk_ids))
+
+            # 4. Remove the chunks from the sources of their entities and relationships,
+            #    deleting those left without any source
+            (
+                deleted_entities,
+                deleted_relations,
+                updated_entities,
+                updated_relations,
+            ) = await remove_chunks_from_graph(
+                chunk_ids,
+                entity_names,
+                relation_pairs,
+                self.chunk_entity_relation_graph,
+                self.entities_vdb,
+                self.relationships_vdb,
+            )
 
-            # 6. Delete original document and status
+            # 5. Delete original document, status and index record
             await self.full_docs.delete([doc_id])
             await self.doc_status.delete([doc_id])
+            await self.doc_graph_refs.delete([doc_id])
 
-            # 7. Ensure all indexes are updated
+            # 6. Ensure all indexes are updated
             await self._insert_done()
 
             logger.info(
                 f"Successfully deleted document {doc_id} and related data. "
-                f"Deleted {len(entities_to_delete)} entities and {len(relationships_to_delete)} relationships. "
-                f"Updated {len(entities_to_update)} entities and {len(relationships_to_update)} relationships."
+                f"Deleted {deleted_entities} entities and {deleted_relations} relationships. "
+                f"Updated {updated_entities} entities and {updated_relations} relationships."
             )
 
-            async def process_data(data_type, vdb, chunk_id):
-                # Check data (entities or relationships)
-                storage = await vdb.client_storage
-                data_with_chunk = [
-                    dp
-                    for dp in storage["data"]
-                    if chunk_id in (dp.get("source_id") or "").split(GRAPH_FIELD_SEP)
-                ]
-
-                data_for_vdb = {}
-                if data_with_chunk:
-                    logger.warning(
-                        f"found {len(data_with_chunk)} {data_type} still referencing chunk {chunk_id}"
-                    )
-
-                    for item in data_with_chunk:
-                        old_sources = item["source_id"].split(GRAPH_FIELD_SEP)
-                        new_sources = [src for src in old_sources if src != chunk_id]
-
-                        if not new_sources:
-                            logger.info(
-                                f"{data_type} {item.get('entity_name', 'N/A')} is deleted because source_id is not exists"
-                            )
-                            await vdb.delete_entity(item)
-                        else:
-                            item["source_id"] = GRAPH_FIELD_SEP.join(new_sources)
-                            item_id = item["__id__"]
-                            data_for_vdb[item_id] = item.copy()
-                            if data_type == "entities":
-                                data_for_vdb[item_id]["content"] = data_for_vdb[
-                                    item_id
-                                ].get("content") or (
-                                    item.get("entity_name", "")
-                                    + (item.get("description") or "")
-                                )
-                            else:  # relationships
-                                data_for_vdb[item_id]["content"] = data_for_vdb[
-                                    item_id
-                                ].get("content") or (
-                                    (item.get("keywords") or "")
-                                    + (item.get("src_id") or "")
-                                    + (item.get("tgt_id") or "")
-                                    + (item.get("description") or "")
-                                )
-
-                    if data_for_vdb:
-                        await vdb.upsert(data_for_vdb)
-                        logger.info(f"Successfully updated {data_type} in vector DB")
-
-            # Add verification step
-            async def verify_deletion():
-                # Verify if the document has been deleted
-                if await self.full_docs.get_by_id(doc_id):
-                    logger.warning(f"Document {doc_id} still exists in full_docs")
-
-                # Verify if chunks have been deleted
-                all_remaining_chunks = await self.text_chunks.get_all()
-                remaining_related_chunks = {
-                    chunk_id: chunk_data
-                    for chunk_id, chunk_data in all_remaining_chunks.items()
-                    if isinstance(chunk_data, dict)
-                    and chunk_data.get("full_doc_id") == doc_id
-                }
-
-                if remaining_related_chunks:
-                    logger.warning(
-                        f"Found {len(remaining_related_chunks)} remaining chunks"
-                    )
-
-                # Verify entities and relationships
-                for chunk_id in chunk_ids:
-                    await process_data("entities", self.entities_vdb, chunk_id)
-                    await process_data(
-                        "relationships", self.relationships_vdb, chunk_id
-                    )
-
-            await verify_deletion()
-
         except Exception as e:
             logger.error(f"Error while deleting document {doc_id}: {e}")
 
+    async def _scan_doc_graph_refs(self, doc_id: str) -> dict[str, Any]:
+        """Build the doc_graph_refs record of a document inserted before the index existed
+
+        Scans all chunks and all graph nodes, use only as a fallback.
+        """
+        all_chunks = await self.text_chunks.get_all()
+        chunk_ids = {
+            chunk_id
+            for chunk_id, chunk_data in all_chunks.items()
+            if isinstance(chunk_data, dict) and chunk_data.get("full_doc_id") == doc_id
+        }
+        chunks = {chunk_id: {"entities": [], "relations": []} for chunk_id in chunk_ids}
+        if not chunk_ids:
+            return {"chunks": chunks}
+
+        def sources_of(data: dict) -> set[str]:
+            return set((data.get("source_id") or "").split(GRAPH_FIELD_SEP)) & chunk_ids
+
+        graph = self.chunk_entity_relation_graph
+        all_labels = await graph.get_all_labels()
+        nodes = await graph.get_nodes_batch(all_labels)
+        entity_names = [name for name, data in nodes.items() if sources_of(data)]
+        for name in entity_names:
+            for chunk_id in sources_of(nodes[name]):
+                chunks[chunk_id]["entities"].append(name)
+
+        # Relations extracted from a chunk connect entities extracted from it
+        node_edges = await graph.get_nodes_edges_batch(entity_names)
+        pairs = sorted(
+            {tuple(sorted(edge)) for edges in node_edges.values() for edge in edges}
+        )
+        edges = await graph.get_edges_batch(
+            [{"src": src, "tgt": tgt} for src, tgt in pairs]
+        )
+        for pair, data in edges.items():
+            for chunk_id in sources_of(data):
+                chunks[chunk_id]["relations"].append(list(pair))
+        return {"chunks": chunks}
+
     async def adelete_by_entity(self, entity_name: str) -> None:
         """Asynchronously delete an entity and all its relationships.
 
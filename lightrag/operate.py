@@ -1,13 +1,21 @@
 from __future__ import annotations
+from contextlib import nullcontext
 from functools import partial
 
 import asyncio
+import atexit
+import multiprocessing
 import traceback
 import json
+import logging
 import re
 import os
+import threading
 from typing import Any, AsyncIterator
+import numpy as np
+from bisect import bisect_right
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 from .utils import (
     logger,
@@ -19,14 +27,17 @@ from .utils import (
     pack_user_ass_to_openai_messages,
     split_string_by_multi_markers,
     truncate_list_by_token_size,
+    with_description_tokens,
     process_combine_contexts,
     compute_args_hash,
     handle_cache,
     save_to_cache,
+    cache_streamed_response,
     CacheData,
     get_conversation_turns,
     use_llm_func_with_cache,
     list_of_list_to_json,
+    ChunkScheduler,
 )
 from .base import (
     BaseGraphStorage,
@@ -45,6 +56,55 @@ from dotenv import load_dotenv
 load_dotenv(dotenv_path=".env", override=False)
 
 
+# Documents at least this long are encoded in worker processes when workers > 1
+PARALLEL_CHUNKING_MIN_CHARS = 1_000_000
+
+# Chunk ends may snap to the end of these matches, see chunking_by_token_size.
+# Matched against the UTF-8 encoded content.
+CHUNK_BOUNDARY_PATTERNS = {
+    "paragraph": re.compile(rb"\n\s*\n"),
+    # The lookahead on first bytes lets the scan skip most positions quickly
+    "sentence": re.compile(
+        rb"(?=[\n.!?;\xe3\xef])(?:"
+        + "(?:。|！|？|；)+(?:”|’|）)*".encode("utf-8")
+        + rb"""|[.!?;]+["')\]]*\s+|\n\s*)"""
+    ),
+}
+
+# Process pool of _encode_with_offsets, with the size and tokenizer it was created for
+_chunking_pool: ProcessPoolExecutor | None = None
+_chunking_pool_size = 0
+_chunking_pool_tokenizer: Tokenizer | None = None
+# Chunking runs in threads off the event loop, the pool is shared between them
+_chunking_pool_lock = threading.Lock()
+
+# Tokenizer of a chunking worker process, set once by _init_chunking_worker
+_worker_tokenizer: Tokenizer | None = None
+
+
+def _init_chunking_worker(tokenizer: Tokenizer) -> None:
+    """Pool initializer: unpickle the tokenizer once per worker process, so its
+    caches (such as the token byte lengths of encode_with_offsets) are built once"""
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _encode_segment(segment: str) -> tuple[list[int], np.ndarray | None]:
+    return _worker_tokenizer.encode_with_offsets(segment)
+
+
+def _shutdown_chunking_pool() -> None:
+    global _chunking_pool, _chunking_pool_size, _chunking_pool_tokenizer
+    if _chunking_pool is not None:
+        _chunking_pool.shutdown(wait=False, cancel_futures=True)
+    _chunking_pool = None
+    _chunking_pool_size = 0
+    _chunking_pool_tokenizer = None
+
+
+atexit.register(_shutdown_chunking_pool)
+
+
 def chunking_by_token_size(
     tokenizer: Tokenizer,
     content: str,
@@ -52,52 +112,214 @@ def chunking_by_token_size(
     split_by_character_only: bool = False,
     overlap_token_size: int = 128,
     max_token_size: int = 1024,
+    *,
+    snap_to: str | None = None,
+    workers: int = 1,
 ) -> list[dict[str, Any]]:
-    tokens = tokenizer.encode(content)
-    results: list[dict[str, Any]] = []
+    """Split content into chunks of at most max_token_size tokens
+
+    The content is encoded once together with a token -> byte offset map, and
+    chunks are sliced from the UTF-8 encoded content instead of being decoded
+    window by window. A window edge inside a multi-byte character drops the
+    partial character.
+
+    Args:
+        tokenizer: Tokenizer used to count tokens
+        content: Text to split
+        split_by_character: Split on this string first, pieces longer than
+            max_token_size are split again into token windows
+        split_by_character_only: Keep the pieces as they are, however long
+        overlap_token_size: Tokens shared by consecutive windows
+        max_token_size: Maximum number of tokens per window
+        snap_to: "sentence" or "paragraph" to end each window at the last such
+            boundary in its second half, None to cut at exactly max_token_size
+        workers: Number of processes encoding documents longer than
+            PARALLEL_CHUNKING_MIN_CHARS; the tokenizer must be picklable
+
+    Returns:
+        Chunks as dicts with tokens, content and chunk_order_index
+    """
+    tokens, offsets = _encode_with_offsets(tokenizer, content, workers)
+    if offsets is None:
+        # The tokenizer cannot map tokens back to the content
+        return _chunking_by_decoding(
+            tokenizer,
+            tokens,
+            content,
+            split_by_character,
+            split_by_character_only,
+            overlap_token_size,
+            max_token_size,
+        )
+
+    data = content.encode("utf-8")
+
+    def byte_at(index: int) -> int:
+        return int(offsets[index]) if index < len(offsets) else len(data)
+
+    def text(start: int, end: int) -> str:
+        return data[start:end].decode("utf-8", errors="ignore")
+
+    bounds = []
+    if snap_to is not None:
+        # Token index following each boundary
+        ends = [match.end() for match in CHUNK_BOUNDARY_PATTERNS[snap_to].finditer(data)]
+        bounds = np.unique(np.searchsorted(offsets, ends)).tolist()
+
+    def windows(start: int, stop: int) -> list[tuple[int, int]]:
+        result = []
+        while start < stop:
+            end = min(start + max_token_size, stop)
+            if bounds and end < stop:
+                i = bisect_right(bounds, end) - 1
+                if i >= 0 and bounds[i] > start + max_token_size // 2:
+                    end = bounds[i]
+            result.append((start, end))
+            if end >= stop:
+                break
+            start = max(end - overlap_token_size, start + 1)
+        return result
+
+    new_chunks = []
     if split_by_character:
-        raw_chunks = content.split(split_by_character)
-        new_chunks = []
-        if split_by_character_only:
-            for chunk in raw_chunks:
-                _tokens = tokenizer.encode(chunk)
+        separator = split_by_character.encode("utf-8")
+        pieces = data.split(separator)
+        piece_ends = np.cumsum([len(piece) + len(separator) for piece in pieces]) - len(
+            separator
+        )
+        piece_starts = piece_ends - [len(piece) for piece in pieces]
+        firsts = np.searchsorted(offsets, piece_starts).tolist()
+        lasts = np.searchsorted(offsets, piece_ends).tolist()
+        for piece, piece_start, piece_end, first, last in zip(
+            pieces, piece_starts.tolist(), piece_ends.tolist(), firsts, lasts
+        ):
+            if split_by_character_only or last - first <= max_token_size:
+                new_chunks.append((last - first, piece.decode("utf-8")))
+                continue
+            for start, end in windows(first, last):
+                new_chunks.append(
+                    (
+                        end - start,
+                        text(max(piece_start, byte_at(start)), min(piece_end, byte_at(end))),
+                    )
+                )
+    else:
+        for start, end in windows(0, len(tokens)):
+            new_chunks.append((end - start, text(byte_at(start), byte_at(end))))
+
+    return [
+        {
+            "tokens": _len,
+            "content": chunk.strip(),
+            "chunk_order_index": index,
+        }
+        for index, (_len, chunk) in enumerate(new_chunks)
+    ]
+
+
+def _encode_with_offsets(
+    tokenizer: Tokenizer, content: str, workers: int
+) -> tuple[list[int], np.ndarray | None]:
+    """Encode content with its offset map, in worker processes for long content
+
+    The content is cut after line breaks into one segment per worker, so tokens
+    rarely differ from a single pass. Falls back to a single pass when the
+    tokenizer cannot be sent to the workers.
+    """
+    global _chunking_pool, _chunking_pool_size, _chunking_pool_tokenizer
+
+    if workers <= 1 or len(content) < PARALLEL_CHUNKING_MIN_CHARS:
+        return tokenizer.encode_with_offsets(content)
+
+    size = len(content) // workers
+    starts = [0]
+    for i in range(1, workers):
+        cut = content.find("\n", max(i * size, starts[-1]))
+        if cut == -1:
+            break
+        starts.append(cut + 1)
+    segments = [
+        content[start:end] for start, end in zip(starts, starts[1:] + [len(content)])
+    ]
+
+    with _chunking_pool_lock:
+        try:
+            # Spawned rather than forked, the caller usually runs an event loop and threads.
+            # The tokenizer is sent once per worker through the initializer, not per segment
+            if (
+                _chunking_pool is None
+                or _chunking_pool_size < len(segments)
+                or _chunking_pool_tokenizer is not tokenizer
+            ):
+                _shutdown_chunking_pool()
+                _chunking_pool = ProcessPoolExecutor(
+                    max_workers=len(segments),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_chunking_worker,
+                    initargs=(tokenizer,),
+                )
+                _chunking_pool_size = len(segments)
+                _chunking_pool_tokenizer = tokenizer
+            encoded = list(_chunking_pool.map(_encode_segment, segments))
+        except Exception as e:
+            logger.warning(f"Parallel encoding failed, encoding in a single pass: {e}")
+            # A pool whose workers failed to start is broken, do not reuse it
+            _shutdown_chunking_pool()
+            encoded = None
+    if encoded is None:
+        return tokenizer.encode_with_offsets(content)
+
+    tokens, offsets = [], []
+    segment_start = 0
+    for segment, (segment_tokens, segment_offsets) in zip(segments, encoded):
+        if segment_offsets is None:
+            return tokenizer.encode(content), None
+        tokens.extend(segment_tokens)
+        offsets.append(segment_offsets + segment_start)
+        segment_start += len(segment.encode("utf-8"))
+    return tokens, np.concatenate(offsets)
+
+
+def _chunking_by_decoding(
+    tokenizer: Tokenizer,
+    tokens: list[int],
+    content: str,
+    split_by_character: str | None,
+    split_by_character_only: bool,
+    overlap_token_size: int,
+    max_token_size: int,
+) -> list[dict[str, Any]]:
+    """Chunk by decoding every window, for tokenizers without an offset map"""
+    new_chunks = []
+    if split_by_character:
+        for chunk in content.split(split_by_character):
+            _tokens = tokenizer.encode(chunk)
+            if split_by_character_only or len(_tokens) <= max_token_size:
                 new_chunks.append((len(_tokens), chunk))
-        else:
-            for chunk in raw_chunks:
-                _tokens = tokenizer.encode(chunk)
-                if len(_tokens) > max_token_size:
-                    for start in range(
-                        0, len(_tokens), max_token_size - overlap_token_size
-                    ):
-                        chunk_content = tokenizer.decode(
-                            _tokens[start : start + max_token_size]
-                        )
-                        new_chunks.append(
-                            (min(max_token_size, len(_tokens) - start), chunk_content)
-                        )
-                else:
-                    new_chunks.append((len(_tokens), chunk))
-        for index, (_len, chunk) in enumerate(new_chunks):
-            results.append(
-                {
-                    "tokens": _len,
-                    "content": chunk.strip(),
-                    "chunk_order_index": index,
-                }
-            )
+                continue
+            for start in range(0, len(_tokens), max_token_size - overlap_token_size):
+                new_chunks.append(
+                    (
+                        min(max_token_size, len(_tokens) - start),
+                        tokenizer.decode(_tokens[start : start + max_token_size]),
+                    )
+                )
     else:
-        for index, start in enumerate(
-            range(0, len(tokens), max_token_size - overlap_token_size)
-        ):
-            chunk_content = tokenizer.decode(tokens[start : start + max_token_size])
-            results.append(
-                {
-                    "tokens": min(max_token_size, len(tokens) - start),
-                    "content": chunk_content.strip(),
-                    "chunk_order_index": index,
-                }
+        for start in range(0, len(tokens), max_token_size - overlap_token_size):
+            new_chunks.append(
+                (
+                    min(max_token_size, len(tokens) - start),
+                    tokenizer.decode(tokens[start : start + max_token_size]),
+                )
             )
-    return results
+    return [
+        {
+            "tokens": _len,
+            "content": chunk.strip(),
+            "chunk_order_index": index,
+        }
+        for index, (_len, chunk) in enumerate(new_chunks)
+    ]
 
 
 async def _handle_entity_relation_summary(
@@ -151,6 +373,39 @@ async def _handle_entity_relation_summary(
     return summary
 
 
+def _needs_summary(description: str, source_id: str, global_config: dict) -> bool:
+    """Decide whether a merged description should be summarized by the LLM
+
+    A description needs at least `force_llm_summary_on_merge` fragments. Besides,
+    a summary is one fragment standing for the chunks summarized so far, so the
+    fragments appended after it are compared against those chunks: the LLM is
+    only called again once they reach `summary_growth_ratio` of them, instead of
+    on every document mentioning a hub entity.
+    """
+    num_fragment = description.count(GRAPH_FIELD_SEP) + 1
+    if num_fragment < global_config["force_llm_summary_on_merge"]:
+        return False
+    num_chunks = len(split_string_by_multi_markers(source_id, [GRAPH_FIELD_SEP]))
+    num_appended = num_fragment - 1
+    num_summarized = max(num_chunks - num_appended, 1)
+    return num_appended >= global_config["summary_growth_ratio"] * num_summarized
+
+
+class SummaryQueue:
+    """Entities and relations whose descriptions wait for an LLM summary
+
+    Filled by the merges of a pipeline run and drained by process_summary_queue,
+    so an entity merged by several documents is summarized once.
+    """
+
+    def __init__(self):
+        self.nodes: set[str] = set()
+        self.edges: set[tuple[str, str]] = set()
+
+    def __len__(self) -> int:
+        return len(self.nodes) + len(self.edges)
+
+
 async def _handle_single_entity_extraction(
     record_attributes: list[str],
     chunk_key: str,
@@ -241,6 +496,8 @@ async def _merge_nodes_then_upsert(
     pipeline_status: dict = None,
     pipeline_status_lock=None,
     llm_response_cache: BaseKVStorage | None = None,
+    llm_semaphore: asyncio.Semaphore | None = None,
+    summary_queue: SummaryQueue | None = None,
 ):
     """Get existing nodes from knowledge graph use name,if exists, merge data, else create, then upsert."""
     already_entity_types = []
@@ -276,27 +533,39 @@ async def _merge_nodes_then_upsert(
         set([dp["file_path"] for dp in nodes_data] + already_file_paths)
     )
 
-    force_llm_summary_on_merge = global_config["force_llm_summary_on_merge"]
-
     num_fragment = description.count(GRAPH_FIELD_SEP) + 1
     num_new_fragment = len(set([dp["description"] for dp in nodes_data]))
 
+    needs_summary = num_fragment > 1 and _needs_summary(
+        description, source_id, global_config
+    )
+
     if num_fragment > 1:
-        if num_fragment >= force_llm_summary_on_merge:
+        if needs_summary and summary_queue is not None:
+            # Summarized once after extraction, see process_summary_queue
+            summary_queue.nodes.add(entity_name)
+            status_message = f"Queue summary N: {entity_name} | {num_new_fragment}+{num_fragment-num_new_fragment}"
+            logger.info(status_message)
+            if pipeline_status is not None and pipeline_status_lock is not None:
+                async with pipeline_status_lock:
+                    pipeline_status["latest_message"] = status_message
+                    pipeline_status["history_messages"].append(status_message)
+        elif needs_summary:
             status_message = f"LLM merge N: {entity_name} | {num_new_fragment}+{num_fragment-num_new_fragment}"
             logger.info(status_message)
             if pipeline_status is not None and pipeline_status_lock is not None:
                 async with pipeline_status_lock:
                     pipeline_status["latest_message"] = status_message
                     pipeline_status["history_messages"].append(status_message)
-            description = await _handle_entity_relation_summary(
-                entity_name,
-                description,
-                global_config,
-                pipeline_status,
-                pipeline_status_lock,
-                llm_response_cache,
-            )
+            async with llm_semaphore or nullcontext():
+                description = await _handle_entity_relation_summary(
+                    entity_name,
+                    description,
+                    global_config,
+                    pipeline_status,
+                    pipeline_status_lock,
+                    llm_response_cache,
+                )
         else:
             status_message = f"Merge N: {entity_name} | {num_new_fragment}+{num_fragment-num_new_fragment}"
             logger.info(status_message)
@@ -305,12 +574,15 @@ async def _merge_nodes_then_upsert(
                     pipeline_status["latest_message"] = status_message
                     pipeline_status["history_messages"].append(status_message)
 
-    node_data = dict(
-        entity_id=entity_name,
-        entity_type=entity_type,
-        description=description,
-        source_id=source_id,
-        file_path=file_path,
+    node_data = with_description_tokens(
+        dict(
+            entity_id=entity_name,
+            entity_type=entity_type,
+            description=description,
+            source_id=source_id,
+            file_path=file_path,
+        ),
+        global_config["tokenizer"],
     )
     await knowledge_graph_inst.upsert_node(
         entity_name,
@@ -329,16 +601,20 @@ async def _merge_edges_then_upsert(
     pipeline_status: dict = None,
     pipeline_status_lock=None,
     llm_response_cache: BaseKVStorage | None = None,
+    llm_semaphore: asyncio.Semaphore | None = None,
+    summary_queue: SummaryQueue | None = None,
 ):
+    from .kg.shared_storage import get_keyed_lock
+
     already_weights = []
     already_source_ids = []
     already_description = []
     already_keywords = []
     already_file_paths = []
 
-    if await knowledge_graph_inst.has_edge(src_id, tgt_id):
-        already_edge = await knowledge_graph_inst.get_edge(src_id, tgt_id)
-        # Handle the case where get_edge returns None or missing fields
+    already_edge = await knowledge_graph_inst.get_edge(src_id, tgt_id)
+    if already_edge is not None:
+        # Handle the case where get_edge returns empty or missing fields
         if already_edge:
             # Get weight with default 0.0 if missing
             already_weights.append(already_edge.get("weight", 0.0))
@@ -403,7 +679,12 @@ async def _merge_edges_then_upsert(
     )
 
     for need_insert_id in [src_id, tgt_id]:
-        if not (await knowledge_graph_inst.has_node(need_insert_id)):
+        if await knowledge_graph_inst.has_node(need_insert_id):
+            continue
+        # Another document may be creating the node, check again under its lock
+        async with get_keyed_lock([_node_lock_key(need_insert_id)]):
+            if await knowledge_graph_inst.has_node(need_insert_id):
+                continue
             # # Discard this edge if the node does not exist
             # if need_insert_id == src_id:
             #     logger.warning(
@@ -416,38 +697,53 @@ async def _merge_edges_then_upsert(
             # return None
             await knowledge_graph_inst.upsert_node(
                 need_insert_id,
-                node_data={
-                    "entity_id": need_insert_id,
-                    "source_id": source_id,
-                    "description": description,
-                    "entity_type": "UNKNOWN",
-                    "file_path": file_path,
-                },
+                node_data=with_description_tokens(
+                    {
+                        "entity_id": need_insert_id,
+                        "source_id": source_id,
+                        "description": description,
+                        "entity_type": "UNKNOWN",
+                        "file_path": file_path,
+                    },
+                    global_config["tokenizer"],
+                ),
             )
 
-    force_llm_summary_on_merge = global_config["force_llm_summary_on_merge"]
-
     num_fragment = description.count(GRAPH_FIELD_SEP) + 1
     num_new_fragment = len(
         set([dp["description"] for dp in edges_data if dp.get("description")])
     )
 
+    needs_summary = num_fragment > 1 and _needs_summary(
+        description, source_id, global_config
+    )
+
     if num_fragment > 1:
-        if num_fragment >= force_llm_summary_on_merge:
+        if needs_summary and summary_queue is not None:
+            # Summarized once after extraction, see process_summary_queue
+            summary_queue.edges.add((src_id, tgt_id))
+            status_message = f"Queue summary E: {src_id} - {tgt_id} | {num_new_fragment}+{num_fragment-num_new_fragment}"
+            logger.info(status_message)
+            if pipeline_status is not None and pipeline_status_lock is not None:
+                async with pipeline_status_lock:
+                    pipeline_status["latest_message"] = status_message
+                    pipeline_status["history_messages"].append(status_message)
+        elif needs_summary:
             status_message = f"LLM merge E: {src_id} - {tgt_id} | {num_new_fragment}+{num_fragment-num_new_fragment}"
             logger.info(status_message)
             if pipeline_status is not None and pipeline_status_lock is not None:
                 async with pipeline_status_lock:
                     pipeline_status["latest_message"] = status_message
                     pipeline_status["history_messages"].append(status_message)
-            description = await _handle_entity_relation_summary(
-                f"({src_id}, {tgt_id})",
-                description,
-                global_config,
-                pipeline_status,
-                pipeline_status_lock,
-                llm_response_cache,
-            )
+            async with llm_semaphore or nullcontext():
+                description = await _handle_entity_relation_summary(
+                    f"({src_id}, {tgt_id})",
+                    description,
+                    global_config,
+                    pipeline_status,
+                    pipeline_status_lock,
+                    llm_response_cache,
+                )
         else:
             status_message = f"Merge E: {src_id} - {tgt_id} | {num_new_fragment}+{num_fragment-num_new_fragment}"
             logger.info(status_message)
@@ -459,12 +755,15 @@ async def _merge_edges_then_upsert(
     await knowledge_graph_inst.upsert_edge(
         src_id,
         tgt_id,
-        edge_data=dict(
-            weight=weight,
-            description=description,
-            keywords=keywords,
-            source_id=source_id,
-            file_path=file_path,
+        edge_data=with_description_tokens(
+            dict(
+                weight=weight,
+                description=description,
+                keywords=keywords,
+                source_id=source_id,
+                file_path=file_path,
+            ),
+            global_config["tokenizer"],
         ),
     )
 
@@ -492,6 +791,11 @@ async def merge_nodes_and_edges(
     current_file_number: int = 0,
     total_files: int = 0,
     file_path: str = "unknown_source",
+    summary_queue: SummaryQueue | None = None,
+    doc_id: str | None = None,
+    chunk_ids: list[str] | None = None,
+    doc_graph_refs: BaseKVStorage | None = None,
+    kept_chunk_refs: dict[str, dict] | None = None,
 ) -> None:
     """Merge nodes and edges from extraction results
 
@@ -504,9 +808,17 @@ async def merge_nodes_and_edges(
         pipeline_status: Pipeline status dictionary
         pipeline_status_lock: Lock for pipeline status
         llm_response_cache: LLM response cache
+        summary_queue: Collects descriptions to summarize after extraction, they are
+            summarized during the merge when None
+        doc_id: ID of the document the chunks belong to
+        chunk_ids: IDs of all chunks of the document, including those without entities
+        doc_graph_refs: Storage of the doc -> chunks -> entities/relations index,
+            recorded for doc_id when given
+        kept_chunk_refs: Index entries of chunks carried over unchanged from the
+            previous version of the document, recorded together with chunk_ids
     """
     # Get lock manager from shared storage
-    from .kg.shared_storage import get_graph_db_lock
+    from .kg.shared_storage import get_graph_db_shared_lock, get_keyed_lock
 
     # Collect all nodes and edges from all chunks
     all_nodes = defaultdict(list)
@@ -522,49 +834,65 @@ async def merge_nodes_and_edges(
             sorted_edge_key = tuple(sorted(edge_key))
             all_edges[sorted_edge_key].extend(edges)
 
-    # Centralized processing of all nodes and edges
-    entities_data = []
-    relationships_data = []
-
-    # Merge nodes and edges
-    # Use graph database lock to ensure atomic merges and updates
-    graph_db_lock = get_graph_db_lock(enable_logging=False)
-    async with graph_db_lock:
-        async with pipeline_status_lock:
-            log_message = (
-                f"Merging stage {current_file_number}/{total_files}: {file_path}"
-            )
-            logger.info(log_message)
-            pipeline_status["latest_message"] = log_message
-            pipeline_status["history_messages"].append(log_message)
-
-        # Process and update all entities at once
-        for entity_name, entities in all_nodes.items():
-            entity_data = await _merge_nodes_then_upsert(
+    # Merges of different entities run concurrently, their LLM summaries bounded
+    # by the semaphore. Each merge locks the entity (or edge) it reads and
+    # rewrites, so documents sharing an entity still merge it one at a time.
+    # Graph reads and writes of the concurrent merges go through one batch, which
+    # sends them to the storage as get_*_batch / upsert_*_batch calls.
+    semaphore = asyncio.Semaphore(global_config.get("llm_model_max_async", 4) * 2)
+    graph_batch = _GraphBatch(knowledge_graph_inst)
+
+    async def merge_node(entity_name, entities):
+        async with get_keyed_lock([_node_lock_key(entity_name)]):
+            return await _merge_nodes_then_upsert(
                 entity_name,
                 entities,
-                knowledge_graph_inst,
+                graph_batch,
                 global_config,
                 pipeline_status,
                 pipeline_status_lock,
                 llm_response_cache,
+                semaphore,
+                summary_queue,
             )
-            entities_data.append(entity_data)
 
-        # Process and update all relationships at once
-        for edge_key, edges in all_edges.items():
-            edge_data = await _merge_edges_then_upsert(
+    async def merge_edge(edge_key, edges):
+        async with get_keyed_lock([_edge_lock_key(*edge_key)]):
+            return await _merge_edges_then_upsert(
                 edge_key[0],
                 edge_key[1],
                 edges,
-                knowledge_graph_inst,
+                graph_batch,
                 global_config,
                 pipeline_status,
                 pipeline_status_lock,
                 llm_response_cache,
+                semaphore,
+                summary_queue,
             )
-            if edge_data is not None:
-                relationships_data.append(edge_data)
+
+    # Merge nodes and edges
+    # Shared graph db lock: other merges may run, whole-graph edits wait
+    async with get_graph_db_shared_lock():
+        async with pipeline_status_lock:
+            log_message = (
+                f"Merging stage {current_file_number}/{total_files}: {file_path}"
+            )
+            logger.info(log_message)
+            pipeline_status["latest_message"] = log_message
+            pipeline_status["history_messages"].append(log_message)
+
+        # Process and update all entities, then all relationships
+        entities_data = await asyncio.gather(
+            *[merge_node(name, entities) for name, entities in all_nodes.items()]
+        )
+        relationships_data = [
+            edge_data
+            for edge_data in await asyncio.gather(
+                *[merge_edge(key, edges) for key, edges in all_edges.items()]
+            )
+            if edge_data is not None
+        ]
 
         # Update total counts
         total_entities_count = len(entities_data)
@@ -579,17 +907,11 @@ async def merge_nodes_and_edges(
 
         # Update vector databases with all collected data
         if entity_vdb is not None and entities_data:
-            data_for_vdb = {
-                compute_mdhash_id(dp["entity_name"], prefix="ent-"): {
-                    "entity_name": dp["entity_name"],
-                    "entity_type": dp["entity_type"],
-                    "content": f"{dp['entity_name']}\n{dp['description']}",
-                    "source_id": dp["source_id"],
-                    "file_path": dp.get("file_path", "unknown_source"),
-                }
-                for dp in entities_data
-            }
-            await entity_vdb.upsert(data_for_vdb)
+            await _refresh_entities_vdb(
+                [dp["entity_name"] for dp in entities_data],
+                knowledge_graph_inst,
+                entity_vdb,
+            )
 
         log_message = f"Updating {total_relations_count} relations {current_file_number}/{total_files}: {file_path}"
         logger.info(log_message)
@@ -599,18 +921,537 @@ async def merge_nodes_and_edges(
                 pipeline_status["history_messages"].append(log_message)
 
         if relationships_vdb is not None and relationships_data:
-            data_for_vdb = {
-                compute_mdhash_id(dp["src_id"] + dp["tgt_id"], prefix="rel-"): {
-                    "src_id": dp["src_id"],
-                    "tgt_id": dp["tgt_id"],
-                    "keywords": dp["keywords"],
-                    "content": f"{dp['src_id']}\t{dp['tgt_id']}\n{dp['keywords']}\n{dp['description']}",
-                    "source_id": dp["source_id"],
-                    "file_path": dp.get("file_path", "unknown_source"),
-                }
-                for dp in relationships_data
+            await _refresh_relationships_vdb(
+                [(dp["src_id"], dp["tgt_id"]) for dp in relationships_data],
+                knowledge_graph_inst,
+                relationships_vdb,
+            )
+
+        if doc_graph_refs is not None and doc_id is not None:
+            refs = _doc_graph_refs(chunk_ids or [], all_nodes, all_edges)
+            refs["chunks"].update(kept_chunk_refs or {})
+            await doc_graph_refs.upsert({doc_id: refs})
+
+
+def _doc_graph_refs(
+    chunk_ids: list[str], all_nodes: dict[str, list], all_edges: dict[tuple, list]
+) -> dict[str, Any]:
+    """Build the doc_graph_refs record of a document from its extraction results
+
+    The record maps each chunk ID to the entity names and sorted (src, tgt)
+    relation pairs extracted from it:
+    {"chunks": {chunk_id: {"entities": [...], "relations": [[src, tgt], ...]}}}
+    """
+    chunks = {chunk_id: (set(), set()) for chunk_id in chunk_ids}
+    for entity_name, entities in all_nodes.items():
+        for dp in entities:
+            chunks.setdefault(dp["source_id"], (set(), set()))[0].add(entity_name)
+    for edge_key, edges in all_edges.items():
+        for dp in edges:
+            chunks.setdefault(dp["source_id"], (set(), set()))[1].add(edge_key)
+    return {
+        "chunks": {
+            chunk_id: {
+                "entities": sorted(entities),
+                "relations": [list(pair) for pair in sorted(relations)],
             }
-            await relationships_vdb.upsert(data_for_vdb)
+            for chunk_id, (entities, relations) in chunks.items()
+        }
+    }
+
+
+async def process_summary_queue(
+    summary_queue: SummaryQueue,
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict[str, str],
+    pipeline_status: dict = None,
+    pipeline_status_lock=None,
+    llm_response_cache: BaseKVStorage | None = None,
+) -> None:
+    """Summarize the descriptions queued by merge_nodes_and_edges
+
+    Queued entities and relations are summarized concurrently and the queue is
+    emptied. Each one is read again under its keyed lock and skipped if it no
+    longer needs a summary, e.g. it was deleted or edited in the meantime.
+
+    Args:
+        summary_queue: Queue filled during the merges of the pipeline run
+        knowledge_graph_inst: Knowledge graph storage
+        entity_vdb: Entity vector database
+        relationships_vdb: Relationship vector database
+        global_config: Global configuration
+        pipeline_status: Pipeline status dictionary
+        pipeline_status_lock: Lock for pipeline status
+        llm_response_cache: LLM response cache
+    """
+    from .kg.shared_storage import get_graph_db_shared_lock, get_keyed_lock
+
+    nodes, edges = sorted(summary_queue.nodes), sorted(summary_queue.edges)
+    summary_queue.nodes.clear()
+    summary_queue.edges.clear()
+    if not nodes and not edges:
+        return
+
+    log_message = f"Summarizing {len(nodes)} entities and {len(edges)} relations"
+    logger.info(log_message)
+    if pipeline_status is not None:
+        async with pipeline_status_lock:
+            pipeline_status["latest_message"] = log_message
+            pipeline_status["history_messages"].append(log_message)
+
+    semaphore = asyncio.Semaphore(global_config.get("llm_model_max_async", 4) * 2)
+    graph_batch = _GraphBatch(knowledge_graph_inst)
+
+    async def summarize_node(entity_name):
+        async with get_keyed_lock([_node_lock_key(entity_name)]):
+            node = await graph_batch.get_node(entity_name)
+            if node is None or not _needs_summary(
+                node.get("description") or "", node.get("source_id") or "", global_config
+            ):
+                return None
+            async with semaphore:
+                description = await _handle_entity_relation_summary(
+                    entity_name,
+                    node["description"],
+                    global_config,
+                    pipeline_status,
+                    pipeline_status_lock,
+                    llm_response_cache,
+                )
+            await graph_batch.upsert_node(
+                entity_name,
+                node_data=with_description_tokens(
+                    dict(
+                        entity_id=entity_name,
+                        entity_type=node.get("entity_type", "UNKNOWN"),
+                        description=description,
+                        source_id=node.get("source_id", ""),
+                        file_path=node.get("file_path", "unknown_source"),
+                    ),
+                    global_config["tokenizer"],
+                ),
+            )
+            return entity_name
+
+    async def summarize_edge(edge_key):
+        src_id, tgt_id = edge_key
+        async with get_keyed_lock([_edge_lock_key(src_id, tgt_id)]):
+            edge = await graph_batch.get_edge(src_id, tgt_id)
+            if edge is None or not _needs_summary(
+                edge.get("description") or "", edge.get("source_id") or "", global_config
+            ):
+                return None
+            async with semaphore:
+                description = await _handle_entity_relation_summary(
+                    f"({src_id}, {tgt_id})",
+                    edge["description"],
+                    global_config,
+                    pipeline_status,
+                    pipeline_status_lock,
+                    llm_response_cache,
+                )
+            await graph_batch.upsert_edge(
+                src_id,
+                tgt_id,
+                edge_data=with_description_tokens(
+                    dict(
+                        weight=edge.get("weight", 0.0),
+                        description=description,
+                        keywords=edge.get("keywords", ""),
+                        source_id=edge.get("source_id", ""),
+                        file_path=edge.get("file_path", "unknown_source"),
+                    ),
+                    global_config["tokenizer"],
+                ),
+            )
+            return edge_key
+
+    async with get_graph_db_shared_lock():
+        summarized_nodes, summarized_edges = await asyncio.gather(
+            asyncio.gather(*[summarize_node(name) for name in nodes]),
+            asyncio.gather(*[summarize_edge(key) for key in edges]),
+        )
+        summarized_nodes = [name for name in summarized_nodes if name is not None]
+        summarized_edges = [key for key in summarized_edges if key is not None]
+
+        if entity_vdb is not None and summarized_nodes:
+            await _refresh_entities_vdb(
+                summarized_nodes, knowledge_graph_inst, entity_vdb
+            )
+        if relationships_vdb is not None and summarized_edges:
+            await _refresh_relationships_vdb(
+                summarized_edges, knowledge_graph_inst, relationships_vdb
+            )
+
+    log_message = f"Summarized {len(summarized_nodes)} entities and {len(summarized_edges)} relations"
+    logger.info(log_message)
+    if pipeline_status is not None:
+        async with pipeline_status_lock:
+            pipeline_status["latest_message"] = log_message
+            pipeline_status["history_messages"].append(log_message)
+
+
+async def remove_chunks_from_graph(
+    chunk_ids: set[str],
+    entity_names: list[str],
+    relation_pairs: list[tuple[str, str]],
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+) -> tuple[int, int, int, int]:
+    """Remove chunks from the sources of the entities and relations extracted from them
+
+    Entities and relations left without any source are deleted from the graph and
+    the vector dbs, the others get their source_id updated. Only the given
+    entities and relations are read, as listed by the doc_graph_refs index.
+
+    Args:
+        chunk_ids: IDs of the removed chunks
+        entity_names: Entities extracted from these chunks
+        relation_pairs: Relations extracted from these chunks
+        knowledge_graph_inst: Knowledge graph storage
+        entity_vdb: Entity vector database
+        relationships_vdb: Relationship vector database
+
+    Returns:
+        Numbers of deleted entities, deleted relations, updated entities and
+        updated relations
+    """
+    from .kg.shared_storage import get_graph_db_shared_lock, get_keyed_lock
+
+    def remaining_sources(data: dict) -> list[str] | None:
+        sources = split_string_by_multi_markers(
+            data.get("source_id") or "", [GRAPH_FIELD_SEP]
+        )
+        return [source for source in sources if source not in chunk_ids]
+
+    lock_keys = [_node_lock_key(name) for name in entity_names] + [
+        _edge_lock_key(src, tgt) for src, tgt in relation_pairs
+    ]
+    async with get_graph_db_shared_lock():
+        async with get_keyed_lock(lock_keys):
+            nodes, edges = await asyncio.gather(
+                knowledge_graph_inst.get_nodes_batch(entity_names),
+                knowledge_graph_inst.get_edges_batch(
+                    [{"src": src, "tgt": tgt} for src, tgt in relation_pairs]
+                ),
+            )
+
+            entities_to_delete = []
+            entities_to_update = {}
+            for name, node_data in nodes.items():
+                sources = remaining_sources(node_data)
+                if sources:
+                    entities_to_update[name] = {
+                        **node_data,
+                        "source_id": GRAPH_FIELD_SEP.join(sources),
+                    }
+                else:
+                    entities_to_delete.append(name)
+
+            # Edges of deleted entities go with them, even if other chunks mention them
+            deleted = set(entities_to_delete)
+            relationships_to_delete = []
+            relationships_to_update = []
+            for (src, tgt), edge_data in edges.items():
+                sources = remaining_sources(edge_data)
+                if sources and src not in deleted and tgt not in deleted:
+                    relationships_to_update.append(
+                        (src, tgt, {**edge_data, "source_id": GRAPH_FIELD_SEP.join(sources)})
+                    )
+                else:
+                    relationships_to_delete.append((src, tgt))
+
+            if relationships_to_delete:
+                await relationships_vdb.delete(
+                    [
+                        compute_mdhash_id(a + b, prefix="rel-")
+                        for src, tgt in relationships_to_delete
+                        for a, b in ((src, tgt), (tgt, src))
+                    ]
+                )
+                await knowledge_graph_inst.remove_edges(relationships_to_delete)
+            if entities_to_delete:
+                await entity_vdb.delete(
+                    [compute_mdhash_id(name, prefix="ent-") for name in entities_to_delete]
+                )
+                await knowledge_graph_inst.remove_nodes(entities_to_delete)
+            await knowledge_graph_inst.upsert_nodes_batch(entities_to_update)
+            await knowledge_graph_inst.upsert_edges_batch(relationships_to_update)
+
+        # The vector db entries carry source_id too
+        if entities_to_update:
+            await _refresh_entities_vdb(
+                list(entities_to_update), knowledge_graph_inst, entity_vdb
+            )
+        if relationships_to_update:
+            await _refresh_relationships_vdb(
+                [(src, tgt) for src, tgt, _ in relationships_to_update],
+                knowledge_graph_inst,
+                relationships_vdb,
+            )
+
+    return (
+        len(entities_to_delete),
+        len(relationships_to_delete),
+        len(entities_to_update),
+        len(relationships_to_update),
+    )
+
+
+async def _refresh_entities_vdb(
+    names: list[str], knowledge_graph_inst: BaseGraphStorage, entity_vdb: BaseVectorStorage
+) -> None:
+    """Write the current graph data of entities to the vector db
+
+    Another document may have merged the same entity since, so the latest graph
+    data is read and written under the entity locks, keeping the vector db in
+    step with the graph.
+    """
+    from .kg.shared_storage import get_keyed_lock
+
+    async with get_keyed_lock([_node_lock_key(name) for name in names]):
+        nodes = await knowledge_graph_inst.get_nodes_batch(names)
+        data_for_vdb = {
+            compute_mdhash_id(name, prefix="ent-"): {
+                "entity_name": name,
+                "entity_type": dp.get("entity_type", "UNKNOWN"),
+                "content": f"{name}\n{dp.get('description', '')}",
+                "source_id": dp.get("source_id", ""),
+                "file_path": dp.get("file_path", "unknown_source"),
+            }
+            for name, dp in nodes.items()
+        }
+        await entity_vdb.upsert(data_for_vdb)
+
+
+async def _refresh_relationships_vdb(
+    pairs: list[tuple[str, str]],
+    knowledge_graph_inst: BaseGraphStorage,
+    relationships_vdb: BaseVectorStorage,
+) -> None:
+    """Write the current graph data of relations to the vector db, see _refresh_entities_vdb"""
+    from .kg.shared_storage import get_keyed_lock
+
+    async with get_keyed_lock([_edge_lock_key(*pair) for pair in pairs]):
+        edges = await knowledge_graph_inst.get_edges_batch(
+            [{"src": src_id, "tgt": tgt_id} for src_id, tgt_id in pairs]
+        )
+        data_for_vdb = {}
+        for (src_id, tgt_id), dp in edges.items():
+            keywords = dp.get("keywords", "")
+            data_for_vdb[compute_mdhash_id(src_id + tgt_id, prefix="rel-")] = {
+                "src_id": src_id,
+                "tgt_id": tgt_id,
+                "keywords": keywords,
+                "content": f"{src_id}\t{tgt_id}\n{keywords}\n{dp.get('description', '')}",
+                "source_id": dp.get("source_id", ""),
+                "file_path": dp.get("file_path", "unknown_source"),
+            }
+        await relationships_vdb.upsert(data_for_vdb)
+
+
+def _node_lock_key(entity_name: str) -> str:
+    return f"node:{entity_name}"
+
+
+def _edge_lock_key(src_id: str, tgt_id: str) -> str:
+    src_id, tgt_id = sorted((src_id, tgt_id))
+    return f"edge:{src_id}\x1f{tgt_id}"
+
+
+class _GraphBatch:
+    """Graph storage stand-in that coalesces the calls of concurrent merges
+
+    Reads and writes requested in the same event loop iteration are sent to the
+    storage together, as one get_nodes_batch / get_edges_batch /
+    upsert_nodes_batch / upsert_edges_batch call per kind. Each call returns
+    once its own request has been answered or written.
+
+    Importance notes:
+    1. Callers must hold the keyed lock of every node or edge they read or write,
+       a cached value is never served, so a read always reflects writes made by
+       earlier lock holders.
+    2. The merges start together and read first, so the existing nodes (or edges)
+       of a document are fetched in one prefetch call.
+    """
+
+    def __init__(self, graph: BaseGraphStorage):
+        self.graph = graph
+        self._pending: dict[str, dict[Any, tuple[asyncio.Future, Any]]] = {
+            "get_nodes": {},
+            "get_edges": {},
+            "upsert_nodes": {},
+            "upsert_edges": {},
+        }
+        self._flush_scheduled = False
+        # Keep references to the running flush tasks so they are not garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+    def _request(self, kind: str, key: Any, value: Any = None) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._flush)
+        pending = self._pending[kind]
+        if key in pending:
+            future, _ = pending[key]
+        else:
+            future = loop.create_future()
+        pending[key] = (future, value)
+        return future
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        for kind, pending in self._pending.items():
+            if pending:
+                self._pending[kind] = {}
+                task = asyncio.create_task(self._run(kind, pending))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, kind: str, pending: dict) -> None:
+        try:
+            if kind == "get_nodes":
+                result = await self.graph.get_nodes_batch(list(pending))
+            elif kind == "get_edges":
+                result = await self.graph.get_edges_batch(
+                    [{"src": src, "tgt": tgt} for src, tgt in pending]
+                )
+            elif kind == "upsert_nodes":
+                result = {}
+                await self.graph.upsert_nodes_batch(
+                    {node_id: value for node_id, (_, value) in pending.items()}
+                )
+            else:
+                result = {}
+                await self.graph.upsert_edges_batch(
+                    [(src, tgt, value) for (src, tgt), (_, value) in pending.items()]
+                )
+        except BaseException as e:
+            for future, _ in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for key, (future, _) in pending.items():
+            if not future.done():
+                future.set_result(result.get(key))
+
+    async def get_node(self, node_id: str) -> dict | None:
+        return await self._request("get_nodes", node_id)
+
+    async def has_node(self, node_id: str) -> bool:
+        return await self.get_node(node_id) is not None
+
+    async def get_edge(self, source_node_id: str, target_node_id: str) -> dict | None:
+        return await self._request("get_edges", (source_node_id, target_node_id))
+
+    async def upsert_node(self, node_id: str, node_data: dict[str, str]) -> None:
+        await self._request("upsert_nodes", node_id, node_data)
+
+    async def upsert_edge(
+        self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
+    ) -> None:
+        await self._request(
+            "upsert_edges", (source_node_id, target_node_id), edge_data
+        )
+
+
+class _GraphReadBatch:
+    """Graph storage stand-in that merges the batch reads of concurrent query branches
+
+    Batch reads of the same kind requested in the same event loop iteration are
+    sent to the storage as one call over the union of their keys, so keys asked
+    for by several branches are read once. Each call returns the results for its
+    own keys. Other attributes are served by the storage itself.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, graph: BaseGraphStorage):
+        self.graph = graph
+        self._pending: dict[str, dict[Any, asyncio.Future]] = defaultdict(dict)
+        self._flush_scheduled = False
+        self._tasks: set[asyncio.Task] = set()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.graph, name)
+
+    async def _read(self, kind: str, keys: list) -> dict:
+        if not keys:
+            return {}
+        loop = asyncio.get_running_loop()
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._flush)
+        pending = self._pending[kind]
+        futures = {}
+        for key in keys:
+            if key not in pending:
+                pending[key] = loop.create_future()
+            futures[key] = pending[key]
+        results = {}
+        for key, future in futures.items():
+            value = await future
+            if value is not self._MISSING:
+                results[key] = value
+        return results
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        for kind, pending in list(self._pending.items()):
+            if pending:
+                self._pending[kind] = {}
+                task = asyncio.create_task(self._run(kind, pending))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, kind: str, pending: dict[Any, asyncio.Future]) -> None:
+        keys = list(pending)
+        try:
+            if kind == "get_edges_batch":
+                result = await self.graph.get_edges_batch(
+                    [{"src": src, "tgt": tgt} for src, tgt in keys]
+                )
+            else:
+                result = await getattr(self.graph, kind)(keys)
+        except BaseException as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(result.get(key, self._MISSING))
+
+    async def get_nodes_batch(self, node_ids: list[str]) -> dict[str, dict]:
+        return await self._read("get_nodes_batch", node_ids)
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> dict[str, int]:
+        return await self._read("node_degrees_batch", node_ids)
+
+    async def get_nodes_edges_batch(
+        self, node_ids: list[str]
+    ) -> dict[str, list[tuple[str, str]]]:
+        return await self._read("get_nodes_edges_batch", node_ids)
+
+    async def get_edges_batch(
+        self, pairs: list[dict[str, str]]
+    ) -> dict[tuple[str, str], dict]:
+        return await self._read(
+            "get_edges_batch", [(pair["src"], pair["tgt"]) for pair in pairs]
+        )
+
+    async def edge_degrees_batch(
+        self, edge_pairs: list[tuple[str, str]]
+    ) -> dict[tuple[str, str], int]:
+        return await self._read("edge_degrees_batch", edge_pairs)
 
 
 async def extract_entities(
@@ -619,6 +1460,7 @@ async def extract_entities(
     pipeline_status: dict = None,
     pipeline_status_lock=None,
     llm_response_cache: BaseKVStorage | None = None,
+    chunk_scheduler: ChunkScheduler | None = None,
 ) -> list:
     use_llm_func: callable = global_config["llm_model_func"]
     entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
@@ -793,12 +1635,18 @@ async def extract_entities(
         logger.info(log_message)
         if pipeline_status is not None:
             async with pipeline_status_lock:
+                pipeline_status["cur_chunk"] = pipeline_status.get("cur_chunk", 0) + 1
                 pipeline_status["latest_message"] = log_message
                 pipeline_status["history_messages"].append(log_message)
 
         # Return the extracted nodes and edges for centralized processing
         return maybe_nodes, maybe_edges
 
+    # Chunks go through the instance-wide scheduler when given, so the limit
+    # holds across all documents being extracted
+    if chunk_scheduler is not None:
+        return await chunk_scheduler.map(_process_single_content, ordered_chunks)
+
     # Get max async tasks limit from global_config
     llm_model_max_async = global_config.get("llm_model_max_async", 4)
     semaphore = asyncio.Semaphore(llm_model_max_async)
@@ -838,6 +1686,24 @@ async def extract_entities(
     return chunk_results
 
 
+class _QueryEmbedding:
+    """Embeds a query at most once, for the semantic cache lookup in handle_cache
+
+    value stays None until the cache has asked for the embedding, so the vector
+    search only reuses it when it was computed anyway.
+    """
+
+    def __init__(self, query: str, vdb: BaseVectorStorage):
+        self.query = query
+        self.vdb = vdb
+        self.value: np.ndarray | None = None
+
+    async def __call__(self) -> np.ndarray:
+        if self.value is None:
+            self.value = (await self.vdb.embedding_func([self.query], _priority=5))[0]
+        return self.value
+
+
 async def kg_query(
     query: str,
     knowledge_graph_inst: BaseGraphStorage,
@@ -859,7 +1725,13 @@ async def kg_query(
     # Handle cache
     args_hash = compute_args_hash(query_param.mode, query, cache_type="query")
     cached_response, quantized, min_val, max_val = await handle_cache(
-        hashing_kv, args_hash, query, query_param.mode, cache_type="query"
+        hashing_kv,
+        args_hash,
+        query,
+        query_param.mode,
+        cache_type="query",
+        embed_query=_QueryEmbedding(query, entities_vdb),
+        llm_func=use_model_func,
     )
     if cached_response is not None:
         return cached_response
@@ -925,8 +1797,9 @@ async def kg_query(
         return sys_prompt
 
     tokenizer: Tokenizer = global_config["tokenizer"]
-    len_of_prompts = len(tokenizer.encode(query + sys_prompt))
-    logger.debug(f"[kg_query]Prompt Tokens: {len_of_prompts}")
+    if logger.isEnabledFor(logging.DEBUG):
+        len_of_prompts = len(tokenizer.encode(query + sys_prompt))
+        logger.debug(f"[kg_query]Prompt Tokens: {len_of_prompts}")
 
     response = await use_model_func(
         query,
@@ -945,20 +1818,21 @@ async def kg_query(
         )
 
     if hashing_kv.global_config.get("enable_llm_cache"):
-        # Save to cache
-        await save_to_cache(
-            hashing_kv,
-            CacheData(
-                args_hash=args_hash,
-                content=response,
-                prompt=query,
-                quantized=quantized,
-                min_val=min_val,
-                max_val=max_val,
-                mode=query_param.mode,
-                cache_type="query",
-            ),
+        cache_data = CacheData(
+            args_hash=args_hash,
+            content=response,
+            prompt=query,
+            quantized=quantized,
+            min_val=min_val,
+            max_val=max_val,
+            mode=query_param.mode,
+            cache_type="query",
         )
+        if hasattr(response, "__aiter__"):
+            # Saved once the caller has read the whole stream
+            response = cache_streamed_response(response, hashing_kv, cache_data)
+        else:
+            await save_to_cache(hashing_kv, cache_data)
 
     return response
 
@@ -1048,8 +1922,9 @@ async def extract_keywords_only(
     )
 
     tokenizer: Tokenizer = global_config["tokenizer"]
-    len_of_prompts = len(tokenizer.encode(kw_prompt))
-    logger.debug(f"[kg_query]Prompt Tokens: {len_of_prompts}")
+    if logger.isEnabledFor(logging.DEBUG):
+        len_of_prompts = len(tokenizer.encode(kw_prompt))
+        logger.debug(f"[kg_query]Prompt Tokens: {len_of_prompts}")
 
     # 5. Call the LLM for keyword extraction
     if param.model_func:
@@ -1131,8 +2006,15 @@ async def mix_kg_vector_query(
 
     # 1. Cache handling
     args_hash = compute_args_hash("mix", query, cache_type="query")
+    query_embedding = _QueryEmbedding(query, chunks_vdb)
     cached_response, quantized, min_val, max_val = await handle_cache(
-        hashing_kv, args_hash, query, "mix", cache_type="query"
+        hashing_kv,
+        args_hash,
+        query,
+        "mix",
+        cache_type="query",
+        embed_query=query_embedding,
+        llm_func=use_model_func,
     )
     if cached_response is not None:
         return cached_response
@@ -1197,7 +2079,13 @@ async def mix_kg_vector_query(
             # Reduce top_k for vector search in hybrid mode since we have structured information from KG
             mix_topk = min(10, query_param.top_k)
             results = await chunks_vdb.query(
-                augmented_query, top_k=mix_topk, ids=query_param.ids
+                augmented_query,
+                top_k=mix_topk,
+                ids=query_param.ids,
+                # Embedded already if the semantic cache looked the query up
+                query_embedding=query_embedding.value
+                if augmented_query == query
+                else None,
             )
             if not results:
                 return None
@@ -1211,6 +2099,7 @@ async def mix_kg_vector_query(
                     # Merge chunk content and time metadata
                     chunk_with_time = {
                         "content": chunk["content"],
+                        "tokens": chunk.get("tokens"),
                         "created_at": result.get("created_at", None),
                         "file_path": result.get("file_path", None),
                     }
@@ -1222,6 +2111,7 @@ async def mix_kg_vector_query(
             maybe_trun_chunks = truncate_list_by_token_size(
                 valid_chunks,
                 key=lambda x: x["content"],
+                count=lambda x: x.get("tokens"),
                 max_token_size=query_param.max_token_for_text_unit,
                 tokenizer=tokenizer,
             )
@@ -1288,8 +2178,9 @@ async def mix_kg_vector_query(
     if query_param.only_need_prompt:
         return sys_prompt
 
-    len_of_prompts = len(tokenizer.encode(query + sys_prompt))
-    logger.debug(f"[mix_kg_vector_query]Prompt Tokens: {len_of_prompts}")
+    if logger.isEnabledFor(logging.DEBUG):
+        len_of_prompts = len(tokenizer.encode(query + sys_prompt))
+        logger.debug(f"[mix_kg_vector_query]Prompt Tokens: {len_of_prompts}")
 
     # 6. Generate response
     response = await use_model_func(
@@ -1325,6 +2216,24 @@ async def mix_kg_vector_query(
                     cache_type="query",
                 ),
             )
+    elif hasattr(response, "__aiter__") and hashing_kv.global_config.get(
+        "enable_llm_cache"
+    ):
+        # Saved once the caller has read the whole stream
+        response = cache_streamed_response(
+            response,
+            hashing_kv,
+            CacheData(
+                args_hash=args_hash,
+                content="",
+                prompt=query,
+                quantized=quantized,
+                min_val=min_val,
+                max_val=max_val,
+                mode="mix",
+                cache_type="query",
+            ),
+        )
 
     return response
 
@@ -1356,19 +2265,29 @@ async def _build_query_context(
             query_param,
         )
     else:  # hybrid mode
-        ll_data = await _get_node_data(
-            ll_keywords,
-            knowledge_graph_inst,
-            entities_vdb,
-            text_chunks_db,
-            query_param,
+        # Both keywords are embedded in one call, the two branches run concurrently
+        # and their graph reads are merged into shared batch requests
+        ll_embedding, hl_embedding = await entities_vdb.embedding_func(
+            [ll_keywords, hl_keywords], _priority=5
         )
-        hl_data = await _get_edge_data(
-            hl_keywords,
-            knowledge_graph_inst,
-            relationships_vdb,
-            text_chunks_db,
-            query_param,
+        graph = _GraphReadBatch(knowledge_graph_inst)
+        ll_data, hl_data = await asyncio.gather(
+            _get_node_data(
+                ll_keywords,
+                graph,
+                entities_vdb,
+                text_chunks_db,
+                query_param,
+                query_embedding=ll_embedding,
+            ),
+            _get_edge_data(
+                hl_keywords,
+                graph,
+                relationships_vdb,
+                text_chunks_db,
+                query_param,
+                query_embedding=hl_embedding,
+            ),
         )
 
         (
@@ -1425,6 +2344,7 @@ async def _get_node_data(
     entities_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage,
     query_param: QueryParam,
+    query_embedding: np.ndarray | None = None,
 ):
     # get similar entities
     logger.info(
@@ -1432,7 +2352,10 @@ async def _get_node_data(
     )
 
     results = await entities_vdb.query(
-        query, top_k=query_param.top_k, ids=query_param.ids
+        query,
+        top_k=query_param.top_k,
+        ids=query_param.ids,
+        query_embedding=query_embedding,
     )
 
     if not len(results):
@@ -1460,16 +2383,18 @@ async def _get_node_data(
         if n is not None
     ]  # what is this text_chunks_db doing.  dont remember it in airvx.  check the diagram.
     # get entitytext chunk
-    use_text_units = await _find_most_related_text_unit_from_entities(
-        node_datas,
-        query_param,
-        text_chunks_db,
-        knowledge_graph_inst,
-    )
-    use_relations = await _find_most_related_edges_from_entities(
-        node_datas,
-        query_param,
-        knowledge_graph_inst,
+    use_text_units, use_relations = await asyncio.gather(
+        _find_most_related_text_unit_from_entities(
+            node_datas,
+            query_param,
+            text_chunks_db,
+            knowledge_graph_inst,
+        ),
+        _find_most_related_edges_from_entities(
+            node_datas,
+            query_param,
+            knowledge_graph_inst,
+        ),
     )
 
     tokenizer: Tokenizer = text_chunks_db.global_config.get("tokenizer")
@@ -1477,6 +2402,7 @@ async def _get_node_data(
     node_datas = truncate_list_by_token_size(
         node_datas,
         key=lambda x: x["description"] if x["description"] is not None else "",
+        count=lambda x: x.get("description_tokens"),
         max_token_size=query_param.max_token_for_local_context,
         tokenizer=tokenizer,
     )
@@ -1616,16 +2542,8 @@ async def _find_most_related_text_unit_from_entities(
                 all_text_units_lookup[c_id] = index
                 tasks.append((c_id, index, this_edges))
 
-    # Process in batches tasks at a time to avoid overwhelming resources
-    batch_size = 5
-    results = []
-
-    for i in range(0, len(tasks), batch_size):
-        batch_tasks = tasks[i : i + batch_size]
-        batch_results = await asyncio.gather(
-            *[text_chunks_db.get_by_id(c_id) for c_id, _, _ in batch_tasks]
-        )
-        results.extend(batch_results)
+    # One multi-get for all chunks instead of one round-trip per chunk
+    results = await text_chunks_db.get_by_ids([c_id for c_id, _, _ in tasks])
 
     for (c_id, index, this_edges), data in zip(tasks, results):
         all_text_units_lookup[c_id] = {
@@ -1660,6 +2578,7 @@ async def _find_most_related_text_unit_from_entities(
     all_text_units = truncate_list_by_token_size(
         all_text_units,
         key=lambda x: x["data"]["content"],
+        count=lambda x: x["data"].get("tokens"),
         max_token_size=query_param.max_token_for_text_unit,
         tokenizer=tokenizer,
     )
@@ -1722,6 +2641,7 @@ async def _find_most_related_edges_from_entities(
     all_edges_data = truncate_list_by_token_size(
         all_edges_data,
         key=lambda x: x["description"] if x["description"] is not None else "",
+        count=lambda x: x.get("description_tokens"),
         max_token_size=query_param.max_token_for_global_context,
         tokenizer=tokenizer,
     )
@@ -1739,13 +2659,17 @@ async def _get_edge_data(
     relationships_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage,
     query_param: QueryParam,
+    query_embedding: np.ndarray | None = None,
 ):
     logger.info(
         f"Query edges: {keywords}, top_k: {query_param.top_k}, cosine: {relationships_vdb.cosine_better_than_threshold}"
     )
 
     results = await relationships_vdb.query(
-        keywords, top_k=query_param.top_k, ids=query_param.ids
+        keywords,
+        top_k=query_param.top_k,
+        ids=query_param.ids,
+        query_embedding=query_embedding,
     )
 
     if not len(results):
@@ -1786,6 +2710,7 @@ async def _get_edge_data(
     edge_datas = truncate_list_by_token_size(
         edge_datas,
         key=lambda x: x["description"] if x["description"] is not None else "",
+        count=lambda x: x.get("description_tokens"),
         max_token_size=query_param.max_token_for_global_context,
         tokenizer=tokenizer,
     )
@@ -1914,6 +2839,7 @@ async def _find_most_related_entities_from_relationships(
     node_datas = truncate_list_by_token_size(
         node_datas,
         key=lambda x: x["description"] if x["description"] is not None else "",
+        count=lambda x: x.get("description_tokens"),
         max_token_size=query_param.max_token_for_local_context,
         tokenizer=tokenizer,
     )
@@ -1935,24 +2861,19 @@ async def _find_related_text_unit_from_relationships(
         for dp in edge_datas
         if dp["source_id"] is not None
     ]
-    all_text_units_lookup = {}
-
-    async def fetch_chunk_data(c_id, index):
-        if c_id not in all_text_units_lookup:
-            chunk_data = await text_chunks_db.get_by_id(c_id)
-            # Only store valid data
-            if chunk_data is not None and "content" in chunk_data:
-                all_text_units_lookup[c_id] = {
-                    "data": chunk_data,
-                    "order": index,
-                }
-
-    tasks = []
+    # The first relationship referencing a chunk decides its order
+    chunk_order = {}
     for index, unit_list in enumerate(text_units):
         for c_id in unit_list:
-            tasks.append(fetch_chunk_data(c_id, index))
-
-    await asyncio.gather(*tasks)
+            chunk_order.setdefault(c_id, index)
+
+    chunk_datas = await text_chunks_db.get_by_ids(list(chunk_order))
+    all_text_units_lookup = {
+        c_id: {"data": chunk_data, "order": chunk_order[c_id]}
+        for c_id, chunk_data in zip(chunk_order, chunk_datas)
+        # Only store valid data
+        if chunk_data is not None and "content" in chunk_data
+    }
 
     if not all_text_units_lookup:
         logger.warning("No valid text chunks found")
@@ -1974,6 +2895,7 @@ async def _find_related_text_unit_from_relationships(
     truncated_text_units = truncate_list_by_token_size(
         valid_text_units,
         key=lambda x: x["data"]["content"],
+        count=lambda x: x["data"].get("tokens"),
         max_token_size=query_param.max_token_for_text_unit,
         tokenizer=tokenizer,
     )
@@ -2024,14 +2946,25 @@ async def naive_query(
 
     # Handle cache
     args_hash = compute_args_hash(query_param.mode, query, cache_type="query")
+    query_embedding = _QueryEmbedding(query, chunks_vdb)
     cached_response, quantized, min_val, max_val = await handle_cache(
-        hashing_kv, args_hash, query, query_param.mode, cache_type="query"
+        hashing_kv,
+        args_hash,
+        query,
+        query_param.mode,
+        cache_type="query",
+        embed_query=query_embedding,
+        llm_func=use_model_func,
     )
     if cached_response is not None:
         return cached_response
 
     results = await chunks_vdb.query(
-        query, top_k=query_param.top_k, ids=query_param.ids
+        query,
+        top_k=query_param.top_k,
+        ids=query_param.ids,
+        # Embedded already if the semantic cache looked the query up
+        query_embedding=query_embedding.value,
     )
     if not len(results):
         return PROMPTS["fail_response"]
@@ -2052,6 +2985,7 @@ async def naive_query(
     maybe_trun_chunks = truncate_list_by_token_size(
         valid_chunks,
         key=lambda x: x["content"],
+        count=lambda x: x.get("tokens"),
         max_token_size=query_param.max_token_for_text_unit,
         tokenizer=tokenizer,
     )
@@ -2094,8 +3028,9 @@ async def naive_query(
     if query_param.only_need_prompt:
         return sys_prompt
 
-    len_of_prompts = len(tokenizer.encode(query + sys_prompt))
-    logger.debug(f"[naive_query]Prompt Tokens: {len_of_prompts}")
+    if logger.isEnabledFor(logging.DEBUG):
+        len_of_prompts = len(tokenizer.encode(query + sys_prompt))
+        logger.debug(f"[naive_query]Prompt Tokens: {len_of_prompts}")
 
     response = await use_model_func(
         query,
@@ -2116,20 +3051,21 @@ async def naive_query(
         )
 
     if hashing_kv.global_config.get("enable_llm_cache"):
-        # Save to cache
-        await save_to_cache(
-            hashing_kv,
-            CacheData(
-                args_hash=args_hash,
-                content=response,
-                prompt=query,
-                quantized=quantized,
-                min_val=min_val,
-                max_val=max_val,
-                mode=query_param.mode,
-                cache_type="query",
-            ),
+        cache_data = CacheData(
+            args_hash=args_hash,
+            content=response,
+            prompt=query,
+            quantized=quantized,
+            min_val=min_val,
+            max_val=max_val,
+            mode=query_param.mode,
+            cache_type="query",
         )
+        if hasattr(response, "__aiter__"):
+            # Saved once the caller has read the whole stream
+            response = cache_streamed_response(response, hashing_kv, cache_data)
+        else:
+            await save_to_cache(hashing_kv, cache_data)
 
     return response
 
@@ -2244,8 +3180,9 @@ async def kg_query_with_keywords(
         return sys_prompt
 
     tokenizer: Tokenizer = global_config["tokenizer"]
-    len_of_prompts = len(tokenizer.encode(query + sys_prompt))
-    logger.debug(f"[kg_query_with_keywords]Prompt Tokens: {len_of_prompts}")
+    if logger.isEnabledFor(logging.DEBUG):
+        len_of_prompts = len(tokenizer.encode(query + sys_prompt))
+        logger.debug(f"[kg_query_with_keywords]Prompt Tokens: {len_of_prompts}")
 
     # 6. Generate response
     response = await use_model_func(
@@ -2281,6 +3218,24 @@ async def kg_query_with_keywords(
                     cache_type="query",
                 ),
             )
+    elif hasattr(response, "__aiter__") and hashing_kv.global_config.get(
+        "enable_llm_cache"
+    ):
+        # Saved once the caller has read the whole stream
+        response = cache_streamed_response(
+            response,
+            hashing_kv,
+            CacheData(
+                args_hash=args_hash,
+                content="",
+                prompt=query,
+                quantized=quantized,
+                min_val=min_val,
+                max_val=max_val,
+                mode=query_param.mode,
+                cache_type="query",
+            ),
+        )
 
     return response
 
@@ -3,16 +3,19 @@ import weakref
 
 import asyncio
 import html
+import itertools
 import csv
 import json
 import logging
 import logging.handlers
 import os
 import re
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
 from functools import wraps
 from hashlib import md5
-from typing import Any, Protocol, Callable, TYPE_CHECKING, List
+from typing import Any, AsyncIterator, Awaitable, Protocol, Callable, TYPE_CHECKING, List
 import xml.etree.ElementTree as ET
 import numpy as np
 from lightrag.prompt import PROMPTS
@@ -29,6 +32,9 @@ load_dotenv(dotenv_path=".env", override=False)
 
 VERBOSE_DEBUG = os.getenv("VERBOSE", "false").lower() == "true"
 
+# Number of strings whose token count Tokenizer.count_tokens remembers
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", 10000))
+
 
 def verbose_debug(msg: str, *args, **kwargs):
     """Function for outputting detailed debug information.
@@ -554,6 +560,443 @@ def priority_limit_async_func_call(max_size: int, max_queue_size: int = 1000):
     return final_decro
 
 
+class ChunkScheduler:
+    """
+    Instance-wide scheduler for chunk extraction, built on
+    priority_limit_async_func_call.
+
+    Every document submits its chunks here, so at most max_size chunks are being
+    extracted at once no matter how many documents are in flight. Chunks are
+    dispatched in rounds: the i-th chunk of a document gets round start + i, where
+    start is the round being dispatched when the document arrived. Documents in
+    flight therefore take turns, and a small document is not queued behind the
+    whole of a large one.
+
+    Keep max_size below the LLM concurrency so the remaining slots stay free for
+    query-time calls, which go to the LLM queue with a higher priority.
+    """
+
+    def __init__(self, max_size: int, max_queue_size: int = 1000):
+        self.max_size = max(1, max_size)
+        self.round = 0
+        self._call = priority_limit_async_func_call(self.max_size, max_queue_size)(
+            self._run
+        )
+
+    async def _run(self, round_no: int, func: Callable[..., Any], *args: Any) -> Any:
+        self.round = max(self.round, round_no)
+        return await func(*args)
+
+    async def map(self, func: Callable[..., Any], items: list[Any]) -> list[Any]:
+        """
+        Run func on every item through the scheduler.
+
+        Args:
+            func: Coroutine function called once per item
+            items: Items of one document, in the order they should be processed
+
+        Returns:
+            Results in the order of items. On the first failure the remaining
+            items are cancelled and the exception is raised.
+        """
+        start = self.round
+        tasks = [
+            asyncio.create_task(self._call(start + i, func, item, _priority=start + i))
+            for i, item in enumerate(items)
+        ]
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception():
+                for pending_task in pending:
+                    pending_task.cancel()
+                if pending:
+                    await asyncio.wait(pending)
+                raise task.exception()
+        return [task.result() for task in tasks]
+
+
+@dataclass
+class PipelineStage:
+    """One stage of run_pipeline_stages
+
+    Attributes:
+        name: Stage name used in the metrics
+        func: Coroutine function taking an item (a list of items when batch is True).
+            Returns the item passed to the next stage (a list when batch is True),
+            None drops it
+        workers: Number of items processed concurrently
+        batch: Hand all items waiting in the input queue to one func call
+    """
+
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+    batch: bool = False
+
+
+class StageMetrics:
+    """Throughput counters of a pipeline stage"""
+
+    def __init__(self, workers: int, queue: asyncio.Queue):
+        self.workers = workers
+        self.queue = queue
+        self.end_markers = 0  # End markers waiting in the queue
+        self.items = 0
+        self.units = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.first_start: float | None = None
+        self.last_end: float | None = None
+
+    def snapshot(self) -> dict[str, Any]:
+        """Counters plus throughput over the time the stage has been active"""
+        elapsed = 0.0
+        if self.first_start is not None and self.last_end is not None:
+            elapsed = self.last_end - self.first_start
+        return {
+            "items": self.items,
+            "units": self.units,
+            "failed": self.failed,
+            "queued": self.queue.qsize() - self.end_markers,
+            "busy_time": round(self.busy_time, 3),
+            "items_per_s": round(self.items / elapsed, 3) if elapsed else 0.0,
+            "units_per_s": round(self.units / elapsed, 3) if elapsed else 0.0,
+            "utilization": round(self.busy_time / (elapsed * self.workers), 3)
+            if elapsed
+            else 0.0,
+        }
+
+
+async def run_pipeline_stages(
+    items: list[Any],
+    stages: list[PipelineStage],
+    queue_size: int,
+    count_units: Callable[[Any], int] | None = None,
+    on_update: Callable[[dict[str, StageMetrics]], None] | None = None,
+) -> dict[str, StageMetrics]:
+    """Pass items through stages connected by bounded queues
+
+    Each stage runs its own workers, so different items are in different stages
+    at the same time, and a full queue holds back the stage feeding it.
+
+    Importance notes:
+    1. Stage functions are expected to handle their own errors. An exception is
+       logged, counted as failed and drops the item, the workers keep running.
+    2. Items are counted when they leave a stage. Units (e.g. chunks) are counted
+       with count_units on the items a stage took, once it processed them.
+
+    Args:
+        items: Items fed to the first stage
+        stages: Stages in processing order
+        queue_size: Capacity of each queue between stages
+        count_units: Size of an item in units, for the units metrics
+        on_update: Called with the metrics whenever an item leaves a stage
+
+    Returns:
+        Metrics per stage name
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    metrics = {
+        stage.name: StageMetrics(stage.workers, queue)
+        for stage, queue in zip(stages, queues)
+    }
+    done = object()
+
+    async def worker(index: int) -> None:
+        stage = stages[index]
+        in_queue = queues[index]
+        out_queue = queues[index + 1] if index + 1 < len(stages) else None
+        stage_metrics = metrics[stage.name]
+        finished = False
+        while not finished:
+            item = await in_queue.get()
+            if item is done:
+                stage_metrics.end_markers -= 1
+                return
+            batch = [item]
+            while stage.batch and not in_queue.empty():
+                item = in_queue.get_nowait()
+                if item is done:
+                    stage_metrics.end_markers -= 1
+                    finished = True
+                    break
+                batch.append(item)
+
+            start = time.perf_counter()
+            if stage_metrics.first_start is None:
+                stage_metrics.first_start = start
+            try:
+                if stage.batch:
+                    results = await stage.func(batch) or []
+                else:
+                    result = await stage.func(batch[0])
+                    results = [] if result is None else [result]
+            except Exception as e:
+                logger.error(f"Pipeline stage {stage.name} failed: {e}")
+                results = []
+            end = time.perf_counter()
+
+            stage_metrics.busy_time += end - start
+            stage_metrics.last_end = end
+            stage_metrics.items += len(results)
+            stage_metrics.failed += len(batch) - len(results)
+            if count_units is not None:
+                stage_metrics.units += sum(count_units(i) for i in batch)
+            if on_update is not None:
+                on_update(metrics)
+            if out_queue is not None:
+                for result in results:
+                    await out_queue.put(result)
+
+    async def run_stage(index: int) -> None:
+        await asyncio.gather(*[worker(index) for _ in range(stages[index].workers)])
+        # Every worker of the next stage gets its own end marker
+        if index + 1 < len(stages):
+            await put_end_markers(index + 1)
+
+    async def put_end_markers(index: int) -> None:
+        for _ in range(stages[index].workers):
+            metrics[stages[index].name].end_markers += 1
+            await queues[index].put(done)
+
+    async def feed() -> None:
+        for item in items:
+            await queues[0].put(item)
+        await put_end_markers(0)
+
+    await asyncio.gather(feed(), *[run_stage(i) for i in range(len(stages))])
+    return metrics
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    """Check whether an exception raised by an LLM/embedding call means HTTP 429"""
+    if getattr(e, "status_code", None) == 429:
+        return True
+    return any("RateLimit" in cls.__name__ for cls in type(e).__mro__)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token-bucket rate limiter with an AIMD (additive increase, multiplicative
+    decrease) concurrency window.
+
+    Two buckets are enforced: requests per second and tokens per minute. A budget
+    of 0 disables that bucket. The concurrency window starts at max_concurrency,
+    grows by 1/window per successful call, and is multiplied by decrease_factor on
+    a 429 or when latency exceeds latency_target. After a 429 every caller pauses
+    for a short, growing cooldown, so a throttled provider sees one backoff instead
+    of a retry storm.
+
+    One instance is meant to be shared by every call made to the same provider.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        requests_per_second: float = 0,
+        tokens_per_minute: float = 0,
+        latency_target: float = 0,
+        min_concurrency: int = 1,
+        decrease_factor: float = 0.5,
+        max_cooldown: float = 30.0,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.max_cooldown = max_cooldown
+
+        self.window = float(self.max_concurrency)
+        self.in_flight = 0
+        self.rate_limited_count = 0
+
+        now = time.monotonic()
+        self._request_tokens = max(1.0, requests_per_second)
+        self._llm_tokens = float(tokens_per_minute)
+        self._refilled_at = now
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._consecutive_limited = 0
+        self._admission_lock = None
+        self._slot_released = None
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.requests_per_second > 0:
+            self._request_tokens = min(
+                max(1.0, self.requests_per_second),
+                self._request_tokens + elapsed * self.requests_per_second,
+            )
+        if self.tokens_per_minute > 0:
+            self._llm_tokens = min(
+                float(self.tokens_per_minute),
+                self._llm_tokens + elapsed * self.tokens_per_minute / 60,
+            )
+
+    def _wait_time(self, cost: int, now: float) -> float:
+        """Seconds until a call of the given token cost may start, 0 if it may start now"""
+        wait = max(0.0, self._blocked_until - now)
+        if self.in_flight >= int(self.window):
+            # Woken up by release(); the timeout is only a safety net
+            wait = max(wait, 1.0)
+        if self.requests_per_second > 0 and self._request_tokens < 1:
+            wait = max(wait, (1 - self._request_tokens) / self.requests_per_second)
+        if self.tokens_per_minute > 0:
+            # A single call larger than the whole budget only has to wait for a full bucket
+            cost = min(cost, self.tokens_per_minute)
+            if self._llm_tokens < cost:
+                wait = max(
+                    wait, (cost - self._llm_tokens) * 60 / self.tokens_per_minute
+                )
+        return wait
+
+    async def acquire(self, cost: int = 0) -> None:
+        """Wait for a concurrency slot and enough budget, then consume it"""
+        if self._admission_lock is None:
+            self._admission_lock = asyncio.Lock()
+            self._slot_released = asyncio.Event()
+
+        # Admission is FIFO: later callers queue behind the one waiting for budget
+        async with self._admission_lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_time(cost, now)
+                if wait <= 0:
+                    break
+                self._slot_released.clear()
+                try:
+                    await asyncio.wait_for(self._slot_released.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            self.in_flight += 1
+            if self.requests_per_second > 0:
+                self._request_tokens -= 1
+            if self.tokens_per_minute > 0:
+                self._llm_tokens -= min(cost, self.tokens_per_minute)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        if self._slot_released is not None:
+            self._slot_released.set()
+
+    def charge(self, cost: int) -> None:
+        """Consume budget known only after the call, e.g. completion tokens"""
+        if self.tokens_per_minute > 0 and cost > 0:
+            self._refill(time.monotonic())
+            # May go negative: the debt delays the next callers
+            self._llm_tokens -= cost
+
+    def _decrease(self, now: float) -> None:
+        # Decrease at most once per cooldown period, so a burst of failures from
+        # calls started before the first one is reported only halves the window once
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.window = max(self.min_concurrency, self.window * self.decrease_factor)
+
+    def on_success(self, latency: float) -> None:
+        self._consecutive_limited = 0
+        now = time.monotonic()
+        if self.latency_target > 0 and latency > self.latency_target:
+            self._decrease(now)
+        else:
+            self.window = min(self.max_concurrency, self.window + 1 / self.window)
+
+    def on_rate_limited(self) -> float:
+        """Record a 429 and return the cooldown every caller now waits for"""
+        self.rate_limited_count += 1
+        self._consecutive_limited += 1
+        now = time.monotonic()
+        self._decrease(now)
+        cooldown = min(self.max_cooldown, 2 ** (self._consecutive_limited - 1))
+        self._blocked_until = max(self._blocked_until, now + cooldown)
+        logger.warning(
+            f"rate_limit: throttled by provider, concurrency window {self.window:.1f}, "
+            f"pausing {cooldown}s"
+        )
+        return cooldown
+
+
+def _count_prompt_tokens(
+    args: tuple, kwargs: dict, token_counter: Callable[[str], int]
+) -> int:
+    """Count tokens of the text arguments of an LLM or embedding call"""
+
+    def count(value: Any) -> int:
+        if isinstance(value, str):
+            return token_counter(value)
+        if isinstance(value, dict):
+            return count(value.get("content"))
+        if isinstance(value, (list, tuple)):
+            return sum(count(v) for v in value)
+        return 0
+
+    text_kwargs = ("prompt", "system_prompt", "history_messages", "texts")
+    return count(args) + count([v for k, v in kwargs.items() if k in text_kwargs])
+
+
+def rate_limit_async_func_call(
+    limiter: AdaptiveRateLimiter,
+    token_counter: Callable[[str], int] | None = None,
+    max_retries: int = 5,
+):
+    """
+    Rate-limit an async LLM or embedding function through a shared AdaptiveRateLimiter
+
+    Calls rejected with a rate-limit error are retried here, after the limiter's
+    cooldown, so the wrapped function should not retry 429s on its own.
+
+    Args:
+        limiter: Limiter shared by all functions calling the same provider
+        token_counter: Counts tokens of a string for the tokens-per-minute budget;
+            prompt tokens are charged up front and string results afterwards
+        max_retries: Maximum retries of a call rejected with a rate-limit error
+    Returns:
+        Decorator function
+    """
+
+    def final_decro(func):
+        @wraps(func)
+        async def wait_func(*args, **kwargs):
+            cost = 0
+            if token_counter is not None and limiter.tokens_per_minute > 0:
+                cost = _count_prompt_tokens(args, kwargs, token_counter)
+
+            for attempt in range(max_retries + 1):
+                await limiter.acquire(cost)
+                start = time.monotonic()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    if is_rate_limit_error(e) and attempt < max_retries:
+                        limiter.on_rate_limited()
+                        continue
+                    raise
+                finally:
+                    limiter.release()
+
+                limiter.on_success(time.monotonic() - start)
+                if (
+                    token_counter is not None
+                    and limiter.tokens_per_minute > 0
+                    and isinstance(result, str)
+                ):
+                    limiter.charge(token_counter(result))
+                return result
+
+        wait_func.limiter = limiter
+        return wait_func
+
+    return final_decro
+
+
 def wrap_embedding_func_with_attrs(**kwargs):
     """Wrap a function with attributes"""
 
@@ -605,6 +1048,11 @@ class Tokenizer:
         """
         self.model_name: str = model_name
         self.tokenizer: TokenizerInterface = tokenizer
+        # Byte length, or bytes, of each token ID, see encode_with_offsets
+        self._token_lengths: np.ndarray | None = None
+        self._token_pieces: dict[int, bytes] = {}
+        # Token counts of recently counted strings, see count_tokens
+        self._token_counts: OrderedDict[str, int] = OrderedDict()
 
     def encode(self, content: str) -> List[int]:
         """
@@ -630,6 +1078,75 @@ class Tokenizer:
         """
         return self.tokenizer.decode(tokens)
 
+    def count_tokens(self, content: str) -> int:
+        """
+        Counts the tokens of a string, remembering the counts of the last
+        TOKEN_COUNT_CACHE_SIZE strings.
+
+        Args:
+            content: The string to count.
+
+        Returns:
+            The number of tokens in content.
+        """
+        count = self._token_counts.get(content)
+        if count is not None:
+            self._token_counts.move_to_end(content)
+            return count
+        count = len(self.encode(content))
+        self._token_counts[content] = count
+        if len(self._token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            self._token_counts.popitem(last=False)
+        return count
+
+    def encode_with_offsets(self, content: str) -> tuple[List[int], np.ndarray | None]:
+        """
+        Encodes a string and maps every token to where it starts in the UTF-8
+        encoded content.
+
+        The byte length of every token is computed once per token ID: from the
+        token bytes when the underlying tokenizer exposes them (tiktoken), otherwise
+        by decoding the token alone. In the latter case the map is only accepted if
+        the pieces add up to the content exactly.
+
+        Args:
+            content: The string to encode.
+
+        Returns:
+            The tokens, and the byte offset of each token in content.encode("utf-8")
+            as an int64 array. The offsets are None when tokens cannot be mapped
+            back to the content.
+        """
+        tokens = self.encode(content)
+        data = content.encode("utf-8")
+        token_ids = np.fromiter(tokens, dtype=np.int64, count=len(tokens))
+
+        if hasattr(self.tokenizer, "decode_single_token_bytes"):
+            if self._token_lengths is None:
+                self._token_lengths = np.zeros(self.tokenizer.n_vocab, dtype=np.int64)
+                for token in range(self.tokenizer.n_vocab):
+                    try:
+                        self._token_lengths[token] = len(
+                            self.tokenizer.decode_single_token_bytes(token)
+                        )
+                    except KeyError:
+                        pass
+            lengths = self._token_lengths[token_ids]
+        else:
+            pieces = self._token_pieces
+            for token in set(tokens).difference(pieces):
+                pieces[token] = self.decode([token]).encode("utf-8")
+            if b"".join(pieces[token] for token in tokens) != data:
+                return tokens, None
+            lengths = np.fromiter(
+                (len(pieces[token]) for token in tokens), dtype=np.int64, count=len(tokens)
+            )
+
+        offsets = np.cumsum(lengths) - lengths
+        if len(tokens) and offsets[-1] + lengths[-1] != len(data):
+            return tokens, None
+        return tokens, offsets
+
 
 class TiktokenTokenizer(Tokenizer):
     """
@@ -660,6 +1177,10 @@ class TiktokenTokenizer(Tokenizer):
         except KeyError:
             raise ValueError(f"Invalid model_name: {model_name}.")
 
+    def __reduce__(self):
+        # Rebuilt from the model name when sent to worker processes
+        return self.__class__, (self.model_name,)
+
 
 def pack_user_ass_to_openai_messages(*args: str):
     roles = ["user", "assistant"]
@@ -699,18 +1220,36 @@ def truncate_list_by_token_size(
     key: Callable[[Any], str],
     max_token_size: int,
     tokenizer: Tokenizer,
+    count: Callable[[Any], Any] | None = None,
 ) -> list[int]:
-    """Truncate a list of data by token size"""
+    """Truncate a list of data by token size
+
+    count returns the token count stored with an item (chunk `tokens`, node and edge
+    `description_tokens`). Items without a usable stored count are counted with
+    tokenizer.count_tokens(key(item)).
+    """
     if max_token_size <= 0:
         return []
     tokens = 0
     for i, data in enumerate(list_data):
-        tokens += len(tokenizer.encode(key(data)))
+        stored = count(data) if count is not None else None
+        try:
+            tokens += int(stored)
+        except (TypeError, ValueError):
+            # No stored count, or one the storage returned in an unusable form
+            tokens += tokenizer.count_tokens(key(data))
         if tokens > max_token_size:
             return list_data[:i]
     return list_data
 
 
+def with_description_tokens(data: dict[str, Any], tokenizer: Tokenizer) -> dict[str, Any]:
+    """Store the token count of a node or edge description as `description_tokens`,
+    so truncate_list_by_token_size does not tokenize it on every query"""
+    data["description_tokens"] = tokenizer.count_tokens(data.get("description") or "")
+    return data
+
+
 def list_of_list_to_json(data: list[list[str]]) -> list[dict[str, str]]:
     if not data or len(data) <= 1:
         return []
@@ -815,6 +1354,265 @@ def process_combine_contexts(
     return combined_data
 
 
+EMBEDDING_CACHE_ANN_THRESHOLD = int(os.getenv("EMBEDDING_CACHE_ANN_THRESHOLD", 20000))
+EMBEDDING_CACHE_ANN_NPROBE = int(os.getenv("EMBEDDING_CACHE_ANN_NPROBE", 4))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _train_ivf(matrix: np.ndarray, n_lists: int, iterations: int = 8) -> tuple:
+    """Spherical k-means over a sample of rows, returns (centroids, assignment of every row)"""
+    rng = np.random.default_rng(0)
+    n = len(matrix)
+    sample = matrix[rng.choice(n, min(n, n_lists * 16), replace=False)]
+    n_lists = min(n_lists, len(sample))
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]
+        centroids = _normalize_rows(sums)
+    assignment = np.empty(n, dtype=np.int64)
+    for start in range(0, n, 8192):
+        block = matrix[start : start + 8192]
+        assignment[start : start + 8192] = np.argmax(block @ centroids.T, axis=1)
+    return centroids, assignment
+
+
+class EmbeddingCacheMatrix:
+    """Pre-normalized embeddings of the cache entries of one mode and cache_type
+
+    Rows live in one contiguous float32 matrix, so a lookup is a single
+    matrix-vector product plus argmax instead of dequantizing every entry.
+
+    Importance notes:
+    1. Once the matrix holds EMBEDDING_CACHE_ANN_THRESHOLD rows, an inverted file
+       index (spherical k-means centroids) is trained in a worker thread. Lookups
+       then only score the rows of the EMBEDDING_CACHE_ANN_NPROBE closest lists,
+       and fall back to the exact product until training has finished.
+    2. The index is retrained in the background whenever the matrix has doubled
+       since the last training; rows added in between are assigned to their
+       nearest existing centroid.
+    """
+
+    def __init__(self, dim: int):
+        self.ids: list[str] = []
+        self._rows: dict[str, int] = {}
+        self._matrix = np.zeros((16, dim), dtype=np.float32)
+        self._centroids: np.ndarray | None = None
+        self._lists: list[list[int]] = []
+        self._assignment: list[int] = []
+        self._trained_size = 0
+        self._training = False
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, cache_id: str, embedding: np.ndarray) -> None:
+        """Insert or replace the embedding of a cache entry"""
+        self.add_many([cache_id], np.asarray(embedding, dtype=np.float32)[None, :])
+
+    def add_many(self, cache_ids: list[str], embeddings: np.ndarray) -> None:
+        embeddings = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        for cache_id, vector in zip(cache_ids, embeddings):
+            row = self._rows.get(cache_id)
+            if row is None:
+                row = len(self.ids)
+                if row == len(self._matrix):
+                    grown = np.zeros(
+                        (2 * len(self._matrix), self._matrix.shape[1]), dtype=np.float32
+                    )
+                    grown[:row] = self._matrix
+                    self._matrix = grown
+                self._rows[cache_id] = row
+                self.ids.append(cache_id)
+                self._matrix[row] = vector
+                if self._centroids is not None:
+                    self._assign_row(row)
+            else:
+                self._matrix[row] = vector
+                if self._centroids is not None:
+                    self._lists[self._assignment[row]].remove(row)
+                    self._assign_row(row, reassign=True)
+        self._maybe_train()
+
+    def _assign_row(self, row: int, reassign: bool = False) -> None:
+        label = int(np.argmax(self._centroids @ self._matrix[row]))
+        self._lists[label].append(row)
+        if reassign:
+            self._assignment[row] = label
+        else:
+            self._assignment.append(label)
+
+    def _maybe_train(self) -> None:
+        size = len(self.ids)
+        if (
+            self._training
+            or size < EMBEDDING_CACHE_ANN_THRESHOLD
+            or size < 2 * self._trained_size
+        ):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._install_index(size, *_train_ivf(self._matrix[:size], self._n_lists(size)))
+            return
+        self._training = True
+        snapshot = self._matrix[:size]
+        future = loop.run_in_executor(
+            None, _train_ivf, snapshot, self._n_lists(size)
+        )
+
+        def done(fut):
+            self._training = False
+            if fut.exception() is not None:
+                logger.warning(f"Embedding cache index training failed: {fut.exception()}")
+                return
+            self._install_index(size, *fut.result())
+
+        future.add_done_callback(done)
+
+    @staticmethod
+    def _n_lists(size: int) -> int:
+        return max(1, int(2 * np.sqrt(size)))
+
+    def _install_index(self, size: int, centroids: np.ndarray, assignment) -> None:
+        self._centroids = centroids
+        self._assignment = assignment.tolist()
+        self._lists = [[] for _ in range(len(centroids))]
+        for row, label in enumerate(self._assignment):
+            self._lists[label].append(row)
+        self._trained_size = size
+        # Rows added while the index was being trained
+        for row in range(size, len(self.ids)):
+            self._assign_row(row)
+        logger.debug(
+            f"Embedding cache index trained: {size} rows, {len(centroids)} lists"
+        )
+
+    def best(self, embedding) -> tuple[float, str | None]:
+        """Return (cosine similarity, cache id) of the most similar entry"""
+        size = len(self.ids)
+        if size == 0:
+            return -1.0, None
+        query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return -1.0, None
+        query = query / norm
+        if self._centroids is None:
+            scores = self._matrix[:size] @ query
+            row = int(np.argmax(scores))
+            return float(scores[row]), self.ids[row]
+
+        nprobe = min(EMBEDDING_CACHE_ANN_NPROBE, len(self._centroids))
+        centroid_scores = self._centroids @ query
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        candidates = np.fromiter(
+            itertools.chain.from_iterable(self._lists[p] for p in probes), dtype=np.int64
+        )
+        if len(candidates) == 0:
+            return -1.0, None
+        scores = self._matrix[candidates] @ query
+        best = int(np.argmax(scores))
+        return float(scores[best]), self.ids[int(candidates[best])]
+
+
+def _decode_cached_embeddings(entries: list[tuple[str, dict]]) -> tuple:
+    """Dequantize the embeddings of cache entries in one vectorized step"""
+    ids, quantized, mins, maxs = [], [], [], []
+    for cache_id, cache_data in entries:
+        embedding_min = cache_data.get("embedding_min")
+        embedding_max = cache_data.get("embedding_max")
+        if (
+            embedding_min is None
+            or embedding_max is None
+            or embedding_min >= embedding_max
+        ):
+            logger.warning(
+                f"Invalid embedding min/max values: min={embedding_min}, max={embedding_max}"
+            )
+            continue
+        try:
+            quantized.append(
+                np.frombuffer(
+                    bytes.fromhex(cache_data["embedding"]), dtype=np.uint8
+                ).reshape(cache_data["embedding_shape"])
+            )
+        except Exception as e:
+            logger.warning(f"Error processing cached embedding: {str(e)}")
+            continue
+        ids.append(cache_id)
+        mins.append(embedding_min)
+        maxs.append(embedding_max)
+    if not ids:
+        return [], None
+    # All embeddings of one storage share a dimension, skip any that do not
+    dim = quantized[0].size
+    keep = [i for i, q in enumerate(quantized) if q.size == dim]
+    stacked = np.stack([quantized[i].reshape(-1) for i in keep]).astype(np.float32)
+    mins = np.asarray([mins[i] for i in keep], dtype=np.float32)[:, None]
+    maxs = np.asarray([maxs[i] for i in keep], dtype=np.float32)[:, None]
+    return [ids[i] for i in keep], stacked * ((maxs - mins) / 255) + mins
+
+
+def get_embedding_cache_matrices(
+    hashing_kv, mode: str, mode_cache: dict[str, Any]
+) -> dict[str | None, EmbeddingCacheMatrix]:
+    """Get the embedding matrices of a cache mode by cache_type, rebuilding them if the mode changed
+
+    The matrices are kept on the storage object. They are rebuilt from the stored
+    quantized embeddings when the number of entries in the mode no longer matches,
+    e.g. after the cache was cleared or written by another process.
+    """
+    cache = hashing_kv.__dict__.setdefault("_embedding_cache_matrices", {})
+    entry = cache.get(mode)
+    if entry is None or entry["count"] != len(mode_cache):
+        by_type: dict[str | None, list] = {}
+        for cache_id, cache_data in mode_cache.items():
+            if cache_data.get("embedding") is None:
+                continue
+            by_type.setdefault(cache_data.get("cache_type"), []).append(
+                (cache_id, cache_data)
+            )
+        matrices = {}
+        for entry_type, entries in by_type.items():
+            ids, embeddings = _decode_cached_embeddings(entries)
+            if ids:
+                matrices[entry_type] = EmbeddingCacheMatrix(embeddings.shape[1])
+                matrices[entry_type].add_many(ids, embeddings)
+        entry = cache[mode] = {"count": len(mode_cache), "matrices": matrices}
+    return entry["matrices"]
+
+
+def _update_embedding_cache_matrix(
+    hashing_kv, cache_data: "CacheData", is_new: bool
+) -> None:
+    """Add a saved cache entry to the in-memory matrix of its mode, if one was built"""
+    entry = getattr(hashing_kv, "_embedding_cache_matrices", {}).get(cache_data.mode)
+    if entry is None:
+        return
+    if is_new:
+        entry["count"] += 1
+    if cache_data.quantized is None:
+        return
+    embedding = dequantize_embedding(
+        cache_data.quantized, cache_data.min_val, cache_data.max_val
+    ).reshape(-1)
+    matrix = entry["matrices"].get(cache_data.cache_type)
+    if matrix is None:
+        matrix = entry["matrices"][cache_data.cache_type] = EmbeddingCacheMatrix(
+            embedding.size
+        )
+    matrix.add(cache_data.args_hash, embedding)
+
+
 async def get_best_cached_response(
     hashing_kv,
     current_embedding,
@@ -832,56 +1630,22 @@ async def get_best_cached_response(
     if not mode_cache:
         return None
 
+    matrices = get_embedding_cache_matrices(hashing_kv, mode, mode_cache)
+    if cache_type:
+        matrices = [matrices[cache_type]] if cache_type in matrices else []
+    else:
+        matrices = list(matrices.values())
+
     best_similarity = -1
-    best_response = None
-    best_prompt = None
     best_cache_id = None
-
-    # Only iterate through cache entries for this mode
-    for cache_id, cache_data in mode_cache.items():
-        # Skip if cache_type doesn't match
-        if cache_type and cache_data.get("cache_type") != cache_type:
-            continue
-
-        # Check if cache data is valid
-        if cache_data["embedding"] is None:
-            continue
-
-        try:
-            # Safely convert cached embedding
-            cached_quantized = np.frombuffer(
-                bytes.fromhex(cache_data["embedding"]), dtype=np.uint8
-            ).reshape(cache_data["embedding_shape"])
-
-            # Ensure min_val and max_val are valid float values
-            embedding_min = cache_data.get("embedding_min")
-            embedding_max = cache_data.get("embedding_max")
-
-            if (
-                embedding_min is None
-                or embedding_max is None
-                or embedding_min >= embedding_max
-            ):
-                logger.warning(
-                    f"Invalid embedding min/max values: min={embedding_min}, max={embedding_max}"
-                )
-                continue
-
-            cached_embedding = dequantize_embedding(
-                cached_quantized,
-                embedding_min,
-                embedding_max,
-            )
-        except Exception as e:
-            logger.warning(f"Error processing cached embedding: {str(e)}")
-            continue
-
-        similarity = cosine_similarity(current_embedding, cached_embedding)
+    for matrix in matrices:
+        similarity, cache_id = matrix.best(current_embedding)
         if similarity > best_similarity:
-            best_similarity = similarity
-            best_response = cache_data["return"]
-            best_prompt = cache_data["original_prompt"]
-            best_cache_id = cache_id
+            best_similarity, best_cache_id = similarity, cache_id
+    if best_cache_id is None or best_cache_id not in mode_cache:
+        return None
+    best_response = mode_cache[best_cache_id]["return"]
+    best_prompt = mode_cache[best_cache_id]["original_prompt"]
 
     if best_similarity > similarity_threshold:
         # If LLM check is enabled and all required parameters are provided
@@ -919,6 +1683,8 @@ async def get_best_cached_response(
                     }
                     logger.debug(json.dumps(log_data, ensure_ascii=False))
                     logger.info(f"Cache rejected by LLM(mode:{mode} tpye:{cache_type})")
+                    if cache_type == "query":
+                        get_query_cache_metrics(hashing_kv).llm_rejections += 1
                     return None
             except Exception as e:  # Catch all possible exceptions
                 logger.warning(f"LLM similarity check failed: {e}")
@@ -936,6 +1702,8 @@ async def get_best_cached_response(
             "original_prompt": prompt_display,
         }
         logger.debug(json.dumps(log_data, ensure_ascii=False))
+        if cache_type == "query":
+            get_query_cache_metrics(hashing_kv).record_semantic_hit(best_similarity)
         return best_response
     return None
 
@@ -982,14 +1750,78 @@ def dequantize_embedding(
     return (quantized * scale + min_val).astype(np.float32)
 
 
+class QueryCacheMetrics:
+    """Counters of the query answer cache (cache_type "query"), kept per cache storage,
+    see get_query_cache_metrics. Keyword extraction lookups are not counted."""
+
+    def __init__(self):
+        self.lookups = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        # Semantic candidates above the threshold that the LLM check judged different
+        self.llm_rejections = 0
+        self.lookup_time = 0.0
+        self.min_hit_similarity: float | None = None
+
+    def record_semantic_hit(self, similarity: float) -> None:
+        self.semantic_hits += 1
+        if self.min_hit_similarity is None or similarity < self.min_hit_similarity:
+            self.min_hit_similarity = similarity
+
+    def snapshot(self) -> dict[str, Any]:
+        """Counters plus hit rates and mean lookup latency"""
+        hits = self.exact_hits + self.semantic_hits
+        candidates = self.semantic_hits + self.llm_rejections
+        return {
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "llm_rejections": self.llm_rejections,
+            "hit_rate": round(hits / self.lookups, 3) if self.lookups else 0.0,
+            "semantic_hit_rate": round(self.semantic_hits / self.lookups, 3)
+            if self.lookups
+            else 0.0,
+            # Share of semantic candidates the LLM check caught as false hits. Only
+            # meaningful with use_llm_check on: without the check nothing is ever
+            # rejected and this stays 0.0 whatever the real false hit rate is
+            "false_hit_rate": round(self.llm_rejections / candidates, 3)
+            if candidates
+            else 0.0,
+            "min_hit_similarity": round(self.min_hit_similarity, 4)
+            if self.min_hit_similarity is not None
+            else None,
+            "avg_lookup_ms": round(self.lookup_time / self.lookups * 1000, 3)
+            if self.lookups
+            else 0.0,
+        }
+
+
+def get_query_cache_metrics(hashing_kv) -> QueryCacheMetrics:
+    """Get the query cache metrics kept on the storage object"""
+    return hashing_kv.__dict__.setdefault("_query_cache_metrics", QueryCacheMetrics())
+
+
 async def handle_cache(
     hashing_kv,
     args_hash,
     prompt,
     mode="default",
     cache_type=None,
+    embed_query: Callable[[], Awaitable[np.ndarray]] | None = None,
+    llm_func: Callable[..., Any] | None = None,
 ):
-    """Generic cache handling function"""
+    """Generic cache handling function
+
+    Queries are looked up by args_hash first. With embedding_cache_config["enabled"],
+    a miss falls back to the most similar cached question of the same mode
+    (get_best_cached_response). The query embedding comes from embed_query, which is
+    only awaited on such a miss; its quantized form is returned so save_to_cache stores
+    it with the new answer.
+
+    Returns:
+        (cached response, quantized embedding, min value, max value); the response is
+        None on a miss, the embedding parts are None unless the semantic cache is used
+    """
     if hashing_kv is None:
         return None, None, None, None
 
@@ -1000,16 +1832,128 @@ async def handle_cache(
         if not hashing_kv.global_config.get("enable_llm_cache_for_entity_extract"):
             return None, None, None, None
 
-    if exists_func(hashing_kv, "get_by_mode_and_id"):
-        mode_cache = await hashing_kv.get_by_mode_and_id(mode, args_hash) or {}
-    else:
-        mode_cache = await hashing_kv.get_by_id(mode) or {}
-    if args_hash in mode_cache:
-        logger.debug(f"Non-embedding cached hit(mode:{mode} type:{cache_type})")
-        return mode_cache[args_hash]["return"], None, None, None
+    # Only answer lookups are counted, keyword lookups share the mode but would skew the rates
+    metrics = get_query_cache_metrics(hashing_kv) if cache_type == "query" else None
+    start = time.perf_counter()
+    try:
+        if exists_func(hashing_kv, "get_by_mode_and_id"):
+            mode_cache = await hashing_kv.get_by_mode_and_id(mode, args_hash) or {}
+        else:
+            mode_cache = await hashing_kv.get_by_id(mode) or {}
+        if args_hash in mode_cache:
+            logger.debug(f"Non-embedding cached hit(mode:{mode} type:{cache_type})")
+            if metrics is not None:
+                metrics.exact_hits += 1
+            return mode_cache[args_hash]["return"], None, None, None
+
+        embedding_cache_config = hashing_kv.global_config.get("embedding_cache_config") or {}
+        if (
+            mode != "default"
+            and embed_query is not None
+            and embedding_cache_config.get("enabled")
+        ):
+            query_embedding = np.asarray(await embed_query(), dtype=np.float32).reshape(-1)
+            best_cached_response = await get_best_cached_response(
+                hashing_kv,
+                query_embedding,
+                similarity_threshold=embedding_cache_config.get(
+                    "similarity_threshold", 0.95
+                ),
+                mode=mode,
+                use_llm_check=embedding_cache_config.get("use_llm_check", False),
+                llm_func=llm_func,
+                original_prompt=prompt,
+                cache_type=cache_type,
+            )
+            if best_cached_response is not None:
+                return best_cached_response, None, None, None
+            quantized, min_val, max_val = quantize_embedding(query_embedding)
+            # Stored in the cache as JSON, numpy scalars are not serializable
+            return None, quantized, float(min_val), float(max_val)
+
+        logger.debug(f"Non-embedding cached missed(mode:{mode} type:{cache_type})")
+        return None, None, None, None
+    finally:
+        if metrics is not None:
+            metrics.lookups += 1
+            metrics.lookup_time += time.perf_counter() - start
+
+
+class ReadThroughKVCache:
+    """
+    Read-through LRU cache in front of a KV storage, used for text chunks at query time.
+
+    get_by_id/get_by_ids serve hot records from memory and fetch the misses with one
+    get_by_ids call on the wrapped storage. upsert/delete/drop go to the storage and
+    invalidate the affected keys; every other attribute is delegated unchanged, so the
+    wrapper can be used wherever the storage is.
+
+    Importance notes:
+    1. Cached records are returned as-is, callers must not modify them
+    2. Only writes made through this wrapper invalidate the cache. Chunk ids are
+       content hashes, so another process can at worst serve a chunk it deleted
+       until the entry is evicted
+    """
+
+    def __init__(self, storage: "BaseKVStorage", max_size: int):
+        self.storage = storage
+        self.max_size = max(1, max_size)
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        # Bumped on every write, so a fetch racing with a write does not cache stale data
+        self._generation = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.storage, name)
+
+    async def get_by_id(self, id: str) -> dict[str, Any] | None:
+        return (await self.get_by_ids([id]))[0]
+
+    async def get_by_ids(self, ids: list[str]) -> list[dict[str, Any] | None]:
+        found: dict[str, dict[str, Any] | None] = {}
+        for id in ids:
+            if id in self._cache:
+                self._cache.move_to_end(id)
+                found[id] = self._cache[id]
+        missing = [id for id in dict.fromkeys(ids) if id not in found]
+        self.hits += len(ids) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            generation = self._generation
+            records = await self.storage.get_by_ids(missing)
+            for id, record in zip(missing, records):
+                found[id] = record
+                if record is not None and generation == self._generation:
+                    self._cache[id] = record
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return [found.get(id) for id in ids]
+
+    def invalidate(self, ids: list[str] | None = None) -> None:
+        """Drop the given keys from the cache, all keys when ids is None"""
+        self._generation += 1
+        if ids is None:
+            self._cache.clear()
+            return
+        for id in ids:
+            self._cache.pop(id, None)
+
+    async def upsert(self, data: dict[str, dict[str, Any]]) -> None:
+        self.invalidate(list(data))
+        await self.storage.upsert(data)
+        self.invalidate(list(data))
+
+    async def delete(self, ids: list[str]) -> None:
+        self.invalidate(ids)
+        await self.storage.delete(ids)
+        self.invalidate(ids)
 
-    logger.debug(f"Non-embedding cached missed(mode:{mode} type:{cache_type})")
-    return None, None, None, None
+    async def drop(self) -> dict[str, str]:
+        self.invalidate()
+        result = await self.storage.drop()
+        self.invalidate()
+        return result
 
 
 @dataclass
@@ -1049,8 +1993,10 @@ async def save_to_cache(hashing_kv, cache_data: CacheData):
     else:
         mode_cache = await hashing_kv.get_by_id(cache_data.mode) or {}
 
+    is_new = cache_data.args_hash not in mode_cache
+
     # Check if we already have identical content cached
-    if cache_data.args_hash in mode_cache:
+    if not is_new:
         existing_content = mode_cache[cache_data.args_hash].get("return")
         if existing_content == cache_data.content:
             logger.info(
@@ -1077,6 +2023,35 @@ async def save_to_cache(hashing_kv, cache_data: CacheData):
 
     # Only upsert if there's actual new content
     await hashing_kv.upsert({cache_data.mode: mode_cache})
+    _update_embedding_cache_matrix(hashing_kv, cache_data, is_new)
+
+
+async def cache_streamed_response(
+    stream: AsyncIterator[str], hashing_kv, cache_data: CacheData
+) -> AsyncIterator[str]:
+    """Pass a streaming response through and cache it once it is complete.
+
+    save_to_cache skips streaming responses, so the pieces are collected here and the
+    joined text is saved when the stream ends. Nothing is cached if the stream fails
+    or the caller stops reading early.
+
+    Args:
+        stream: The streaming LLM response
+        hashing_kv: The key-value storage for caching
+        cache_data: The cache data to save, content is filled in from the stream
+    """
+    parts = []
+    try:
+        async for part in stream:
+            parts.append(part)
+            yield part
+        cache_data.content = "".join(parts)
+        await save_to_cache(hashing_kv, cache_data)
+    finally:
+        # Close the LLM stream when the caller stops early, see _stream_then_query_done
+        aclose = getattr(stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
 
 
 def safe_unicode_decode(content):
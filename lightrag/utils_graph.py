@@ -5,7 +5,7 @@ from typing import Any, cast
 
 from .kg.shared_storage import get_graph_db_lock
 from .prompt import GRAPH_FIELD_SEP
-from .utils import compute_mdhash_id, logger
+from .utils import compute_mdhash_id, logger, with_description_tokens
 from .base import StorageNameSpace
 
 
@@ -139,6 +139,7 @@ async def aedit_entity(
     Returns:
         Dictionary containing updated entity information
     """
+    tokenizer = chunk_entity_relation_graph.global_config["tokenizer"]
     graph_db_lock = get_graph_db_lock(enable_logging=False)
     # Use graph database lock to ensure atomic graph and vector db operations
     async with graph_db_lock:
@@ -183,7 +184,7 @@ async def aedit_entity(
 
                 # Create new entity
                 await chunk_entity_relation_graph.upsert_node(
-                    new_entity_name, new_node_data
+                    new_entity_name, with_description_tokens(new_node_data, tokenizer)
                 )
 
                 # Store relationships that need to be updated
@@ -269,7 +270,7 @@ async def aedit_entity(
             else:
                 # If not renaming, directly update node data
                 await chunk_entity_relation_graph.upsert_node(
-                    entity_name, new_node_data
+                    entity_name, with_description_tokens(new_node_data, tokenizer)
                 )
 
             # 3. Recalculate entity's vector representation and update vector database
@@ -351,6 +352,7 @@ async def aedit_relation(
     Returns:
         Dictionary containing updated relation information
     """
+    tokenizer = chunk_entity_relation_graph.global_config["tokenizer"]
     graph_db_lock = get_graph_db_lock(enable_logging=False)
     # Use graph database lock to ensure atomic graph and vector db operations
     async with graph_db_lock:
@@ -376,7 +378,9 @@ async def aedit_relation(
             )
 
             # 2. Update relation information in the graph
-            new_edge_data = {**edge_data, **updated_data}
+            new_edge_data = with_description_tokens(
+                {**edge_data, **updated_data}, tokenizer
+            )
             await chunk_entity_relation_graph.upsert_edge(
                 source_entity, target_entity, new_edge_data
             )
@@ -465,6 +469,7 @@ async def acreate_entity(
     Returns:
         Dictionary containing created entity information
     """
+    tokenizer = chunk_entity_relation_graph.global_config["tokenizer"]
     graph_db_lock = get_graph_db_lock(enable_logging=False)
     # Use graph database lock to ensure atomic graph and vector db operations
     async with graph_db_lock:
@@ -483,7 +488,9 @@ async def acreate_entity(
             }
 
             # Add entity to knowledge graph
-            await chunk_entity_relation_graph.upsert_node(entity_name, node_data)
+            await chunk_entity_relation_graph.upsert_node(
+                entity_name, with_description_tokens(node_data, tokenizer)
+            )
 
             # Prepare content for entity
             description = node_data.get("description", "")
@@ -549,6 +556,7 @@ async def acreate_relation(
     Returns:
         Dictionary containing created relation information
     """
+    tokenizer = chunk_entity_relation_graph.global_config["tokenizer"]
     graph_db_lock = get_graph_db_lock(enable_logging=False)
     # Use graph database lock to ensure atomic graph and vector db operations
     async with graph_db_lock:
@@ -581,7 +589,7 @@ async def acreate_relation(
 
             # Add relation to knowledge graph
             await chunk_entity_relation_graph.upsert_edge(
-                source_entity, target_entity, edge_data
+                source_entity, target_entity, with_description_tokens(edge_data, tokenizer)
             )
 
             # Prepare content for embedding
@@ -667,6 +675,7 @@ async def amerge_entities(
     Returns:
         Dictionary containing the merged entity information
     """
+    tokenizer = chunk_entity_relation_graph.global_config["tokenizer"]
     graph_db_lock = get_graph_db_lock(enable_logging=False)
     # Use graph database lock to ensure atomic graph and vector db operations
     async with graph_db_lock:
@@ -734,6 +743,7 @@ async def amerge_entities(
 
             # 5. Create or update the target entity
             merged_entity_data["entity_id"] = target_entity
+            with_description_tokens(merged_entity_data, tokenizer)
             if not target_exists:
                 await chunk_entity_relation_graph.upsert_node(
                     target_entity, merged_entity_data
@@ -790,7 +800,9 @@ async def amerge_entities(
             # Apply relationship updates
             for rel_data in relation_updates.values():
                 await chunk_entity_relation_graph.upsert_edge(
-                    rel_data["src"], rel_data["tgt"], rel_data["data"]
+                    rel_data["src"],
+                    rel_data["tgt"],
+                    with_description_tokens(rel_data["data"], tokenizer),
                 )
                 logger.info(
                     f"Created or updated relationship: {rel_data['src']} -> {rel_data['tgt']}"